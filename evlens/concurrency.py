@@ -1,5 +1,8 @@
-from typing import List, Union, Any
+from typing import List, Union, Any, Dict, Iterator
+from collections import deque
 import math
+import sys
+import asyncio
 
 import multiprocessing
 import numpy as np
@@ -17,7 +20,7 @@ def parse_n_jobs(n_jobs: Union[int, None]) -> int:
     how many jobs should be run in parallel. If None, returns the number of
     available CPUs minus one so the parent process has a CPU to itself.
     '''
-    num_cpus = multiprocessing.cpu_count() - 1
+    num_cpus = max(1, multiprocessing.cpu_count() - 1)
     if  n_jobs == -1 or n_jobs is None:
         n_jobs = num_cpus
     elif n_jobs > num_cpus:
@@ -30,6 +33,97 @@ def parse_n_jobs(n_jobs: Union[int, None]) -> int:
     return n_jobs
 
 
+class AIMDLimiter:
+    '''
+    Asyncio concurrency cap that follows what an upstream host will tolerate, TCP-style: the cap grows additively while responses are healthy and is cut multiplicatively on throttling (429), server errors (5xx), or timeouts.
+    '''
+    def __init__(
+        self,
+        initial_limit: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 512,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0
+    ):
+        '''
+        Parameters
+        ----------
+        initial_limit : int, optional
+            Concurrent requests allowed to start with, by default 16
+        min_limit : int, optional
+            Floor for the cap, by default 1
+        max_limit : int, optional
+            Ceiling for the cap, by default 512
+        increase : float, optional
+            How much the cap grows after a full cap's worth of healthy responses (i.e. roughly once per round trip), by default 1.0
+        decrease_factor : float, optional
+            Multiplier applied to the cap on backoff, by default 0.5
+        cooldown : float, optional
+            Minimum seconds between two backoffs, so a burst of failures from requests that were all in flight together only counts once, by default 1.0
+        '''
+        if not 0 < decrease_factor < 1:
+            raise ValueError("`decrease_factor` must be between 0 and 1")
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("Limits must satisfy 1 <= min_limit <= initial_limit <= max_limit")
+        
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = None
+        self._condition = None
+        
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+        
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so it binds to whichever event loop is running
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+        
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+            
+    async def release(self, healthy: bool = True):
+        '''
+        Frees up a slot and adjusts the cap based on how the request went.
+
+        Parameters
+        ----------
+        healthy : bool, optional
+            True if the upstream responded normally (including 4xx other than 429), False if it throttled, errored, or timed out, by default True
+        '''
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if healthy:
+                self.limit = min(
+                    self.max_limit,
+                    self.limit + self.increase / self.current_limit
+                )
+            else:
+                self._back_off()
+            condition.notify_all()
+            
+    def _back_off(self):
+        now = asyncio.get_running_loop().time()
+        if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+            return
+        
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        logger.info("Backing off, concurrency limit now %s", self.current_limit)
+
+
 def get_batches_by_worker(
     data: Any,
     n_jobs: int,
@@ -81,6 +175,176 @@ def get_batch_indices_from_identifiers(
     return last_ones.index.tolist()
     
 
+def get_chunks(data: Any, chunk_size: int) -> List[Any]:
+    '''
+    Splits `data` into consecutive chunks of at most `chunk_size` items, for handing out to workers one at a time.
+    '''
+    if chunk_size < 1:
+        raise ValueError("`chunk_size` must be a positive integer")
+    if hasattr(data, 'iloc'):
+        return [data.iloc[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+class ChunkResult:
+    '''
+    Outcome of one chunk of work from `parallelized_data_processing(chunk_size=...)`: either what the actor's `run()` returned or the error it raised.
+    '''
+    def __init__(
+        self,
+        chunk_index: int,
+        inputs: Any,
+        result: Any = None,
+        error: Exception = None
+    ):
+        self.chunk_index = chunk_index
+        self.inputs = inputs
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        status = 'ok' if self.ok else f"error={type(self.error).__name__}"
+        return f"ChunkResult(chunk_index={self.chunk_index}, num_inputs={len(self.inputs)}, {status})"
+
+
+def _result_nbytes(result: Any) -> int:
+    '''
+    Rough in-memory size of a `run()` result, e.g. a tuple of DataFrames.
+    '''
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    if isinstance(result, (list, tuple)):
+        return sum(_result_nbytes(r) for r in result)
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    return sys.getsizeof(result)
+
+
+class _ChunkQueue:
+    '''
+    Bookkeeping for `_iter_chunk_results()`: which chunks are left, which actors are free, and what's running on them.
+    '''
+    def __init__(
+        self,
+        actor: Any,
+        parallel_actors: List[Any],
+        chunks: List[Any],
+        run_kwargs: Dict[str, Any],
+        actor_kwargs: Dict[str, Any],
+        max_in_flight_bytes: int = None
+    ):
+        self.actor = actor
+        self.parallel_actors = parallel_actors
+        self.chunks = chunks
+        self.run_kwargs = run_kwargs
+        self.actor_kwargs = actor_kwargs
+        self.max_in_flight_bytes = max_in_flight_bytes
+
+        self.pending = deque(range(len(chunks)))
+        self.idle_actors = deque(range(len(parallel_actors)))
+        self.in_flight = dict()
+        self.num_measured = 0
+        self.bytes_measured = 0
+
+    def can_dispatch(self) -> bool:
+        if not self.pending or not self.idle_actors:
+            return False
+        # Always keep one chunk running, but until a result comes back there's nothing to estimate more from
+        if self.max_in_flight_bytes is None or not self.in_flight:
+            return True
+        if self.num_measured == 0:
+            return False
+        estimate = (len(self.in_flight) + 1) * self.bytes_measured / self.num_measured
+        return estimate <= self.max_in_flight_bytes
+
+    def dispatch(self):
+        while self.can_dispatch():
+            actor_index = self.idle_actors.popleft()
+            chunk_index = self.pending.popleft()
+            task = self.parallel_actors[actor_index].run.remote(self.chunks[chunk_index], **self.run_kwargs)
+            self.in_flight[task] = (chunk_index, actor_index)
+
+    def replace_actor(self, actor_index: int):
+        # Ray already used up the actor's restarts, so swap in a fresh one for the remaining chunks
+        self.parallel_actors[actor_index] = self.actor.remote(**self.actor_kwargs)
+
+    def collect(self, task: Any) -> ChunkResult:
+        '''
+        Takes a finished task out of flight, returning its result and freeing up its actor.
+        '''
+        chunk_index, actor_index = self.in_flight.pop(task)
+        inputs = self.chunks[chunk_index]
+        try:
+            result = ChunkResult(chunk_index, inputs, result=ray.get(task))
+            self.num_measured += 1
+            self.bytes_measured += _result_nbytes(result.result)
+
+        except ray.exceptions.RayActorError as e:
+            logger.error("Actor %s died on chunk %s, replacing it", actor_index, chunk_index, exc_info=True)
+            result = ChunkResult(chunk_index, inputs, error=e)
+            self.replace_actor(actor_index)
+
+        except ray.exceptions.RayTaskError as e:
+            logger.error("Chunk %s failed on actor %s", chunk_index, actor_index, exc_info=True)
+            result = ChunkResult(chunk_index, inputs, error=e)
+
+        self.idle_actors.append(actor_index)
+        return result
+
+
+def _iter_chunk_results(
+    actor: Any,
+    parallel_actors: List[Any],
+    chunks: List[Any],
+    run_kwargs: Dict[str, Any],
+    actor_kwargs: Dict[str, Any],
+    max_in_flight_bytes: int = None
+) -> Iterator[ChunkResult]:
+    '''
+    Hands chunks out one at a time to whichever actor finishes first, yielding each chunk's result as soon as it's done.
+
+    If `max_in_flight_bytes` is given, only one chunk is run until its result gives a size to estimate from, then fewer chunks are kept running at once when the results seen so far suggest they'd add up to more than that.
+
+    If the caller stops iterating early, chunks still running are waited on (and their results dropped) so the actors are free for whatever is handed to them next.
+    '''
+    queue = _ChunkQueue(actor, parallel_actors, chunks, run_kwargs, actor_kwargs, max_in_flight_bytes)
+    queue.dispatch()
+    num_done = 0
+    try:
+        while queue.in_flight:
+            [task], _ = ray.wait(list(queue.in_flight.keys()), num_returns=1)
+            result = queue.collect(task)
+
+            # Keep the actors busy while the caller deals with this result
+            queue.dispatch()
+
+            num_done += 1
+            logger.info("%s of %s chunks done", num_done, len(chunks))
+            yield result
+
+    finally:
+        if queue.in_flight:
+            # Running actor tasks can't be interrupted, and warm actors would otherwise
+            # only start the next job's chunks once these are done anyway
+            logger.warning("Stopped early, waiting on %s chunks still running", len(queue.in_flight))
+            ray.wait(list(queue.in_flight.keys()), num_returns=len(queue.in_flight))
+
+
+def _process_chunks(
+    actor: Any,
+    parallel_actors: List[Any],
+    chunks: List[Any],
+    run_kwargs: Dict[str, Any],
+    actor_kwargs: Dict[str, Any]
+) -> List[ChunkResult]:
+    results = list(_iter_chunk_results(actor, parallel_actors, chunks, run_kwargs, actor_kwargs))
+    return sorted(results, key=lambda r: r.chunk_index)
+
+
 #TODO: make it so you don't need to assume `run()` method name and can feed run()-ish method more than one arg
 #TODO: enable different kwarg config for each actor
 def parallelized_data_processing(
@@ -88,8 +352,41 @@ def parallelized_data_processing(
     run_args: List[Any],
     n_jobs: int = -1,
     checkpoint_indices: List[Any] = None,
+    chunk_size: int = None,
+    run_kwargs: Dict[str, Any] = None,
     **kwargs
-) -> pd.DataFrame:
+) -> Union[List[Any], List[ChunkResult]]:
+    '''
+    Runs `actor.run()` over `run_args` across a pool of `n_jobs` Ray actors.
+
+    By default `run_args` is split into one contiguous batch per actor up front. If `chunk_size` is given, it's instead split into small chunks that are handed out to actors as they free up, so a slow region or a crashed browser only holds up its own chunk rather than the whole job.
+
+    Parameters
+    ----------
+    actor : Any
+        Ray actor class with a `run()` method taking a batch of `run_args`
+    run_args : List[Any]
+        Inputs to process
+    n_jobs : int, optional
+        Number of actors. -1 uses all but one CPU, by default -1
+    checkpoint_indices : List[Any], optional
+        Index values per batch to resume after (see `get_batch_indices_from_identifiers()`). Only for the default batch mode, by default None
+    chunk_size : int, optional
+        If given, size of the chunks handed out one at a time, by default None
+    run_kwargs : Dict[str, Any], optional
+        Extra keyword arguments for every `run()` call. In chunk mode, actors with a `quit()` method (the scrapers) are passed `close_when_done=False` by default so their browser survives between chunks, and are told to quit at the end, by default None
+    kwargs
+        Passed to each actor on instantiation
+
+    Returns
+    -------
+    Union[List[Any], List[ChunkResult]]
+        In batch mode, what each actor's `run()` returned. In chunk mode, one ChunkResult per chunk in input order, failures included rather than raised.
+    '''
+    if chunk_size is not None and checkpoint_indices is not None:
+        raise ValueError("`checkpoint_indices` can't be used with `chunk_size`")
+    if run_kwargs is None:
+        run_kwargs = dict()
     
     # Just in case
     ray.shutdown()
@@ -101,6 +398,32 @@ def parallelized_data_processing(
         include_dashboard=False
     )
     
+    if chunk_size is not None:
+        chunks = get_chunks(run_args, chunk_size)
+        parallel_actors = [actor.remote(**kwargs) for _ in range(min(n_jobs, len(chunks)))]
+        logger.info(
+            "Handing out %s chunks of up to %s to %s actors",
+            len(chunks),
+            chunk_size,
+            len(parallel_actors)
+        )
+        # Actors that can be told to quit are scrapers, keep their browsers open between chunks
+        keep_open = hasattr(parallel_actors[0], 'quit') if parallel_actors else False
+        if keep_open:
+            run_kwargs = {'close_when_done': False, **run_kwargs}
+        try:
+            results = _process_chunks(actor, parallel_actors, chunks, run_kwargs, kwargs)
+            # Now that they're done, let the scrapers close their browsers
+            if keep_open:
+                ray.get([a.quit.remote() for a in parallel_actors])
+        finally:
+            ray.shutdown()
+
+        num_failed = sum(not r.ok for r in results)
+        if num_failed > 0:
+            logger.error("%s of %s chunks failed", num_failed, len(results))
+        return results
+    
     # Batch up in n_actors-sized batches across all run_args
     run_arg_batches = get_batches_by_worker(
         run_args,
@@ -118,7 +441,7 @@ def parallelized_data_processing(
     )
     try:    
         results = ray.get([
-            parallel_actors[i].run.remote(batch) for i, batch in enumerate(run_arg_batches)
+            parallel_actors[i].run.remote(batch, **run_kwargs) for i, batch in enumerate(run_arg_batches)
         ])
     except (ray.exceptions.RayTaskError, ray.exceptions.RayActorError) as e:
         logger.error("Ray had an error. See the dashboard for more information.")
@@ -128,4 +451,238 @@ def parallelized_data_processing(
     # Make sure we have no ray processes already running
     ray.shutdown()
     
-    return results
\ No newline at end of file
+    return results
+
+def iter_parallelized_data_processing(
+    actor: Any,
+    run_args: List[Any],
+    n_jobs: int = -1,
+    chunk_size: int = 100,
+    max_in_flight_bytes: int = None,
+    run_kwargs: Dict[str, Any] = None,
+    **kwargs
+) -> Iterator[ChunkResult]:
+    '''
+    Streaming version of `parallelized_data_processing(chunk_size=...)`: yields each chunk's result as soon as it's done rather than returning everything at the end, so results can be written out while the rest are still being scraped and the driver only ever holds a few chunks' worth.
+
+    Parameters
+    ----------
+    actor : Any
+        Ray actor class with a `run()` method taking a batch of `run_args`
+    run_args : List[Any]
+        Inputs to process
+    n_jobs : int, optional
+        Number of actors. -1 uses all but one CPU, by default -1
+    chunk_size : int, optional
+        Number of inputs per chunk, by default 100
+    max_in_flight_bytes : int, optional
+        Cap on the (estimated) size of results being produced at once. Only one chunk is run until the first result comes back, then fewer chunks are kept running if the average result size says they'd go over. If None, every actor is always kept busy, by default None
+    run_kwargs : Dict[str, Any], optional
+        Extra keyword arguments for every `run()` call, by default None
+    kwargs
+        Passed to each actor on instantiation
+
+    Yields
+    ------
+    ChunkResult
+        One per chunk, in the order they finish
+    '''
+    if run_kwargs is None:
+        run_kwargs = dict()
+
+    ray.shutdown()
+    n_jobs = parse_n_jobs(n_jobs)
+    ray.init(
+        num_cpus=n_jobs,
+        include_dashboard=False
+    )
+
+    chunks = get_chunks(run_args, chunk_size)
+    parallel_actors = [actor.remote(**kwargs) for _ in range(min(n_jobs, len(chunks)))]
+    keep_open = hasattr(parallel_actors[0], 'quit') if parallel_actors else False
+    if keep_open:
+        run_kwargs = {'close_when_done': False, **run_kwargs}
+
+    try:
+        yield from _iter_chunk_results(
+            actor,
+            parallel_actors,
+            chunks,
+            run_kwargs,
+            kwargs,
+            max_in_flight_bytes=max_in_flight_bytes
+        )
+        if keep_open:
+            ray.get([a.quit.remote() for a in parallel_actors])
+    finally:
+        ray.shutdown()
+
+
+class ScraperSession:
+    '''
+    Pool of long-lived Ray actors (e.g. scrapers with their browsers already open) that can be handed any number of jobs, instead of paying for Ray and Chrome startup on every `parallelized_data_processing()` call.
+
+    Attaches to whatever Ray runtime is already running (or the cluster at `address`) and only shuts down when `shutdown()` is called or the `with` block exits.
+
+    Example
+    -------
+    with ScraperSession(ParallelMainMapScraper, n_jobs=4, headless=True) as session:
+        session.submit(location_ids_today)
+        session.submit(location_ids_retry, chunk_size=50)
+    '''
+    def __init__(
+        self,
+        actor: Any,
+        n_jobs: int = -1,
+        address: str = None,
+        ray_init_kwargs: Dict[str, Any] = None,
+        **kwargs
+    ):
+        '''
+        Parameters
+        ----------
+        actor : Any
+            Ray actor class with a `run()` method taking a batch of inputs
+        n_jobs : int, optional
+            Number of actors to keep warm. -1 uses all but one local CPU, or every CPU of the cluster when connecting to one by `address`, by default -1
+        address : str, optional
+            Address of a running Ray cluster to connect to (e.g. "ray://head-node:10001" or "auto"). If None and Ray isn't already initialized in this process, starts a local runtime, by default None
+        ray_init_kwargs : Dict[str, Any], optional
+            Extra arguments for `ray.init()` if the session has to initialize Ray itself, by default None
+        kwargs
+            Passed to each actor on instantiation
+        '''
+        self.actor = actor
+        self.n_jobs = n_jobs
+        self.address = address
+        self.ray_init_kwargs = ray_init_kwargs or dict()
+        self.actor_kwargs = kwargs
+        self.actors = []
+        self._owns_runtime = False
+        self._keep_open = False
+
+    def start(self) -> 'ScraperSession':
+        '''
+        Connects to (or starts) Ray and spins up the actors. Called automatically by `submit()` and on entering a `with` block.
+        '''
+        if self.actors:
+            return self
+
+        if not ray.is_initialized():
+            if self.address is not None:
+                ray.init(address=self.address, **self.ray_init_kwargs)
+            else:
+                ray.init(
+                    num_cpus=parse_n_jobs(self.n_jobs),
+                    include_dashboard=False,
+                    **self.ray_init_kwargs
+                )
+            self._owns_runtime = True
+        else:
+            logger.info("Attaching to the Ray runtime already running")
+
+        if self.n_jobs == -1 and (self.address is not None or not self._owns_runtime):
+            n_jobs = max(1, int(ray.cluster_resources().get('CPU', 1)))
+        else:
+            n_jobs = parse_n_jobs(self.n_jobs)
+
+        self.actors = [self.actor.remote(**self.actor_kwargs) for _ in range(n_jobs)]
+        # Actors that can be told to quit are scrapers, keep their browsers open between jobs
+        self._keep_open = hasattr(self.actors[0], 'quit')
+        logger.info("Started %s warm actors", n_jobs)
+        return self
+
+    def submit(
+        self,
+        run_args: List[Any],
+        chunk_size: int = None,
+        run_kwargs: Dict[str, Any] = None
+    ) -> Union[List[Any], List[ChunkResult]]:
+        '''
+        Runs one job on the warm actors. Same modes and outputs as `parallelized_data_processing()`, but nothing is started or torn down.
+
+        Parameters
+        ----------
+        run_args : List[Any]
+            Inputs to process
+        chunk_size : int, optional
+            If given, hands the inputs out in chunks of this size as actors free up. Otherwise splits them into one batch per actor, by default None
+        run_kwargs : Dict[str, Any], optional
+            Extra keyword arguments for every `run()` call, by default None
+
+        Returns
+        -------
+        Union[List[Any], List[ChunkResult]]
+            In batch mode, what each actor's `run()` returned. In chunk mode, one ChunkResult per chunk in input order.
+        '''
+        self.start()
+        if run_kwargs is None:
+            run_kwargs = dict()
+        if self._keep_open:
+            run_kwargs = {'close_when_done': False, **run_kwargs}
+
+        if chunk_size is not None:
+            chunks = get_chunks(run_args, chunk_size)
+            logger.info("Handing out %s chunks of up to %s to %s actors", len(chunks), chunk_size, len(self.actors))
+            return _process_chunks(self.actor, self.actors, chunks, run_kwargs, self.actor_kwargs)
+
+        batches = get_batches_by_worker(run_args, len(self.actors))
+        logger.info("Generated %s batches of sizes %s", len(batches), [len(batch) for batch in batches])
+        try:
+            return ray.get([a.run.remote(batch, **run_kwargs) for a, batch in zip(self.actors, batches)])
+        except (ray.exceptions.RayTaskError, ray.exceptions.RayActorError) as e:
+            logger.error("Ray had an error. See the dashboard for more information.")
+            raise e
+
+    def iter_submit(
+        self,
+        run_args: List[Any],
+        chunk_size: int = 100,
+        max_in_flight_bytes: int = None,
+        run_kwargs: Dict[str, Any] = None
+    ) -> Iterator[ChunkResult]:
+        '''
+        Streaming version of `submit()`, see `iter_parallelized_data_processing()`. Stopping early (e.g. `break`ing out of the loop and closing the generator) waits for the chunks still running, so the actors are free for the next job.
+
+        Yields
+        ------
+        ChunkResult
+            One per chunk, in the order they finish
+        '''
+        self.start()
+        if run_kwargs is None:
+            run_kwargs = dict()
+        if self._keep_open:
+            run_kwargs = {'close_when_done': False, **run_kwargs}
+
+        yield from _iter_chunk_results(
+            self.actor,
+            self.actors,
+            get_chunks(run_args, chunk_size),
+            run_kwargs,
+            self.actor_kwargs,
+            max_in_flight_bytes=max_in_flight_bytes
+        )
+
+    def shutdown(self):
+        '''
+        Closes the actors' browsers, kills the actors, and shuts Ray down if this session started it.
+        '''
+        if self._keep_open and self.actors:
+            try:
+                ray.get([a.quit.remote() for a in self.actors])
+            except (ray.exceptions.RayTaskError, ray.exceptions.RayActorError):
+                logger.error("Couldn't cleanly quit every actor", exc_info=True)
+        for a in self.actors:
+            ray.kill(a)
+        self.actors = []
+
+        if self._owns_runtime:
+            ray.shutdown()
+            self._owns_runtime = False
+
+    def __enter__(self) -> 'ScraperSession':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.shutdown()
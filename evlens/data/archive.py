@@ -0,0 +1,320 @@
+from typing import Tuple, Dict, Iterator, Union, List
+import os
+import re
+import socket
+import struct
+import zlib
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# kind, key length, compressed body length, CRC32 of the compressed body
+RECORD_HEADER = struct.Struct('>BHII')
+RECORD_KINDS = ['location', 'region']
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+
+class ResponseArchive:
+    '''
+    Append-only, compressed archive of raw PlugShare API response bodies so the tables can be re-derived offline (e.g. after a parser fix) without re-scraping.
+
+    Each writer (one per process by default) appends to its own rotating segment files of length-prefixed, zlib-compressed records and to its own index file mapping (kind, key) to (segment, offset). Many workers can share one directory without any locking.
+    '''
+    def __init__(
+        self,
+        directory: str,
+        writer_id: str = None,
+        segment_max_bytes: int = 256 * 1024**2,
+        compression_level: int = 6
+    ):
+        '''
+        Parameters
+        ----------
+        directory : str
+            Local directory holding the segment and index files. Created if it doesn't exist.
+        writer_id : str, optional
+            Prefix for this writer's files. Must be unique among processes writing to `directory` at the same time. If None, uses "<hostname>-<pid>", by default None
+        segment_max_bytes : int, optional
+            Size at which the current segment is closed and a new one started, by default 256 MB
+        compression_level : int, optional
+            zlib compression level (1 is fastest, 9 is smallest), by default 6
+        '''
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        if writer_id is None:
+            writer_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.writer_id = writer_id
+        self.segment_max_bytes = segment_max_bytes
+        self.compression_level = compression_level
+
+        self._segment_file = None
+        self._segment_name = None
+        self._index_file = None
+        self._read_files = dict()
+        self.index: Dict[Tuple[str, str], Tuple[str, int]] = None
+
+    def _writer_segments(self) -> List[str]:
+        pattern = re.compile(re.escape(self.writer_id) + r'-(\d+)' + re.escape(SEGMENT_SUFFIX) + '$')
+        return sorted(f for f in os.listdir(self.directory) if pattern.match(f))
+
+    def _open_segment(self, segment_name: str):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_name = segment_name
+        self._segment_file = open(os.path.join(self.directory, segment_name), 'ab')
+
+    def _valid_length(self, segment_name: str) -> int:
+        '''
+        Bytes of a segment up to the end of its last intact record.
+        '''
+        with open(os.path.join(self.directory, segment_name), 'rb', buffering=1024**2) as f:
+            length = 0
+            while self._read_record(f, segment_name) is not None:
+                length = f.tell()
+        return length
+
+    def _open_for_writing(self):
+        segments = self._writer_segments()
+        if len(segments) > 0:
+            # A writer that crashed mid-append (with this writer ID) leaves a torn record at the end,
+            # which would hide everything appended after it from sequential reads
+            path = os.path.join(self.directory, segments[-1])
+            length = self._valid_length(segments[-1])
+            if length < os.path.getsize(path):
+                logger.warning(
+                    "Truncating %s bytes of torn records from the end of archive segment %s",
+                    os.path.getsize(path) - length,
+                    segments[-1]
+                )
+                os.truncate(path, length)
+            self._open_segment(segments[-1])
+        else:
+            self._open_segment(f"{self.writer_id}-{0:06d}{SEGMENT_SUFFIX}")
+        index_path = os.path.join(self.directory, self.writer_id + INDEX_SUFFIX)
+        self._index_file = open(index_path, 'a', encoding='utf-8')
+        # Likewise a torn last index line, which the next line must not be glued onto
+        if self._index_file.tell() > 0:
+            with open(index_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._index_file.write('\n')
+
+    def _rotate(self):
+        sequence = int(self._segment_name[len(self.writer_id) + 1:-len(SEGMENT_SUFFIX)]) + 1
+        logger.debug("Rotating archive segment %s", self._segment_name)
+        self._open_segment(f"{self.writer_id}-{sequence:06d}{SEGMENT_SUFFIX}")
+
+    def append(
+        self,
+        kind: str,
+        key: str,
+        body: Union[str, bytes]
+    ) -> Tuple[str, int]:
+        '''
+        Writes one response body to the end of the current segment and indexes it.
+
+        Parameters
+        ----------
+        kind : str
+            One of RECORD_KINDS, e.g. 'location' for `v3/locations/<id>` and 'region' for `v3/locations/region`
+        key : str
+            What the body is for, e.g. the location ID or search cell ID. If the same (kind, key) is appended more than once, reads return the latest.
+        body : Union[str, bytes]
+            Raw (decoded) response body
+
+        Returns
+        -------
+        Tuple[str, int]
+            Segment file name and byte offset the record was written at
+        '''
+        if kind not in RECORD_KINDS:
+            raise ValueError(f"`kind` must be one of {RECORD_KINDS}, got '{kind}'")
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        key = str(key)
+        if '\t' in key or '\n' in key:
+            raise ValueError("`key` can't contain tabs or newlines")
+
+        if self._segment_file is None:
+            self._open_for_writing()
+        elif self._segment_file.tell() >= self.segment_max_bytes:
+            self._rotate()
+
+        key_bytes = key.encode('utf-8')
+        compressed = zlib.compress(body, self.compression_level)
+        offset = self._segment_file.tell()
+        self._segment_file.write(
+            RECORD_HEADER.pack(
+                RECORD_KINDS.index(kind),
+                len(key_bytes),
+                len(compressed),
+                zlib.crc32(compressed)
+            )
+            + key_bytes
+            + compressed
+        )
+        # Only index records that have made it out of our buffers
+        self._segment_file.flush()
+        self._index_file.write(f"{kind}\t{key}\t{self._segment_name}\t{offset}\n")
+        self._index_file.flush()
+
+        if self.index is not None:
+            self.index[(kind, key)] = (self._segment_name, offset)
+
+        return self._segment_name, offset
+
+    def close(self):
+        '''
+        Closes any open files. The archive can keep being used afterwards, files are reopened as needed.
+        '''
+        for f in [self._segment_file, self._index_file] + list(self._read_files.values()):
+            if f is not None:
+                f.close()
+        self._segment_file = None
+        self._segment_name = None
+        self._index_file = None
+        self._read_files = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def load_index(self) -> Dict[Tuple[str, str], Tuple[str, int]]:
+        '''
+        (Re)reads every writer's index file, e.g. to pick up records appended by other processes.
+        '''
+        index = dict()
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(INDEX_SUFFIX):
+                continue
+            with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    # A torn last line from a crashed writer
+                    if len(fields) != 4:
+                        continue
+                    kind, key, segment_name, offset = fields
+                    index[(kind, key)] = (segment_name, int(offset))
+        self.index = index
+        return index
+
+    def rebuild_index(self) -> Dict[Tuple[str, str], Tuple[str, int]]:
+        '''
+        Recreates every writer's index file by scanning the segments, for when index files are lost or out of date.
+        '''
+        self.close()
+        index_lines = dict()
+        for segment_name, offset, kind, key, _ in self._scan():
+            writer_id = segment_name.rsplit('-', 1)[0]
+            index_lines.setdefault(writer_id, []).append(f"{kind}\t{key}\t{segment_name}\t{offset}\n")
+
+        for filename in os.listdir(self.directory):
+            if filename.endswith(INDEX_SUFFIX):
+                os.remove(os.path.join(self.directory, filename))
+        for writer_id, lines in index_lines.items():
+            with open(os.path.join(self.directory, writer_id + INDEX_SUFFIX), 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+
+        return self.load_index()
+
+    def _read_record(self, f, segment_name: str) -> Tuple[str, str, bytes]:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        kind_code, key_length, body_length, checksum = RECORD_HEADER.unpack(header)
+        key_bytes = f.read(key_length)
+        compressed = f.read(body_length)
+        if len(compressed) < body_length or zlib.crc32(compressed) != checksum:
+            logger.warning("Truncated or corrupt record in archive segment %s", segment_name)
+            return None
+        return RECORD_KINDS[kind_code], key_bytes.decode('utf-8'), compressed
+
+    def get(self, kind: str, key: str) -> bytes:
+        '''
+        Random read of the latest body archived for (kind, key).
+
+        Returns
+        -------
+        bytes
+            The response body, or None if it isn't in the archive
+        '''
+        if self.index is None:
+            self.load_index()
+        location = self.index.get((kind, str(key)))
+        if location is None:
+            return None
+
+        segment_name, offset = location
+        if segment_name == self._segment_name:
+            self._segment_file.flush()
+        if segment_name not in self._read_files:
+            self._read_files[segment_name] = open(os.path.join(self.directory, segment_name), 'rb')
+        f = self._read_files[segment_name]
+        f.seek(offset)
+        record = self._read_record(f, segment_name)
+        if record is None:
+            return None
+        return zlib.decompress(record[2])
+
+    def keys(self, kind: str = None) -> List[str]:
+        if self.index is None:
+            self.load_index()
+        return [k for record_kind, k in self.index if kind is None or record_kind == kind]
+
+    def segments(self) -> List[str]:
+        return sorted(f for f in os.listdir(self.directory) if f.endswith(SEGMENT_SUFFIX))
+
+    def _scan(self, segments: List[str] = None) -> Iterator[Tuple[str, int, str, str, bytes]]:
+        if self._segment_file is not None:
+            self._segment_file.flush()
+        if segments is None:
+            segments = self.segments()
+        for segment_name in segments:
+            with open(os.path.join(self.directory, segment_name), 'rb', buffering=1024**2) as f:
+                while True:
+                    offset = f.tell()
+                    record = self._read_record(f, segment_name)
+                    if record is None:
+                        break
+                    yield (segment_name, offset) + record
+
+    def iter_records(
+        self,
+        kind: str = None,
+        latest_only: bool = True,
+        segments: List[str] = None
+    ) -> Iterator[Tuple[str, str, bytes]]:
+        '''
+        Sequential read of the whole archive, segment by segment, without going through the index for each record.
+
+        Parameters
+        ----------
+        kind : str, optional
+            Only yield records of this kind. If None, yields every kind, by default None
+        latest_only : bool, optional
+            If True, skips records that were superseded by a later append for the same (kind, key), according to the index, by default True
+        segments : List[str], optional
+            Only read these segment files, e.g. to split a reparse across workers. If None, reads them all, by default None
+
+        Yields
+        ------
+        Tuple[str, str, bytes]
+            (kind, key, body) for each record
+        '''
+        if latest_only:
+            index = self.load_index()
+        for segment_name, offset, record_kind, key, compressed in self._scan(segments):
+            if kind is not None and record_kind != kind:
+                continue
+            if latest_only and index.get((record_kind, key)) != (segment_name, offset):
+                continue
+            yield record_kind, key, zlib.decompress(compressed)
+
+    def __len__(self) -> int:
+        if self.index is None:
+            self.load_index()
+        return len(self.index)
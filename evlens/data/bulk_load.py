@@ -0,0 +1,228 @@
+from typing import List, Dict, Tuple, Union
+from uuid import uuid4
+import os
+import shutil
+import tempfile
+
+from google.cloud import storage
+import pandas as pd
+
+from evlens.data.google_cloud import BigQuery, get_storage_client, MAX_URIS_PER_LOAD_JOB
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+STAGED_FILE_SUFFIX = '.parquet'
+# Marks staged files that are plain appends rather than merges
+NO_MERGE_COLUMNS = '_append'
+
+
+class GCSStagingBucket:
+    '''
+    GCS bucket that staged load files are uploaded to and loaded from.
+    '''
+    def __init__(self, bucket_name: str = 'plugshare_scraping'):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self) -> storage.Bucket:
+        # Lazy so that the stager can be pickled over to Ray actors
+        if self._bucket is None:
+            self._bucket = get_storage_client().bucket(self.bucket_name)
+        return self._bucket
+
+    def upload(self, local_path: str, blob_name: str) -> str:
+        self.bucket.blob(blob_name).upload_from_filename(local_path, if_generation_match=0)
+        return self.uri(blob_name)
+
+    def list(self, prefix: str) -> List[str]:
+        return sorted(b.name for b in self.bucket.list_blobs(prefix=prefix))
+
+    def delete(self, blob_names: List[str]):
+        for blob_name in blob_names:
+            self.bucket.blob(blob_name).delete()
+
+    def uri(self, blob_name: str) -> str:
+        return f"gs://{self.bucket_name}/{blob_name}"
+
+
+class LocalStagingBucket:
+    '''
+    Local-filesystem stand-in for `GCSStagingBucket`, e.g. for testing. URIs are plain file paths, so BigQuery itself can't load from it, but a `LocalWarehouse` can.
+    '''
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, local_path: str, blob_name: str) -> str:
+        path = os.path.join(self.directory, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy then rename so loads never see half-written files
+        shutil.copyfile(local_path, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return self.uri(blob_name)
+
+    def list(self, prefix: str) -> List[str]:
+        blob_names = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                blob_name = os.path.relpath(os.path.join(root, filename), self.directory)
+                if blob_name.startswith(prefix):
+                    blob_names.append(blob_name)
+        return sorted(blob_names)
+
+    def delete(self, blob_names: List[str]):
+        for blob_name in blob_names:
+            os.remove(os.path.join(self.directory, blob_name))
+
+    def uri(self, blob_name: str) -> str:
+        return os.path.abspath(os.path.join(self.directory, blob_name))
+
+
+class StagedBulkLoader:
+    '''
+    Bulk-load path into BigQuery: checkpoints are written as compressed Parquet files and staged in a bucket (cheap, and can be done by any number of workers), then every file staged for a table is loaded with one load job. That's one job per table per run instead of one (plus a dedupe query) per checkpoint per worker.
+
+    Staged files are named "<prefix>/<table>/<merge columns>/<uuid>.parquet" so whoever runs the load doesn't need to know what was staged or how it should be de-duplicated.
+    '''
+    def __init__(
+        self,
+        bucket: Union[GCSStagingBucket, LocalStagingBucket] = None,
+        prefix: str = 'staged_loads',
+        dataset_name: str = 'plugshare',
+        bq_client: BigQuery = None,
+        compression: str = 'zstd',
+        max_uris_per_job: int = MAX_URIS_PER_LOAD_JOB
+    ):
+        '''
+        Parameters
+        ----------
+        bucket : Union[GCSStagingBucket, LocalStagingBucket], optional
+            Where files are staged. If None, uses the 'plugshare_scraping' GCS bucket, by default None
+        prefix : str, optional
+            Blob name prefix for this loader's files, e.g. one per run so runs can be loaded separately, by default 'staged_loads'
+        dataset_name : str, optional
+            BigQuery dataset the tables are in, by default 'plugshare'
+        bq_client : BigQuery, optional
+            Client used by `load()`, e.g. a `LocalWarehouse` for files staged in a `LocalStagingBucket`. If None, one is created when first needed, by default None
+        compression : str, optional
+            Parquet compression codec, by default 'zstd'
+        max_uris_per_job : int, optional
+            Most staged files loaded by one load job. Tables with more staged files than this are loaded in several jobs, by default MAX_URIS_PER_LOAD_JOB
+        '''
+        if bucket is None:
+            bucket = GCSStagingBucket()
+        self.bucket = bucket
+        self.prefix = prefix.rstrip('/')
+        self.dataset_name = dataset_name
+        self._bq_client = bq_client
+        self.compression = compression
+        self.max_uris_per_job = max_uris_per_job
+
+    @property
+    def bq_client(self) -> BigQuery:
+        if self._bq_client is None:
+            self._bq_client = BigQuery(project='evlens')
+        return self._bq_client
+
+    def stage(
+        self,
+        df: pd.DataFrame,
+        table_name: str,
+        merge_columns: Union[str, List[str]] = None
+    ) -> str:
+        '''
+        Writes `df` to a compressed Parquet file and stages it for the next `load()` of `table_name`.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Rows to load, with columns matching the table's schema
+        table_name : str
+            Name of the target BQ table
+        merge_columns : Union[str, List[str]], optional
+            Column name(s) of the unique (composite) key. If provided, rows whose keys are already in the table are skipped at load time (see `BigQuery.merge_data()`), otherwise rows are appended, by default None
+
+        Returns
+        -------
+        str
+            URI of the staged file
+        '''
+        if isinstance(merge_columns, str):
+            merge_columns = [merge_columns]
+        merge_segment = NO_MERGE_COLUMNS if merge_columns is None else ','.join(merge_columns)
+        blob_name = f"{self.prefix}/{table_name}/{merge_segment}/{uuid4().hex}{STAGED_FILE_SUFFIX}"
+
+        with tempfile.TemporaryDirectory() as directory:
+            local_path = os.path.join(directory, 'staged' + STAGED_FILE_SUFFIX)
+            df.to_parquet(local_path, compression=self.compression, index=False)
+            uri = self.bucket.upload(local_path, blob_name)
+
+        logger.debug("Staged %s rows for '%s' at %s", len(df), table_name, uri)
+        return uri
+
+    def staged(self) -> Dict[Tuple[str, str], List[str]]:
+        '''
+        Blob names currently staged under this loader's prefix, grouped by (table name, merge columns).
+        '''
+        groups = dict()
+        for blob_name in self.bucket.list(self.prefix + '/'):
+            if not blob_name.endswith(STAGED_FILE_SUFFIX):
+                continue
+            parts = blob_name[len(self.prefix) + 1:].split('/')
+            if len(parts) != 3:
+                continue
+            table_name, merge_segment, _ = parts
+            groups.setdefault((table_name, merge_segment), []).append(blob_name)
+        return groups
+
+    def load(
+        self,
+        table_names: List[str] = None,
+        timeout: int = 600
+    ) -> Dict[str, int]:
+        '''
+        Loads everything staged into BigQuery with one load job per table (plus one MERGE for tables staged with merge columns), or one per `max_uris_per_job` files for tables with more staged than that, then deletes the staged files. Files that fail to load are left staged for the next attempt.
+
+        Parameters
+        ----------
+        table_names : List[str], optional
+            Only load these tables. If None, loads every table with staged files, by default None
+        timeout : int, optional
+            Seconds to wait on each load job, by default 600
+
+        Returns
+        -------
+        Dict[str, int]
+            Number of rows added to each table
+        '''
+        num_rows = dict()
+        for (table_name, merge_segment), blob_names in self.staged().items():
+            if table_names is not None and table_name not in table_names:
+                continue
+            merge_columns = None if merge_segment == NO_MERGE_COLUMNS else merge_segment.split(',')
+            if merge_columns is None:
+                # Appends aren't de-duplicated, so each batch is deleted as soon as it's in,
+                # rather than being loaded again if a later batch fails
+                batches = [
+                    blob_names[i:i + self.max_uris_per_job]
+                    for i in range(0, len(blob_names), self.max_uris_per_job)
+                ]
+            else:
+                batches = [blob_names]
+            for batch in batches:
+                uris = [self.bucket.uri(b) for b in batch]
+                num_rows[table_name] = num_rows.get(table_name, 0) + self.bq_client.load_from_uris(
+                    uris,
+                    self.dataset_name,
+                    table_name,
+                    merge_columns=merge_columns,
+                    max_uris_per_job=self.max_uris_per_job,
+                    timeout=timeout
+                )
+                self.bucket.delete(batch)
+        return num_rows
@@ -0,0 +1,295 @@
+from typing import Dict, Literal, Tuple
+from collections import Counter, OrderedDict
+from threading import Lock
+from time import monotonic
+from uuid import uuid4
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import traceback
+
+from evlens import get_current_datetime
+from evlens.data.google_cloud import get_background_uploader
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+SUPPRESSION_REASONS = ['duplicate', 'sampled', 'rate_limited']
+# Requests kept in a snapshot's network log, most recent last
+MAX_SNAPSHOT_REQUESTS = 50
+
+# (pid, savepath, bucket_name, mode): ErrorCapture, see `ErrorCapture.shared()`
+_SHARED: Dict[tuple, 'ErrorCapture'] = dict()
+_SHARED_LOCK = Lock()
+
+
+class ErrorCapture:
+    '''
+    Decides which scraping failures are worth capturing (as a screenshot or a compressed DOM/network snapshot) and uploads the ones that are, so an outage or page layout change doesn't turn into thousands of slow capture + upload cycles on every worker.
+
+    Each failure is given an error class (e.g. "checkin_parsing_error") and a fingerprint (error class, exception type, message with numbers stripped, and where it was raised). A failure is captured only if its fingerprint hasn't been captured recently, it passes its class' sample rate, and its class is under its rate limit. Everything else is tallied in `suppressed` instead.
+    '''
+    def __init__(
+        self,
+        savepath: str = None,
+        bucket_name: str = 'plugshare_scraping',
+        mode: Literal['screenshot', 'snapshot'] = 'screenshot',
+        sample_rates: Dict[str, float] = None,
+        default_sample_rate: float = 1.0,
+        max_per_minute: Dict[str, float] = None,
+        default_max_per_minute: float = 6,
+        dedupe_window: float = 3600,
+        max_fingerprints: int = 10_000,
+        seed: int = None
+    ):
+        '''
+        Parameters
+        ----------
+        savepath : str, optional
+            Local directory captures are written to (and uploaded from). Must be set for anything to be captured, by default None
+        bucket_name : str, optional
+            GCS bucket captures are uploaded to (under "errors/") in the background and then deleted locally. If None, captures are only kept locally, by default 'plugshare_scraping'
+        mode : Literal['screenshot', 'snapshot'], optional
+            'screenshot' saves a PNG of the page. 'snapshot' saves a gzipped JSON of the page's URL, title, DOM, and recent network requests, which is much cheaper to take and usually more useful for layout changes, by default 'screenshot'
+        sample_rates : Dict[str, float], optional
+            Fraction of failures to capture per error class, by default None
+        default_sample_rate : float, optional
+            Fraction for error classes not in `sample_rates`, by default 1.0
+        max_per_minute : Dict[str, float], optional
+            Most captures per minute per error class, by default None
+        default_max_per_minute : float, optional
+            Limit for error classes not in `max_per_minute`, by default 6
+        dedupe_window : float, optional
+            Seconds during which repeats of a captured fingerprint are skipped, by default 3600
+        max_fingerprints : int, optional
+            Most fingerprints remembered at once, oldest forgotten first, by default 10,000
+        seed : int, optional
+            Seed for sampling, by default None
+        '''
+        if mode not in ('screenshot', 'snapshot'):
+            raise ValueError(f"`mode` must be 'screenshot' or 'snapshot', got '{mode}'")
+        self.savepath = savepath
+        if savepath is not None:
+            os.makedirs(savepath, exist_ok=True)
+        self.bucket_name = bucket_name
+        self.mode = mode
+        self.sample_rates = sample_rates or dict()
+        self.default_sample_rate = default_sample_rate
+        self.max_per_minute = max_per_minute or dict()
+        self.default_max_per_minute = default_max_per_minute
+        self.dedupe_window = dedupe_window
+        self.max_fingerprints = max_fingerprints
+
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        # fingerprint: time last captured
+        self._fingerprints: OrderedDict = OrderedDict()
+        # error class: (tokens, time last refilled)
+        self._buckets: Dict[str, Tuple[float, float]] = dict()
+        self.captured = Counter()
+        # (error class, reason): count
+        self.suppressed = Counter()
+
+    @classmethod
+    def shared(
+        cls,
+        savepath: str = None,
+        bucket_name: str = 'plugshare_scraping',
+        mode: Literal['screenshot', 'snapshot'] = 'screenshot'
+    ) -> 'ErrorCapture':
+        '''
+        Returns this process's shared ErrorCapture for these settings, so that short-lived objects (e.g. one `CheckIn` per entry) share sampling and rate limits.
+        '''
+        key = (os.getpid(), savepath, bucket_name, mode)
+        with _SHARED_LOCK:
+            if key not in _SHARED:
+                _SHARED[key] = cls(savepath=savepath, bucket_name=bucket_name, mode=mode)
+            return _SHARED[key]
+
+    def __getstate__(self):
+        # Locks can't be pickled over to Ray actors
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @classmethod
+    def fingerprint(
+        cls,
+        error_class: str,
+        exception: BaseException = None
+    ) -> str:
+        '''
+        Identifies "the same failure": error class, exception type and message (with numbers such as IDs and coordinates stripped), and the file and line it was raised from.
+        '''
+        parts = [error_class]
+        if exception is not None:
+            parts.append(type(exception).__name__)
+            parts.append(re.sub(r'\d+', '#', str(exception))[:500])
+            frames = traceback.extract_tb(exception.__traceback__)
+            if len(frames) > 0:
+                parts.append(f"{os.path.basename(frames[-1].filename)}:{frames[-1].lineno}")
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+    def _take_token(self, error_class: str, now: float) -> bool:
+        limit = self.max_per_minute.get(error_class, self.default_max_per_minute)
+        tokens, last = self._buckets.get(error_class, (limit, now))
+        tokens = min(limit, tokens + (now - last) * limit / 60)
+        if tokens < 1:
+            self._buckets[error_class] = (tokens, now)
+            return False
+        self._buckets[error_class] = (tokens - 1, now)
+        return True
+
+    def should_capture(
+        self,
+        error_class: str,
+        exception: BaseException = None
+    ) -> bool:
+        '''
+        Decides whether a failure gets captured, counting it in `suppressed` if not.
+        '''
+        fingerprint = self.fingerprint(error_class, exception)
+        now = monotonic()
+        with self._lock:
+            reason = None
+            last_captured = self._fingerprints.get(fingerprint)
+            if last_captured is not None and now - last_captured < self.dedupe_window:
+                reason = 'duplicate'
+            elif self._random.random() >= self.sample_rates.get(error_class, self.default_sample_rate):
+                reason = 'sampled'
+            elif not self._take_token(error_class, now):
+                reason = 'rate_limited'
+
+            if reason is not None:
+                self.suppressed[(error_class, reason)] += 1
+                return False
+
+            self._fingerprints[fingerprint] = now
+            self._fingerprints.move_to_end(fingerprint)
+            while len(self._fingerprints) > self.max_fingerprints:
+                self._fingerprints.popitem(last=False)
+            self.captured[error_class] += 1
+            return True
+
+    def capture(
+        self,
+        error_class: str,
+        driver,
+        exception: BaseException = None
+    ) -> str:
+        '''
+        Captures the page `driver` is on for a failure of `error_class`, if `should_capture()` says so.
+
+        Parameters
+        ----------
+        error_class : str
+            Kind of failure, e.g. "selenium_login_not_found"
+        driver : selenium.webdriver.Chrome
+            Browser showing the failure
+        exception : BaseException, optional
+            Exception behind the failure. If None, uses the one currently being handled (if any), by default None
+
+        Returns
+        -------
+        str
+            Local path of the capture, or None if it was suppressed
+        '''
+        if self.savepath is None:
+            raise ValueError("`savepath` must not be None")
+        if exception is None:
+            exception = sys.exc_info()[1]
+        if not self.should_capture(error_class, exception):
+            logger.debug("Suppressed capture of '%s'", error_class)
+            return None
+
+        # Short random suffix since the same class can be captured more than once a second
+        filename = get_current_datetime() + '_' + str(os.getpid()) + '_' + error_class + '_' + uuid4().hex[:8]
+        try:
+            if self.mode == 'screenshot':
+                filename += '.png'
+                path = os.path.join(self.savepath, filename)
+                driver.save_screenshot(path)
+            else:
+                filename += '.json.gz'
+                path = os.path.join(self.savepath, filename)
+                self._save_snapshot(path, error_class, driver, exception)
+        except Exception:
+            logger.error("Couldn't capture '%s'", error_class, exc_info=True)
+            return None
+
+        if self.bucket_name is not None:
+            get_background_uploader().submit(
+                self.bucket_name,
+                path,
+                "errors/" + filename,
+                remove_after=True
+            )
+        return path
+
+    @classmethod
+    def _network_log(cls, driver) -> list:
+        # Only selenium-wire drivers keep a record of the requests they've made
+        requests = getattr(driver, 'requests', None) or []
+        log = []
+        for request in requests[-MAX_SNAPSHOT_REQUESTS:]:
+            response = request.response
+            log.append({
+                'method': request.method,
+                'url': request.url,
+                'status_code': None if response is None else response.status_code,
+                'content_type': None if response is None else response.headers.get('Content-Type')
+            })
+        return log
+
+    def _save_snapshot(
+        self,
+        path: str,
+        error_class: str,
+        driver,
+        exception: BaseException
+    ):
+        snapshot = {
+            'error_class': error_class,
+            'captured_at': get_current_datetime(),
+            'exception': None if exception is None else ''.join(
+                traceback.format_exception(type(exception), exception, exception.__traceback__)
+            ),
+            'url': driver.current_url,
+            'title': driver.title,
+            'dom': driver.page_source,
+            'network': self._network_log(driver)
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        '''
+        Captured and suppressed counts per error class.
+        '''
+        with self._lock:
+            summary = {c: {'captured': n} for c, n in self.captured.items()}
+            for (error_class, reason), n in self.suppressed.items():
+                summary.setdefault(error_class, {'captured': 0})[reason] = n
+        for counts in summary.values():
+            for reason in SUPPRESSION_REASONS:
+                counts.setdefault(reason, 0)
+        return summary
+
+    def log_summary(self):
+        total_suppressed = sum(self.suppressed.values())
+        if total_suppressed > 0:
+            logger.info(
+                "Captured %s errors and suppressed %s: %s",
+                sum(self.captured.values()),
+                total_suppressed,
+                self.summary()
+            )
@@ -0,0 +1,180 @@
+from typing import List, Union
+import heapq
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Columns of the searchTilesNREL table, in order
+NREL_SEARCH_TILE_COLUMNS = [
+    'id',
+    'cell_radius_mi',
+    'latitude',
+    'longitude',
+    'name',
+    'num_plugs',
+    'ev_connector_types',
+    'ev_network',
+    'pricing',
+    'geocode_accuracy',
+    'network_ids'
+]
+AFDC_PLUG_COUNT_COLUMNS = [
+    'ev_dc_fast_num',
+    'ev_level1_evse_num',
+    'ev_level2_evse_num'
+]
+
+
+def haversine_miles(
+    latitude_1: Union[float, np.ndarray],
+    longitude_1: Union[float, np.ndarray],
+    latitude_2: Union[float, np.ndarray],
+    longitude_2: Union[float, np.ndarray]
+) -> Union[float, np.ndarray]:
+    '''
+    Great-circle distance in miles between points given in degrees. Arrays broadcast against each other like any numpy operation, e.g. one point against many or many pairs at once.
+    '''
+    latitude_1, longitude_1, latitude_2, longitude_2 = (
+        np.radians(x) for x in (latitude_1, longitude_1, latitude_2, longitude_2)
+    )
+    a = np.sin((latitude_2 - latitude_1) / 2)**2 \
+        + np.cos(latitude_1) * np.cos(latitude_2) * np.sin((longitude_2 - longitude_1) / 2)**2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def make_ball_tree(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray
+) -> BallTree:
+    '''
+    Spatial index over points given in degrees, for haversine queries with distances in radians (i.e. miles / EARTH_RADIUS_MILES).
+    '''
+    return BallTree(np.radians(np.column_stack([latitudes, longitudes])), metric='haversine')
+
+
+def _greedy_cover(neighbors: np.ndarray, num_points: int) -> List[tuple]:
+    '''
+    Lazy greedy set cover: repeatedly picks the candidate that covers the most points not covered yet.
+
+    Returns
+    -------
+    List[tuple]
+        (candidate index, indices of the points it newly covers) for each pick, in order
+    '''
+    covered = np.zeros(num_points, dtype=bool)
+    heap = [(-len(n), i) for i, n in enumerate(neighbors)]
+    heapq.heapify(heap)
+    picks = []
+    num_covered = 0
+    while num_covered < num_points:
+        negative_gain, i = heapq.heappop(heap)
+        uncovered = neighbors[i][~covered[neighbors[i]]]
+        # Gains only ever shrink, so a candidate that's still as good as the next best one is the best
+        if len(uncovered) < -negative_gain:
+            heapq.heappush(heap, (-len(uncovered), i))
+            continue
+        covered[uncovered] = True
+        num_covered += len(uncovered)
+        picks.append((i, uncovered))
+    return picks
+
+
+def make_search_tiles(
+    df_stations: pd.DataFrame,
+    max_radius_in_miles: float = 1.0,
+    min_radius_in_miles: float = 0.1
+) -> pd.DataFrame:
+    '''
+    Builds a near-minimal set of circular map search tiles that covers every station, for `LocationIDScraper` to search. Tiles are centered on stations, and picked greedily so that each one covers as many not-yet-covered stations within `max_radius_in_miles` as possible (lazy greedy set cover over a ball tree), then shrunk to just reach the farthest station it covers.
+
+    Parameters
+    ----------
+    df_stations : pd.DataFrame
+        Stations, e.g. from `AFDC.get_stations()`. Needs 'id', 'latitude', and 'longitude' columns, and the rest of the AFDC columns fill out the tiles' details when present
+    max_radius_in_miles : float, optional
+        Largest tile radius, by default 1.0
+    min_radius_in_miles : float, optional
+        Smallest tile radius, so tiles of one station still cover some slack around it, by default 0.1
+
+    Returns
+    -------
+    pd.DataFrame
+        Tiles with the searchTilesNREL table's columns. Station details (name, network, etc.) are the center station's, while `num_plugs` and `ev_connector_types` cover every station assigned to the tile
+    '''
+    df_stations = df_stations.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+    if df_stations.empty:
+        return pd.DataFrame(columns=NREL_SEARCH_TILE_COLUMNS)
+    latitudes = df_stations['latitude'].to_numpy(dtype=float)
+    longitudes = df_stations['longitude'].to_numpy(dtype=float)
+
+    tree = make_ball_tree(latitudes, longitudes)
+    neighbors = tree.query_radius(
+        np.radians(np.column_stack([latitudes, longitudes])),
+        r=max_radius_in_miles / EARTH_RADIUS_MILES
+    )
+    picks = _greedy_cover(neighbors, len(df_stations))
+
+    # Every (tile, station it covers) pair at once
+    centers = np.array([i for i, _ in picks])
+    tile_indices = np.repeat(np.arange(len(picks)), [len(covered) for _, covered in picks])
+    station_indices = np.concatenate([covered for _, covered in picks])
+    distances = haversine_miles(
+        latitudes[centers[tile_indices]],
+        longitudes[centers[tile_indices]],
+        latitudes[station_indices],
+        longitudes[station_indices]
+    )
+    radii = np.full(len(picks), min_radius_in_miles)
+    np.maximum.at(radii, tile_indices, distances)
+
+    df_centers = df_stations.iloc[centers].reset_index(drop=True)
+    df_tiles = pd.DataFrame({
+        'id': df_centers['id'].astype(int),
+        # Round up so float error never leaves a covered station just outside
+        'cell_radius_mi': np.minimum(np.ceil(radii * 1000) / 1000, max_radius_in_miles),
+        'latitude': df_centers['latitude'],
+        'longitude': df_centers['longitude']
+    })
+
+    plug_count_columns = [c for c in AFDC_PLUG_COUNT_COLUMNS if c in df_stations.columns]
+    if len(plug_count_columns) > 0:
+        station_plugs = df_stations[plug_count_columns].fillna(0).sum(axis=1).to_numpy()
+        df_tiles['num_plugs'] = np.bincount(
+            tile_indices,
+            weights=station_plugs[station_indices],
+            minlength=len(picks)
+        ).astype(int)
+    if 'ev_connector_types' in df_stations.columns:
+        df_tiles['ev_connector_types'] = pd.Series(
+            df_stations['ev_connector_types'].to_numpy()[station_indices]
+        ).groupby(tile_indices).agg(
+            lambda types: ';'.join(sorted({t for station_types in types if isinstance(station_types, list) for t in station_types}))
+        ).replace('', None)
+
+    details = {
+        'station_name': 'name',
+        'ev_network': 'ev_network',
+        'ev_pricing': 'pricing',
+        'geocode_status': 'geocode_accuracy',
+        'ev_network_ids': 'network_ids'
+    }
+    for station_column, tile_column in details.items():
+        if station_column in df_centers.columns:
+            df_tiles[tile_column] = df_centers[station_column]
+    if 'network_ids' in df_tiles.columns:
+        df_tiles['network_ids'] = df_tiles['network_ids'].astype(str)
+
+    logger.info(
+        "Covered %s stations with %s search tiles of up to %s miles",
+        len(df_stations),
+        len(df_tiles),
+        max_radius_in_miles
+    )
+    return df_tiles.reindex(columns=NREL_SEARCH_TILE_COLUMNS)
@@ -1,11 +1,18 @@
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Literal, Callable, Any
 from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+import os
 
+from google.api_core.exceptions import NotFound, PreconditionFailed
 from google.cloud import storage
 from google.cloud import bigquery
+from tenacity import retry, wait_random_exponential, stop_after_attempt
 import pandas as pd
 import numpy as np
 
+from evlens.data.key_index import KeyIndex, make_keys
+
 from evlens.logs import setup_logger
 logger = setup_logger(__name__)
 
@@ -13,6 +20,58 @@ logger = setup_logger(__name__)
 pd.set_option('future.no_silent_downcasting', True)
 
 
+# (pid, kind, *args): client, so every thread in a process shares one authenticated client per kind
+# while forked/Ray worker processes build their own rather than reusing the parent's connections
+_CLIENTS: Dict[tuple, Any] = dict()
+_CLIENTS_LOCK = Lock()
+
+# BigQuery's limit on source URIs in one load job
+MAX_URIS_PER_LOAD_JOB = 10_000
+
+
+def _get_client(kind: str, factory: Callable[[], Any], *args) -> Any:
+    key = (os.getpid(), kind) + args
+    client = _CLIENTS.get(key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+            if client is None:
+                client = factory()
+                _CLIENTS[key] = client
+    return client
+
+
+def get_storage_client() -> storage.Client:
+    '''
+    Returns this process's shared GCS client, creating it on first use.
+    '''
+    return _get_client('storage', storage.Client)
+
+
+def get_bigquery_client(
+    project: str = 'evlens',
+    location: str = 'US'
+) -> bigquery.Client:
+    '''
+    Returns this process's shared BigQuery client for `project` and `location`, creating it on first use.
+    '''
+    return _get_client(
+        'bigquery',
+        lambda: bigquery.Client(project=project, location=location),
+        project,
+        location
+    )
+
+
+def get_background_uploader(create: bool = True) -> 'BackgroundUploader':
+    '''
+    Returns this process's shared `BackgroundUploader`, starting it on first use. With `create=False`, returns None instead if nothing in this process has used it yet.
+    '''
+    if not create:
+        return _CLIENTS.get((os.getpid(), 'uploader'))
+    return _get_client('uploader', BackgroundUploader)
+
+
 # Adapted from https://cloud.google.com/storage/docs/uploading-objects#storage-upload-object-python
 def upload_file(
     bucket_name: str,
@@ -27,8 +86,7 @@ def upload_file(
     # The ID of your GCS object
     # destination_blob_name = "storage-object-name"
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_storage_client().bucket(bucket_name)
     
     if destination_blob_name is None:
         destination_blob_name = source_filepath
@@ -69,9 +127,7 @@ def download_blob(
     # The path to which the file should be downloaded
     # destination_file_name = "local/path/to/file"
 
-    storage_client = storage.Client()
-
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_storage_client().bucket(bucket_name)
 
     # Construct a client side representation of a blob.
     # Note `Bucket.blob` differs from `Bucket.get_blob` as it doesn't retrieve
@@ -90,6 +146,120 @@ def download_blob(
     )
     
 
+class BackgroundUploader:
+    '''
+    Small thread pool that uploads files (e.g. error screenshots) to GCS off the calling thread, retrying failed uploads, so the scrape loop only pays for writing the file locally.
+    '''
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_attempts: int = 5
+    ):
+        '''
+        Parameters
+        ----------
+        max_workers : int, optional
+            Number of uploads in flight at once, by default 4
+        max_attempts : int, optional
+            Tries per file before giving up on it, by default 5
+        '''
+        self.max_attempts = max_attempts
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gcs-uploader')
+        self._futures = set()
+        self._lock = Lock()
+        self.num_uploaded = 0
+        self.num_failed = 0
+
+    def submit(
+        self,
+        bucket_name: str,
+        source_filepath: str,
+        destination_blob_name: str = None,
+        remove_after: bool = False
+    ) -> Future:
+        '''
+        Queues `source_filepath` for upload and returns right away.
+
+        Parameters
+        ----------
+        bucket_name : str
+            GCS bucket to upload to
+        source_filepath : str
+            Local file to upload
+        destination_blob_name : str, optional
+            Blob name in the bucket. If None, uses `source_filepath`, by default None
+        remove_after : bool, optional
+            If True, the local file is deleted once it's uploaded. Files that can't be uploaded are always kept, by default False
+
+        Returns
+        -------
+        Future
+            Resolves to True if the file was uploaded, False if every attempt failed
+        '''
+        future = self._executor.submit(
+            self._upload,
+            bucket_name,
+            source_filepath,
+            destination_blob_name,
+            remove_after
+        )
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    @staticmethod
+    def _upload_once(bucket_name: str, source_filepath: str, destination_blob_name: str):
+        try:
+            upload_file(bucket_name, source_filepath, destination_blob_name)
+        except PreconditionFailed:
+            # Uploads only go through if the blob doesn't exist yet, so an earlier
+            # attempt we never heard back from must have made it
+            logger.info("%s was already uploaded by an earlier attempt", source_filepath)
+
+    def _upload(
+        self,
+        bucket_name: str,
+        source_filepath: str,
+        destination_blob_name: str,
+        remove_after: bool
+    ) -> bool:
+        retry_strategy = retry(
+            wait=wait_random_exponential(multiplier=0.5, min=0, max=10),
+            stop=stop_after_attempt(self.max_attempts),
+            reraise=True
+        )
+        try:
+            retry_strategy(self._upload_once)(bucket_name, source_filepath, destination_blob_name)
+        except Exception:
+            logger.error("Giving up on uploading %s, leaving it in place", source_filepath, exc_info=True)
+            with self._lock:
+                self.num_failed += 1
+            return False
+        with self._lock:
+            self.num_uploaded += 1
+        if remove_after:
+            os.remove(source_filepath)
+        return True
+
+    def flush(self, timeout: float = None):
+        '''
+        Blocks until every upload submitted so far is finished (or has given up).
+        '''
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.exception(timeout=timeout)
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
 class BigQuery:
     '''
     Set of useful methods all tied to a single GCP project for BigQuery table setup, querying, data insertion, etc.
@@ -97,14 +267,24 @@ class BigQuery:
     def __init__(
         self,
         project: str = 'evlens',
-        location: str = 'US'
+        location: str = 'US',
+        client: bigquery.Client = None
     ):
+        '''
+        Parameters
+        ----------
+        project : str, optional
+            GCP project ID, by default 'evlens'
+        location : str, optional
+            BigQuery location, by default 'US'
+        client : bigquery.Client, optional
+            Client to use instead of this process's shared one (see `get_bigquery_client()`), e.g. a local SQL stand-in with the same interface for testing, by default None
+        '''
         self.project = project
         self.location = location
-        self.client = bigquery.Client(
-            project=project,
-            location=location
-        )
+        if client is None:
+            client = get_bigquery_client(project=project, location=location)
+        self.client = client
         
     def _make_dataset_id(
         self,
@@ -241,10 +421,12 @@ class BigQuery:
         dataset_name: str,
         table_name: str,
         merge_columns: Union[str, List[str]] = None,
-        timeout: int = 10
-    ):
+        timeout: int = 10,
+        dedupe_method: Literal['merge', 'query'] = 'merge',
+        key_index: KeyIndex = None
+    ) -> int:
         '''
-        Inserts new data as an append operation to BQ. NOTE THAT BQ DOES NOT DE-DUPLICATE DATA, IT APPENDS BLINDLY. So use with caution.
+        Inserts new data as an append operation to BQ. NOTE THAT BQ DOES NOT DE-DUPLICATE DATA, IT APPENDS BLINDLY UNLESS `merge_columns` IS SET. So use with caution.
 
         Parameters
         ----------
@@ -255,8 +437,51 @@ class BigQuery:
         table_name : str
             Name of the target BQ table
         merge_columns : Union[str, List[str]]
-            If this should be a merge operation in which only truly new rows should be added to BQ, set this to the column names in the BQ table (and thus also in `df`) that represent a unique composite key to use for de-duplication purposes. If not None, this will query BQ for all its data in the provided table before attempting to insert new data. If no new rows are detected in `df` after comparing to the contents of the table, insertion will be aborted.
+            If this should be a merge operation in which only truly new rows should be added to BQ, set this to the column names in the BQ table (and thus also in `df`) that represent a unique composite key to use for de-duplication purposes. If no new rows are detected in `df` after comparing to the contents of the table, nothing is inserted.
+        timeout : int, optional
+            Seconds to wait on the load job's API request, by default 10
+        dedupe_method : Literal['merge', 'query'], optional
+            How to de-duplicate when `merge_columns` is set. 'merge' loads `df` into a temporary staging table and runs a single server-side `MERGE ... WHEN NOT MATCHED THEN INSERT`, so the cost scales with the size of `df`. 'query' pulls the table's keys (or whole table, for composite keys) into pandas and filters `df` locally, so the cost scales with the size of the table, by default 'merge'
+        key_index : KeyIndex, optional
+            Local record of the keys already stored in each table. If provided (and `merge_columns` is set), rows with known keys are dropped before anything is sent to BQ, and the keys of every row saved are recorded afterwards, by default None
+
+        Returns
+        -------
+        int
+            Number of rows actually added to the table, whichever path was taken: all of `df` for a plain append, only the new rows when de-duplicating, and 0 when nothing was new
         '''        
+        if dedupe_method not in ('merge', 'query'):
+            raise ValueError(f"`dedupe_method` must be one of ['merge', 'query'], got '{dedupe_method}'")
+        
+        if key_index is not None and merge_columns is not None:
+            namespace = f"{dataset_name}.{table_name}"
+            keys = make_keys(df, merge_columns)
+            df = df[~keys.isin(key_index.filter_known(namespace, keys))]
+            if df.empty:
+                logger.info("Every row in `df` is already in the key index for %s, data insertion skipped", namespace)
+                return 0
+            
+            num_inserted = self.insert_data(
+                df,
+                dataset_name,
+                table_name,
+                merge_columns=merge_columns,
+                timeout=timeout,
+                dedupe_method=dedupe_method
+            )
+            # Every key in `df` is in the table now, whether we inserted it or it was there already
+            key_index.add(namespace, make_keys(df, merge_columns))
+            return num_inserted
+        
+        if merge_columns is not None and dedupe_method == 'merge':
+            return self.merge_data(
+                df,
+                dataset_name,
+                table_name,
+                merge_columns,
+                timeout=timeout
+            )
+            
         if merge_columns is not None:
             df = self.check_and_remove_duplicates(
                 dataset_name,
@@ -266,7 +491,7 @@ class BigQuery:
             )
             if df is None or df.empty:
                 logger.error("No new rows detected in `df` when de-duplicating with columns %s, data insertion aborted", merge_columns)
-                return
+                return 0
             
         # Set table_id to the ID of the table to create.
         table_id = self._make_table_id(dataset_name, table_name)
@@ -278,13 +503,108 @@ class BigQuery:
         )  # Make an API request.
         job.result()  # Wait for the job to complete.
 
-        table = self.client.get_table(table_id)  # Make an API request.
-        logger.info(
-            "Loaded %s rows and %s columns to %s",
-            table.num_rows,
-            len(table.schema),
-            table_id
+        logger.info("Loaded %s rows to %s", len(df), table_id)
+        return len(df)
+        
+    @classmethod
+    def _build_merge_query(
+        cls,
+        table_id: str,
+        staging_table_id: str,
+        merge_columns: List[str],
+        columns: List[str],
+        dedupe_source: bool = False
+    ) -> str:
+        '''
+        Builds a MERGE statement that inserts the rows of the staging table whose `merge_columns` values don't exist in the target table yet, and leaves the rest of the target table untouched. If `dedupe_source`, only one staging row per key is considered, for staging tables that may repeat keys.
+        '''
+        match_condition = ' AND '.join(f"T.{c} = S.{c}" for c in merge_columns)
+        column_list = ', '.join(columns)
+        source_columns = ', '.join(f"S.{c}" for c in columns)
+        source = f"`{staging_table_id}`"
+        if dedupe_source:
+            source = f"""(
+            SELECT * FROM `{staging_table_id}`
+            WHERE true
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY {', '.join(merge_columns)}) = 1
+        )"""
+        return f"""
+        MERGE INTO `{table_id}` T
+        USING {source} S
+        ON {match_condition}
+        WHEN NOT MATCHED THEN
+            INSERT ({column_list}) VALUES ({source_columns})
+        """
+        
+    def merge_data(
+        self,
+        df: pd.DataFrame,
+        dataset_name: str,
+        table_name: str,
+        merge_columns: Union[str, List[str]],
+        timeout: int = 10
+    ) -> int:
+        '''
+        Upserts `df` into a table server-side: loads it into a temporary staging table, then runs one MERGE that inserts only the rows with keys the table doesn't have yet. Existing rows are never modified.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The data of interest, DataFrame schema needs to match BQ table schema (but need not have columns in same order)
+        dataset_name : str
+            Name of the target BQ Dataset
+        table_name : str
+            Name of the target BQ table
+        merge_columns : Union[str, List[str]]
+            Column name(s) that make up the unique (composite) key used to decide if a row is new
+        timeout : int, optional
+            Seconds to wait on the staging load job's API request, by default 10
+
+        Returns
+        -------
+        int
+            Number of rows inserted
+        '''
+        if isinstance(merge_columns, str):
+            merge_columns = [merge_columns]
+        df = df.drop_duplicates(subset=merge_columns)
+        
+        table_id = self._make_table_id(dataset_name, table_name)
+        staging_table_id = self._make_table_id(
+            dataset_name,
+            f"{table_name}_staging_{uuid4().hex}"
+        )
+        
+        # Use the target's schema so the staging table's types line up for the MERGE
+        job_config = bigquery.LoadJobConfig(
+            schema=self.client.get_table(table_id).schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
         )
+        try:
+            self.client.load_table_from_dataframe(
+                df,
+                staging_table_id,
+                job_config=job_config,
+                timeout=timeout
+            ).result()
+            
+            query_job = self.client.query(self._build_merge_query(
+                table_id,
+                staging_table_id,
+                merge_columns,
+                df.columns.tolist()
+            ))
+            query_job.result()
+            
+        finally:
+            self.client.delete_table(staging_table_id, not_found_ok=True)
+            
+        num_inserted = query_job.num_dml_affected_rows or 0
+        if num_inserted == 0:
+            logger.info("No new rows detected in `df` when merging on columns %s", merge_columns)
+        else:
+            logger.info("Merged %s new rows into %s", num_inserted, table_id)
+        return num_inserted
         
     def clear_table(
         self,
@@ -297,6 +617,142 @@ class BigQuery:
         self.client.query_and_wait(query)
         logger.info("Table %s cleared", table_id)
         
+    def table_exists(
+        self,
+        dataset_name: str,
+        table_name: str
+    ) -> bool:
+        try:
+            self.client.get_table(self._make_table_id(dataset_name, table_name))
+            return True
+        except NotFound:
+            return False
+        
+    def replace_table(
+        self,
+        df: pd.DataFrame,
+        dataset_name: str,
+        table_name: str,
+        timeout: int = 10
+    ) -> int:
+        '''
+        Replaces everything in an existing table with `df` in one load job, so the table is never seen empty or half-loaded the way it would be between `clear_table()` and `insert_data()`.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The table's new contents, DataFrame schema needs to match BQ table schema (but need not have columns in same order)
+        dataset_name : str
+            Name of the target BQ Dataset
+        table_name : str
+            Name of the target BQ table
+        timeout : int, optional
+            Seconds to wait on the load job's API request, by default 10
+
+        Returns
+        -------
+        int
+            Number of rows the table now has
+        '''
+        table_id = self._make_table_id(dataset_name, table_name)
+        job_config = bigquery.LoadJobConfig(
+            schema=self.client.get_table(table_id).schema,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
+        )
+        self.client.load_table_from_dataframe(
+            df,
+            table_id,
+            job_config=job_config,
+            timeout=timeout
+        ).result()
+        logger.info("Replaced the contents of %s with %s rows", table_id, len(df))
+        return len(df)
+        
+    def load_from_uris(
+        self,
+        uris: List[str],
+        dataset_name: str,
+        table_name: str,
+        merge_columns: List[str] = None,
+        max_uris_per_job: int = MAX_URIS_PER_LOAD_JOB,
+        timeout: int = 600
+    ) -> int:
+        '''
+        Loads Parquet files (e.g. staged by a `StagedBulkLoader`) into an existing table. Plain appends are one load job. With `merge_columns`, the files are loaded into a staging table, `max_uris_per_job` at a time, and merged in with one MERGE that keeps one row per key.
+
+        Parameters
+        ----------
+        uris : List[str]
+            GCS URIs of the files, at most `max_uris_per_job` of them if `merge_columns` is None
+        dataset_name : str
+            Name of the target BQ Dataset
+        table_name : str
+            Name of the target BQ table
+        merge_columns : List[str], optional
+            Column names of the unique (composite) key. If provided, rows whose keys are already in the table are skipped, by default None
+        max_uris_per_job : int, optional
+            Most files loaded into the staging table by one load job, by default MAX_URIS_PER_LOAD_JOB
+        timeout : int, optional
+            Seconds to wait on each load job's API request, by default 600
+
+        Returns
+        -------
+        int
+            Number of rows added to the table
+        '''
+        table_id = self._make_table_id(dataset_name, table_name)
+        schema = self.client.get_table(table_id).schema
+
+        if merge_columns is None:
+            job = self.client.load_table_from_uri(
+                uris,
+                table_id,
+                job_config=bigquery.LoadJobConfig(
+                    source_format=bigquery.SourceFormat.PARQUET,
+                    write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+                ),
+                timeout=timeout
+            )
+            job.result()
+            logger.info("Loaded %s files into %s", len(uris), table_id)
+            return job.output_rows or 0
+
+        staging_table_id = self._make_table_id(
+            dataset_name,
+            f"{table_name}_staging_{uuid4().hex}"
+        )
+        try:
+            # Everything goes into one staging table first, so there's still only one MERGE
+            for i in range(0, len(uris), max_uris_per_job):
+                self.client.load_table_from_uri(
+                    uris[i:i + max_uris_per_job],
+                    staging_table_id,
+                    job_config=bigquery.LoadJobConfig(
+                        source_format=bigquery.SourceFormat.PARQUET,
+                        schema=schema,
+                        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE if i == 0
+                            else bigquery.WriteDisposition.WRITE_APPEND
+                    ),
+                    timeout=timeout
+                ).result()
+
+            # Different workers may have staged the same key, so only merge one row per key
+            query_job = self.client.query(self._build_merge_query(
+                table_id,
+                staging_table_id,
+                merge_columns,
+                [field.name for field in schema],
+                dedupe_source=True
+            ))
+            query_job.result()
+
+        finally:
+            self.client.delete_table(staging_table_id, not_found_ok=True)
+
+        num_inserted = query_job.num_dml_affected_rows or 0
+        logger.info("Merged %s new rows from %s files into %s", num_inserted, len(uris), table_id)
+        return num_inserted
+        
     def check_and_remove_duplicates(
         self,
         dataset_name: str,
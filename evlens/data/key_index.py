@@ -0,0 +1,219 @@
+from typing import List, Iterable, Union
+import hashlib
+import math
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# Joins the values of composite keys into a single key string
+COMPOSITE_KEY_SEPARATOR = '\x1f'
+
+
+def make_keys(
+    df: pd.DataFrame,
+    key_columns: Union[str, List[str]]
+) -> pd.Series:
+    '''
+    Turns the key column(s) of `df` into one string key per row, the form KeyIndex stores them in.
+    '''
+    if isinstance(key_columns, str):
+        return df[key_columns].astype(str)
+    return df[key_columns].astype(str).agg(COMPOSITE_KEY_SEPARATOR.join, axis=1)
+
+
+class BloomFilter:
+    '''
+    Fixed-size Bloom filter over strings. Never gives false negatives, gives false positives at roughly the rate it was sized for.
+    '''
+    def __init__(
+        self,
+        expected_items: int = 10_000_000,
+        false_positive_rate: float = 0.01
+    ):
+        self.num_bits = max(64, int(-expected_items * math.log(false_positive_rate) / math.log(2)**2))
+        self.num_hashes = max(1, round(self.num_bits / expected_items * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, item: str) -> np.ndarray:
+        # Double hashing: k positions from two 64-bit hashes
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return np.array(
+            [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)],
+            dtype=np.int64
+        )
+
+    def add(self, item: str):
+        positions = self._positions(item)
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def __contains__(self, item: str) -> bool:
+        positions = self._positions(item)
+        return bool(np.all(self.bits[positions >> 3] & (1 << (positions & 7)).astype(np.uint8)))
+
+
+class KeyIndex:
+    '''
+    Local, persistent record of which primary keys (location IDs, check-in IDs, EVSE IDs, etc.) have already been stored in the warehouse, so we can skip re-uploading or re-visiting them without querying the warehouse.
+
+    Keys live in a SQLite database in WAL mode, so any number of processes (e.g. Ray actors) on one host can read and write it at once. Each process keeps an in-memory Bloom filter in front of it so that the usual answer ("never seen it") doesn't touch disk, and catches the filter up on other processes' writes incrementally.
+    '''
+    def __init__(
+        self,
+        path: str,
+        expected_keys: int = 10_000_000,
+        false_positive_rate: float = 0.01,
+        timeout: float = 30
+    ):
+        '''
+        Parameters
+        ----------
+        path : str
+            SQLite database file. Created (along with its directory) if it doesn't exist.
+        expected_keys : int, optional
+            Total number of keys the Bloom filter is sized for. Going well past this raises the false positive rate (which only costs an extra disk lookup), by default 10 million
+        false_positive_rate : float, optional
+            Target rate of Bloom filter false positives, by default 0.01
+        timeout : float, optional
+            Seconds to wait on another process's write lock before raising, by default 30
+        '''
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+
+        # Take the write lock up front so concurrent writers queue up instead of deadlocking
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level='IMMEDIATE')
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS keys (
+                -- Never reused, so other processes can sync by id even after a rebuild
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                UNIQUE (namespace, key)
+            )
+            """
+        )
+
+        self.bloom = BloomFilter(expected_keys, false_positive_rate)
+        self._last_synced_rowid = 0
+        self.sync()
+
+    def sync(self):
+        '''
+        Adds keys written since the last sync (by any process) to this process's Bloom filter.
+        '''
+        rows = self.connection.execute(
+            "SELECT id, namespace, key FROM keys WHERE id > ? ORDER BY id",
+            (self._last_synced_rowid,)
+        ).fetchall()
+        for rowid, namespace, key in rows:
+            self.bloom.add(namespace + COMPOSITE_KEY_SEPARATOR + key)
+        if len(rows) > 0:
+            self._last_synced_rowid = rows[-1][0]
+
+    def add(self, namespace: str, keys: Iterable[str]) -> int:
+        '''
+        Records `keys` as stored.
+
+        Parameters
+        ----------
+        namespace : str
+            What the keys are for, e.g. "plugshare.stations"
+        keys : Iterable[str]
+            Primary key values (see `make_keys()` for composite keys)
+
+        Returns
+        -------
+        int
+            Number of keys that weren't already recorded
+        '''
+        keys = [str(k) for k in keys]
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO keys (namespace, key) VALUES (?, ?)",
+                ((namespace, k) for k in keys)
+            )
+        self.sync()
+        return cursor.rowcount
+
+    def __contains__(self, namespaced_key: tuple) -> bool:
+        namespace, key = namespaced_key
+        return len(self.filter_known(namespace, [key])) > 0
+
+    def filter_known(self, namespace: str, keys: Iterable[str]) -> List[str]:
+        '''
+        Returns the subset of `keys` that have already been recorded, in the order given.
+        '''
+        self.sync()
+        candidates = [
+            str(k) for k in keys
+            if namespace + COMPOSITE_KEY_SEPARATOR + str(k) in self.bloom
+        ]
+        if len(candidates) == 0:
+            return []
+
+        # Weed out Bloom filter false positives
+        known = set()
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            known.update(k for (k,) in self.connection.execute(
+                f"SELECT key FROM keys WHERE namespace = ? AND key IN ({','.join('?' * len(chunk))})",
+                [namespace] + chunk
+            ))
+        return [k for k in candidates if k in known]
+
+    def filter_new(self, namespace: str, keys: Iterable[str]) -> List[str]:
+        '''
+        Returns the subset of `keys` that have NOT been recorded yet, in the order given.
+        '''
+        keys = [str(k) for k in keys]
+        known = set(self.filter_known(namespace, keys))
+        return [k for k in keys if k not in known]
+
+    def count(self, namespace: str = None) -> int:
+        if namespace is None:
+            return self.connection.execute("SELECT count(*) FROM keys").fetchone()[0]
+        return self.connection.execute(
+            "SELECT count(*) FROM keys WHERE namespace = ?",
+            (namespace,)
+        ).fetchone()[0]
+
+    def rebuild(self, namespace: str, keys: Iterable[str]) -> int:
+        '''
+        Replaces everything recorded under `namespace` with `keys`, e.g. with the full key column of a warehouse table.
+
+        Returns
+        -------
+        int
+            Number of keys now recorded under `namespace`
+        '''
+        with self.connection:
+            self.connection.execute("DELETE FROM keys WHERE namespace = ?", (namespace,))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO keys (namespace, key) VALUES (?, ?)",
+                ((namespace, str(k)) for k in keys)
+            )
+
+        # Deleted keys can't be removed from a Bloom filter, so start this process's filter over.
+        # Other processes' filters just end up with a few more false positives.
+        self.bloom.bits[:] = 0
+        self._last_synced_rowid = 0
+        self.sync()
+
+        num_keys = self.count(namespace)
+        logger.info("Rebuilt key index for %s with %s keys", namespace, num_keys)
+        return num_keys
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,177 @@
+from typing import List, Dict, Iterable
+from collections import Counter
+import fcntl
+import os
+import threading
+
+from evlens import get_current_datetime
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+LEDGER_STATES = ['in_flight', 'done', 'failed']
+
+
+class ProgressLedger:
+    '''
+    Durable, append-only record of which work items (search tiles, locations, etc.) are in flight, done, or failed, so an interrupted job can be resumed exactly, no matter how the remaining work gets split across workers.
+
+    Each line is "<time>\\t<state>\\t<key>\\t<detail>" and the latest line for a key wins. Every `mark()` call is a single append under a short file lock, so any number of processes on one host (e.g. Ray actors) can share a ledger file. States are kept in memory and only the lines other writers appended since the last look are read from the file.
+    '''
+    def __init__(self, path: str):
+        '''
+        Parameters
+        ----------
+        path : str
+            Ledger file. Created (along with its directory) if it doesn't exist.
+        '''
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        self._fd = None
+        # flock only keeps other processes out, not other threads sharing our file descriptor
+        self._lock = threading.Lock()
+        self._states = dict()
+        # Bytes of the file already applied to `_states`
+        self._offset = 0
+
+    def _apply(self, data: bytes):
+        for line in data.decode('utf-8', errors='replace').split('\n'):
+            fields = line.split('\t')
+            # A torn line from a crashed writer
+            if len(fields) != 4 or fields[1] not in LEDGER_STATES:
+                continue
+            self._states[fields[2]] = fields[1]
+
+    def _catch_up(self):
+        '''
+        Applies whatever complete lines were appended since the last look. Call with `_lock` held.
+        '''
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self._offset:
+            # File was replaced or truncated out from under us
+            self._states = dict()
+            self._offset = 0
+        if size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # A line still being written is picked up next time
+        num_complete = data.rfind(b'\n') + 1
+        self._apply(data[:num_complete])
+        self._offset += num_complete
+
+    def mark(
+        self,
+        keys: Iterable[str],
+        state: str,
+        detail: str = None
+    ):
+        '''
+        Records `state` for every key in `keys`.
+
+        Parameters
+        ----------
+        keys : Iterable[str]
+            Work item identifiers, e.g. search cell or location IDs
+        state : str
+            One of LEDGER_STATES
+        detail : str, optional
+            Free text kept with the entry, e.g. the error for failures, by default None
+        '''
+        if state not in LEDGER_STATES:
+            raise ValueError(f"`state` must be one of {LEDGER_STATES}, got '{state}'")
+        keys = [str(k) for k in keys]
+        if len(keys) == 0:
+            return
+        if any('\t' in k or '\n' in k for k in keys):
+            raise ValueError("Keys can't contain tabs or newlines")
+        detail = '' if detail is None else ' '.join(str(detail).split())
+
+        now = get_current_datetime(date_delimiter=None, time_delimiter=None).isoformat()
+        lines = ''.join(f"{now}\t{state}\t{k}\t{detail}\n" for k in keys)
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                # Start on a fresh line if a crashed writer left a torn one behind
+                size = os.fstat(self._fd).st_size
+                if size > 0 and os.pread(self._fd, 1, size - 1) != b'\n':
+                    lines = '\n' + lines
+                self._catch_up()
+                encoded = lines.encode('utf-8')
+                os.write(self._fd, encoded)
+                if self._offset == size:
+                    self._apply(encoded)
+                    self._offset += len(encoded)
+                else:
+                    self._catch_up()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def mark_in_flight(self, keys: Iterable[str]):
+        self.mark(keys, 'in_flight')
+
+    def mark_done(self, keys: Iterable[str]):
+        self.mark(keys, 'done')
+
+    def mark_failed(self, keys: Iterable[str], detail: str = None):
+        self.mark(keys, 'failed', detail=detail)
+
+    def states(self) -> Dict[str, str]:
+        '''
+        Latest state of every key in the ledger.
+        '''
+        with self._lock:
+            self._catch_up()
+            return dict(self._states)
+
+    def remaining(
+        self,
+        keys: Iterable[str],
+        retry_failed: bool = True
+    ) -> List[str]:
+        '''
+        Returns the subset of `keys` that still need doing, in the order given. Items left in flight (e.g. by a crashed worker) always count as remaining.
+
+        Parameters
+        ----------
+        keys : Iterable[str]
+            Every work item of the job
+        retry_failed : bool, optional
+            If True, items whose latest attempt failed count as remaining, by default True
+        '''
+        finished = {'done'} if retry_failed else {'done', 'failed'}
+        keys = [str(k) for k in keys]
+        with self._lock:
+            self._catch_up()
+            remaining = [k for k in keys if self._states.get(k) not in finished]
+        if len(remaining) < len(keys):
+            logger.info(
+                "Ledger %s: %s of %s items already finished",
+                self.path,
+                len(keys) - len(remaining),
+                len(keys)
+            )
+        return remaining
+
+    def summary(self) -> Dict[str, int]:
+        '''
+        Number of keys currently in each state.
+        '''
+        counts = Counter(self.states().values())
+        return {state: counts.get(state, 0) for state in LEDGER_STATES}
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
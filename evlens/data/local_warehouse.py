@@ -0,0 +1,348 @@
+from typing import List, Dict, Union, Literal
+from uuid import uuid4
+import glob
+import json
+import os
+import re
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from evlens.data.google_cloud import BigQuery
+from evlens.data.key_index import KeyIndex, make_keys
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+SCHEMA_DIRECTORY = os.path.join(os.path.dirname(__file__), '..', '..', 'cloud')
+SCHEMA_FILENAME = '_schema.json'
+
+# Table name: its schema config in `cloud/`
+PLUGSHARE_TABLE_SCHEMAS = {
+    'stations': 'bq_plugshare_stationsTable_config.json',
+    'checkins': 'bq_plugshare_checkinsTable_config.json',
+    'evses': 'bq_plugshare_evseTable_config.json',
+    'locationID': 'bq_plugshare_locationIDTable_config.json',
+    'searchTiles': 'bq_plugshare_searchTilesTable_config.json',
+    'searchTilesNREL': 'bq_plugshare_searchTilesTable_NREL_config.json',
+    'afdcCrosswalk': 'bq_plugshare_afdcCrosswalkTable_config.json'
+}
+
+# BigQuery column type: DuckDB column type
+DUCKDB_TYPES = {
+    'STRING': 'VARCHAR',
+    'INTEGER': 'BIGINT',
+    'INT64': 'BIGINT',
+    'FLOAT': 'DOUBLE',
+    'FLOAT64': 'DOUBLE',
+    'NUMERIC': 'DECIMAL(38, 9)',
+    'BOOL': 'BOOLEAN',
+    'BOOLEAN': 'BOOLEAN',
+    'DATETIME': 'TIMESTAMP',
+    'TIMESTAMP': 'TIMESTAMPTZ',
+    'DATE': 'DATE',
+    'TIME': 'TIME',
+    'GEOGRAPHY': 'VARCHAR',
+    'JSON': 'VARCHAR'
+}
+
+
+class LocalWarehouse(BigQuery):
+    '''
+    Drop-in stand-in for `BigQuery` that keeps every table as a directory of compressed Parquet files on local disk and answers queries with an embedded DuckDB engine, so whole scrape -> load -> analyze pipelines can run on one machine without any network round trips (e.g. for benchmarking or quick iteration on big tables).
+
+    Tables use the same BigQuery schema configs (`cloud/bq_plugshare_*_config.json`) and are referred to by the same "<project>.<dataset>.<table>" IDs, with or without backticks, so most queries written for BigQuery run as-is.
+    '''
+    def __init__(
+        self,
+        directory: str,
+        project: str = 'evlens',
+        location: str = 'local'
+    ):
+        '''
+        Parameters
+        ----------
+        directory : str
+            Root directory of the warehouse, with one subdirectory per dataset and one per table within that. Created if it doesn't exist.
+        project : str, optional
+            Project part of table IDs, by default 'evlens'
+        location : str, optional
+            Only kept for parity with `BigQuery`, by default 'local'
+        '''
+        self.project = project
+        self.location = location
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._connection = None
+
+    def __getstate__(self):
+        # DuckDB connections can't be pickled (e.g. over to Ray actors), so each process opens its own
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self) -> duckdb.DuckDBPyConnection:
+        if self._connection is None:
+            self._connection = duckdb.connect()
+            # DATETIME columns hold UTC, like the scrapers write them
+            self._connection.execute("SET TimeZone = 'UTC'")
+        return self._connection
+
+    @property
+    def client(self):
+        raise AttributeError("LocalWarehouse has no BigQuery client, use its methods directly")
+
+    def _table_directory(self, dataset_name: str, table_name: str) -> str:
+        return os.path.join(self.directory, dataset_name, table_name)
+
+    def _load_schema(self, dataset_name: str, table_name: str) -> List[Dict[str, str]]:
+        schema_path = os.path.join(self._table_directory(dataset_name, table_name), SCHEMA_FILENAME)
+        if not os.path.exists(schema_path):
+            raise ValueError(f"Table {self._make_table_id(dataset_name, table_name)} doesn't exist, set it up with `setup_table()` first")
+        with open(schema_path, 'r') as f:
+            return json.load(f)
+
+    def _tables(self) -> List[tuple]:
+        return [
+            tuple(os.path.relpath(os.path.dirname(p), self.directory).split(os.sep))
+            for p in glob.glob(os.path.join(self.directory, '*', '*', SCHEMA_FILENAME))
+        ]
+
+    @classmethod
+    def _column_type(cls, field: Dict[str, str]) -> str:
+        column_type = DUCKDB_TYPES[field['type'].upper()]
+        if field.get('mode', 'NULLABLE').upper() == 'REPEATED':
+            column_type += '[]'
+        return column_type
+
+    def _source_sql(self, dataset_name: str, table_name: str) -> str:
+        '''
+        SQL for reading a table: its Parquet files if it has any, or an empty relation with its columns if not.
+        '''
+        schema = self._load_schema(dataset_name, table_name)
+        files = sorted(glob.glob(os.path.join(self._table_directory(dataset_name, table_name), '*.parquet')))
+        if len(files) == 0:
+            columns = ', '.join(f'CAST(NULL AS {self._column_type(f)}) AS "{f["name"]}"' for f in schema)
+            return f"(SELECT {columns} WHERE false)"
+        file_list = ', '.join("'" + f.replace("'", "''") + "'" for f in files)
+        return f"read_parquet([{file_list}], union_by_name = true)"
+
+    def _translate(self, query: str) -> str:
+        '''
+        Points every table ID in a BigQuery query at the table's local files.
+        '''
+        for dataset_name, table_name in self._tables():
+            table_id = re.escape(self._make_table_id(dataset_name, table_name))
+            pattern = rf"`{table_id}`|(?<![\w.`]){table_id}(?![\w`])"
+            if re.search(pattern, query):
+                source = self._source_sql(dataset_name, table_name)
+                query = re.sub(pattern, lambda _: source, query)
+        return query
+
+    def create_dataset(
+        self,
+        dataset: str,
+        location: str = None
+    ):
+        os.makedirs(os.path.join(self.directory, dataset), exist_ok=True)
+        logger.info("Created dataset %s.%s", self.project, dataset)
+
+    def list_datasets(self) -> List[str]:
+        datasets = sorted(
+            d for d in os.listdir(self.directory)
+            if os.path.isdir(os.path.join(self.directory, d))
+        )
+        logger.info("Datasets in project %s: %s", self.project, datasets)
+        return datasets
+
+    def setup_table(
+        self,
+        dataset: str,
+        table_name: str,
+        schema_path: str
+    ):
+        table_directory = self._table_directory(dataset, table_name)
+        os.makedirs(table_directory, exist_ok=True)
+        with open(schema_path, 'r') as f:
+            schema = json.load(f)
+        with open(os.path.join(table_directory, SCHEMA_FILENAME), 'w') as f:
+            json.dump(schema, f, indent=2)
+        logger.info("Created table %s.", self._make_table_id(dataset, table_name))
+
+    def setup_plugshare_tables(
+        self,
+        dataset: str = 'plugshare',
+        schema_directory: str = SCHEMA_DIRECTORY
+    ):
+        '''
+        Sets up every PlugShare table from its schema config in `cloud/`, skipping any that already exist.
+        '''
+        for table_name, schema_filename in PLUGSHARE_TABLE_SCHEMAS.items():
+            if os.path.exists(os.path.join(self._table_directory(dataset, table_name), SCHEMA_FILENAME)):
+                continue
+            self.setup_table(dataset, table_name, os.path.join(schema_directory, schema_filename))
+
+    def set_table_keys(self, *args, **kwargs):
+        # Keys are NOT ENFORCED in BigQuery anyway, so there's nothing to do locally
+        logger.debug("Table keys aren't tracked by LocalWarehouse, skipping")
+
+    def query_to_dataframe(self, query: str) -> pd.DataFrame:
+        df = self.connection.sql(self._translate(query)).df()
+        return df.replace({None: np.nan}).dropna(how='all')
+
+    def insert_data(
+        self,
+        df: pd.DataFrame,
+        dataset_name: str,
+        table_name: str,
+        merge_columns: Union[str, List[str]] = None,
+        timeout: int = None,
+        dedupe_method: Literal['merge', 'query'] = 'merge',
+        key_index: KeyIndex = None
+    ) -> int:
+        '''
+        Same as `BigQuery.insert_data()`: appends `df` to the table as a new Parquet file, skipping rows whose `merge_columns` values are already in the table (or `key_index`) if `merge_columns` is set. `timeout` and `dedupe_method` are accepted for parity and ignored, de-duplication always happens in the engine.
+
+        Returns
+        -------
+        int
+            Number of rows inserted
+        '''
+        if key_index is not None and merge_columns is not None:
+            namespace = f"{dataset_name}.{table_name}"
+            keys = make_keys(df, merge_columns)
+            df = df[~keys.isin(key_index.filter_known(namespace, keys))]
+            if df.empty:
+                logger.info("Every row in `df` is already in the key index for %s, data insertion skipped", namespace)
+                return 0
+            num_inserted = self.insert_data(df, dataset_name, table_name, merge_columns=merge_columns)
+            key_index.add(namespace, make_keys(df, merge_columns))
+            return num_inserted
+
+        schema = self._load_schema(dataset_name, table_name)
+        schema_columns = [f['name'] for f in schema]
+        unknown_columns = [c for c in df.columns if c not in schema_columns]
+        if unknown_columns:
+            raise ValueError(f"Columns {unknown_columns} aren't in the schema of {self._make_table_id(dataset_name, table_name)}")
+
+        # Line the data up with the table's schema, the way a BigQuery load would
+        select = ', '.join(
+            f'CAST("{f["name"]}" AS {self._column_type(f)}) AS "{f["name"]}"' if f['name'] in df.columns
+            else f'CAST(NULL AS {self._column_type(f)}) AS "{f["name"]}"'
+            for f in schema
+        )
+        query = f"SELECT {select} FROM df"
+        if merge_columns is not None:
+            if isinstance(merge_columns, str):
+                merge_columns = [merge_columns]
+            keys = ', '.join(f'"{c}"' for c in merge_columns)
+            query = f"""
+            SELECT * FROM ({query}) new
+            WHERE true
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY {keys}) = 1
+            """
+            query = f"""
+            SELECT new.* FROM ({query}) new
+            ANTI JOIN {self._source_sql(dataset_name, table_name)} existing USING ({keys})
+            """
+
+        relation = self.connection.sql(query)
+        num_rows = relation.aggregate('count(*)').fetchone()[0]
+        if num_rows == 0:
+            logger.info("No new rows detected in `df` when merging on columns %s", merge_columns)
+            return 0
+
+        path = os.path.join(self._table_directory(dataset_name, table_name), f"{uuid4().hex}.parquet")
+        # Write-then-rename so readers never see a half-written file
+        relation.write_parquet(path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+
+        logger.info("Loaded %s rows to %s", num_rows, self._make_table_id(dataset_name, table_name))
+        return num_rows
+
+    def merge_data(
+        self,
+        df: pd.DataFrame,
+        dataset_name: str,
+        table_name: str,
+        merge_columns: Union[str, List[str]],
+        timeout: int = None
+    ) -> int:
+        return self.insert_data(df, dataset_name, table_name, merge_columns=merge_columns)
+
+    def clear_table(
+        self,
+        dataset_name: str,
+        table_name: str
+    ):
+        for path in glob.glob(os.path.join(self._table_directory(dataset_name, table_name), '*.parquet')):
+            os.remove(path)
+        logger.info("Table %s cleared", self._make_table_id(dataset_name, table_name))
+
+    def table_exists(
+        self,
+        dataset_name: str,
+        table_name: str
+    ) -> bool:
+        return os.path.exists(os.path.join(self._table_directory(dataset_name, table_name), SCHEMA_FILENAME))
+
+    def replace_table(
+        self,
+        df: pd.DataFrame,
+        dataset_name: str,
+        table_name: str,
+        timeout: int = None
+    ) -> int:
+        '''
+        Same as `BigQuery.replace_table()`: the new contents are written before the old files are removed, so the table is never seen empty.
+        '''
+        table_directory = self._table_directory(dataset_name, table_name)
+        old_files = glob.glob(os.path.join(table_directory, '*.parquet'))
+        num_rows = self.insert_data(df, dataset_name, table_name)
+        for path in old_files:
+            os.remove(path)
+        logger.info("Replaced the contents of %s with %s rows", self._make_table_id(dataset_name, table_name), num_rows)
+        return num_rows
+
+    def load_from_uris(
+        self,
+        uris: List[str],
+        dataset_name: str,
+        table_name: str,
+        merge_columns: List[str] = None,
+        max_uris_per_job: int = None,
+        timeout: int = None
+    ) -> int:
+        '''
+        Same as `BigQuery.load_from_uris()`, for local Parquet files such as those staged in a `LocalStagingBucket`. `max_uris_per_job` and `timeout` are accepted for parity and ignored.
+        '''
+        remote_uris = [uri for uri in uris if re.match(r'^[a-z0-9]+://', uri)]
+        if remote_uris:
+            raise ValueError(f"LocalWarehouse can only load local files, got {remote_uris[:3]}")
+        df = pd.concat([pd.read_parquet(uri) for uri in uris], ignore_index=True)
+        # Merges keep one row per key, like the MERGE BigQuery runs
+        return self.insert_data(df, dataset_name, table_name, merge_columns=merge_columns)
+
+    def compact_table(
+        self,
+        dataset_name: str,
+        table_name: str
+    ):
+        '''
+        Rewrites a table's many small Parquet files (one per insert) as one, which keeps queries fast after lots of small checkpoints.
+        '''
+        table_directory = self._table_directory(dataset_name, table_name)
+        files = sorted(glob.glob(os.path.join(table_directory, '*.parquet')))
+        if len(files) <= 1:
+            return
+
+        path = os.path.join(table_directory, f"{uuid4().hex}.parquet")
+        self.connection.sql(f"SELECT * FROM {self._source_sql(dataset_name, table_name)}")\
+            .write_parquet(path + '.tmp', compression='zstd')
+        os.replace(path + '.tmp', path)
+        for f in files:
+            os.remove(f)
+        logger.info("Compacted %s files of %s", len(files), self._make_table_id(dataset_name, table_name))
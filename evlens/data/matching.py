@@ -0,0 +1,241 @@
+from typing import Dict, List, Union
+import re
+
+import numpy as np
+import pandas as pd
+
+from evlens.data.geo import make_ball_tree, EARTH_RADIUS_MILES
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# PlugShare connector type ID: AFDC connector type
+PLUGSHARE_TO_AFDC_CONNECTORS = {
+    '2': 'J1772',
+    '3': 'CHADEMO',
+    '6': 'TESLA',
+    '13': 'J1772COMBO'
+}
+# Bit of each AFDC connector type in a connector set's bitmask
+CONNECTOR_BITS = {
+    'J1772': 1,
+    'CHADEMO': 2,
+    'J1772COMBO': 4,
+    'TESLA': 8,
+    'NEMA1450': 16,
+    'NEMA515': 32,
+    'NEMA520': 64,
+    'J3400': 8 # Same plug as TESLA
+}
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+# Words that don't tell networks apart, e.g. "ChargePoint Network" is "ChargePoint"
+NETWORK_STOPWORDS = {'network', 'networks', 'inc', 'llc', 'charging', 'supercharger', 'destination', 'ev'}
+UNKNOWN_NETWORKS = {'', 'nonnetworked', 'none', 'unknown'}
+
+CROSSWALK_COLUMNS = [
+    'location_id',
+    'afdc_station_id',
+    'distance_miles',
+    'connector_similarity',
+    'network_similarity',
+    'confidence'
+]
+
+
+def normalize_network(name: str) -> str:
+    '''
+    Reduces a charging network name to a key that PlugShare's and AFDC's spellings of it share, e.g. "eVgo Network" and "EVgo" are both "evgo". Returns None for unknown and non-networked stations.
+    '''
+    if name is None or not isinstance(name, str):
+        return None
+    words = re.findall(r'[a-z0-9]+', name.lower().replace('-', ''))
+    key = ''.join(w for w in words if w not in NETWORK_STOPWORDS)
+    return None if key in UNKNOWN_NETWORKS else key
+
+
+def connector_bitmask(connectors: Union[str, List[str]], plugshare_ids: bool = False) -> int:
+    '''
+    Encodes a set of connector types as a bitmask (see CONNECTOR_BITS), from a list or a semicolon-delimited string. 0 means unknown.
+
+    Parameters
+    ----------
+    connectors : Union[str, List[str]]
+        AFDC connector types (e.g. ['J1772COMBO', 'CHADEMO']), or PlugShare connector type IDs if `plugshare_ids` (e.g. "3;6")
+    plugshare_ids : bool, optional
+        If True, `connectors` are PlugShare IDs, by default False
+    '''
+    if isinstance(connectors, str):
+        connectors = connectors.split(';')
+    elif not isinstance(connectors, (list, tuple, np.ndarray)):
+        return 0
+    mask = 0
+    for connector in connectors:
+        connector = str(connector).strip()
+        if plugshare_ids:
+            connector = PLUGSHARE_TO_AFDC_CONNECTORS.get(connector)
+        mask |= CONNECTOR_BITS.get(connector, 0)
+    return mask
+
+
+class StationMatcher:
+    '''
+    Links PlugShare locations to NREL AFDC stations. Candidate pairs come from a ball tree (haversine) radius search around every PlugShare location, so only nearby pairs are ever compared, and each pair is scored on distance, connector type overlap, and network agreement. Pairs are then matched one-to-one, best confidence first.
+    '''
+    def __init__(
+        self,
+        max_distance_miles: float = 0.25,
+        distance_scale_miles: float = 0.05,
+        weights: Dict[str, float] = None,
+        min_confidence: float = 0.5
+    ):
+        '''
+        Parameters
+        ----------
+        max_distance_miles : float, optional
+            Pairs farther apart than this are never matched, by default 0.25
+        distance_scale_miles : float, optional
+            Distance at which the distance score falls to 1/e. Geocodes of the same site typically differ by tens of meters, by default 0.05
+        weights : Dict[str, float], optional
+            Weight of each of 'distance', 'connector', and 'network' in the confidence. Similarities that can't be judged (e.g. a station with no known network) are left out of it, by default {'distance': 0.5, 'connector': 0.3, 'network': 0.2}
+        min_confidence : float, optional
+            Lowest confidence that counts as a match, by default 0.5
+        '''
+        self.max_distance_miles = max_distance_miles
+        self.distance_scale_miles = distance_scale_miles
+        if weights is None:
+            weights = {'distance': 0.5, 'connector': 0.3, 'network': 0.2}
+        self.weights = weights
+        self.min_confidence = min_confidence
+
+    def candidates(
+        self,
+        df_locations: pd.DataFrame,
+        df_stations: pd.DataFrame
+    ) -> pd.DataFrame:
+        '''
+        Scores every (PlugShare location, AFDC station) pair within `max_distance_miles` of each other.
+
+        Parameters
+        ----------
+        df_locations : pd.DataFrame
+            PlugShare locations with 'location_id', 'latitude', 'longitude', and 'plug_types' (semicolon-delimited PlugShare connector IDs) columns, and optionally 'network'
+        df_stations : pd.DataFrame
+            AFDC stations (see `AFDC.get_stations()`) with 'id', 'latitude', 'longitude', and 'ev_connector_types' columns, and optionally 'ev_network'
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per pair, with CROSSWALK_COLUMNS
+        '''
+        df_locations = df_locations.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+        df_stations = df_stations.dropna(subset=['latitude', 'longitude']).reset_index(drop=True)
+        if df_locations.empty or df_stations.empty:
+            return pd.DataFrame(columns=CROSSWALK_COLUMNS)
+
+        tree = make_ball_tree(df_stations['latitude'].to_numpy(dtype=float), df_stations['longitude'].to_numpy(dtype=float))
+        station_indices, distances = tree.query_radius(
+            np.radians(df_locations[['latitude', 'longitude']].to_numpy(dtype=float)),
+            r=self.max_distance_miles / EARTH_RADIUS_MILES,
+            return_distance=True
+        )
+        location_indices = np.repeat(np.arange(len(df_locations)), [len(s) for s in station_indices])
+        station_indices = np.concatenate(station_indices).astype(int)
+        distances = np.concatenate(distances) * EARTH_RADIUS_MILES
+
+        # Connector sets as bitmasks, so overlap is a couple of array operations over every pair
+        location_masks = np.array([connector_bitmask(p, plugshare_ids=True) for p in df_locations['plug_types']], dtype=np.int64)
+        station_masks = np.array([connector_bitmask(c) for c in df_stations['ev_connector_types']], dtype=np.int64)
+        a = location_masks[location_indices]
+        b = station_masks[station_indices]
+        union = _POPCOUNT[a | b]
+        connector_similarity = np.where(
+            (a == 0) | (b == 0),
+            np.nan,
+            _POPCOUNT[a & b] / np.maximum(union, 1)
+        )
+
+        network_similarity = np.full(len(location_indices), np.nan)
+        if 'network' in df_locations.columns and 'ev_network' in df_stations.columns:
+            # Shared categories so network keys compare as integer codes
+            location_networks = df_locations['network'].map(normalize_network)
+            station_networks = df_stations['ev_network'].map(normalize_network)
+            categories = pd.Index(pd.concat([location_networks, station_networks]).dropna().unique())
+            location_codes = pd.Categorical(location_networks, categories=categories).codes[location_indices]
+            station_codes = pd.Categorical(station_networks, categories=categories).codes[station_indices]
+            network_similarity = np.where(
+                (location_codes < 0) | (station_codes < 0),
+                np.nan,
+                (location_codes == station_codes).astype(float)
+            )
+
+        df_candidates = pd.DataFrame({
+            'location_id': df_locations['location_id'].astype(str).to_numpy()[location_indices],
+            'afdc_station_id': df_stations['id'].to_numpy()[station_indices],
+            'distance_miles': distances,
+            'connector_similarity': connector_similarity,
+            'network_similarity': network_similarity
+        })
+        df_candidates['confidence'] = self.score(df_candidates)
+        return df_candidates
+
+    def score(self, df_candidates: pd.DataFrame) -> np.ndarray:
+        '''
+        Confidence in [0, 1] that each candidate pair is the same site: the weighted average of its distance score and whichever similarities could be judged.
+        '''
+        scores = {
+            'distance': np.exp(-df_candidates['distance_miles'].to_numpy() / self.distance_scale_miles),
+            'connector': df_candidates['connector_similarity'].to_numpy(),
+            'network': df_candidates['network_similarity'].to_numpy()
+        }
+        total = np.zeros(len(df_candidates))
+        total_weight = np.zeros(len(df_candidates))
+        for component, score in scores.items():
+            known = ~np.isnan(score)
+            total += np.where(known, self.weights.get(component, 0) * np.nan_to_num(score), 0)
+            total_weight += np.where(known, self.weights.get(component, 0), 0)
+        return total / np.maximum(total_weight, 1e-12)
+
+    def match(
+        self,
+        df_locations: pd.DataFrame,
+        df_stations: pd.DataFrame
+    ) -> pd.DataFrame:
+        '''
+        Builds a crosswalk between PlugShare locations and AFDC stations. Each location and each station is in at most one match, taken in order of confidence.
+
+        Parameters
+        ----------
+        df_locations : pd.DataFrame
+            PlugShare locations, see `candidates()`
+        df_stations : pd.DataFrame
+            AFDC stations, see `candidates()`
+
+        Returns
+        -------
+        pd.DataFrame
+            Matches with CROSSWALK_COLUMNS and at least `min_confidence` confidence, best first
+        '''
+        df_candidates = self.candidates(df_locations, df_stations)
+        df_candidates = df_candidates[df_candidates['confidence'] >= self.min_confidence]\
+            .sort_values(['confidence', 'distance_miles'], ascending=[False, True], kind='stable')
+
+        matched_locations = set()
+        matched_stations = set()
+        keep = np.zeros(len(df_candidates), dtype=bool)
+        for i, (location_id, station_id) in enumerate(zip(df_candidates['location_id'], df_candidates['afdc_station_id'])):
+            if location_id in matched_locations or station_id in matched_stations:
+                continue
+            matched_locations.add(location_id)
+            matched_stations.add(station_id)
+            keep[i] = True
+
+        df_crosswalk = df_candidates[keep].reset_index(drop=True)
+        logger.info(
+            "Matched %s of %s PlugShare locations to AFDC stations (%s candidate pairs)",
+            len(df_crosswalk),
+            len(df_locations),
+            len(df_candidates)
+        )
+        return df_crosswalk
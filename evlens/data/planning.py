@@ -0,0 +1,386 @@
+from typing import List, Tuple, Iterable
+from datetime import timedelta
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from evlens import get_current_datetime
+from evlens.data.google_cloud import BigQuery
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# Why a location is worth re-scraping, most compelling first
+CHANGE_REASONS = [
+    'new',
+    'under_repair_changed',
+    'plug_types_changed',
+    'stale'
+]
+
+
+def region_snapshot(df_region: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Turns raw `v3/locations/region` results into a snapshot in the form of the locationID table, so a fresh map search can be planned against without saving it first.
+
+    Parameters
+    ----------
+    df_region : pd.DataFrame
+        One row per location from the region API response (e.g. `pd.DataFrame(loads(body))`)
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns location_id, plug_types, under_repair, and parsed_datetime (the current UTC time)
+    '''
+    df = pd.DataFrame({
+        'location_id': df_region['id'].astype(str),
+        'plug_types': df_region['connector_types'].str.join(';'),
+        'under_repair': df_region['under_repair']
+    })
+    df['parsed_datetime'] = pd.Timestamp(get_current_datetime(date_delimiter=None, time_delimiter=None))
+    return df.drop_duplicates(subset=['location_id'])
+
+
+def _sorted_plug_types(plug_types: pd.Series) -> pd.Series:
+    # Same plugs listed in a different order shouldn't count as a change
+    return plug_types.fillna('').astype(str).str.split(';').map(lambda p: ';'.join(sorted(p)))
+
+
+class ChangeDetectionPlanner:
+    '''
+    Decides which locations are worth sending to `MainMapScraper.run()` by comparing the cheap signals from map searches (the locationID table) against what we last stored, instead of revisiting every location every time.
+    '''
+    def __init__(
+        self,
+        max_staleness: timedelta = timedelta(days=30),
+        dataset_name: str = 'plugshare',
+        bq_client: BigQuery = None
+    ):
+        '''
+        Parameters
+        ----------
+        max_staleness : timedelta, optional
+            Locations not scraped for this long are re-scraped even if nothing looks different, to catch the changes we have no cheap signal for, by default 30 days
+        dataset_name : str, optional
+            BigQuery dataset with the locationID and stations tables, by default 'plugshare'
+        bq_client : BigQuery, optional
+            Client used by `load_snapshots()`. If None, one is created when first needed, by default None
+        '''
+        self.max_staleness = max_staleness
+        self.dataset_name = dataset_name
+        self._bq_client = bq_client
+
+    @property
+    def bq_client(self) -> BigQuery:
+        if self._bq_client is None:
+            self._bq_client = BigQuery(project='evlens')
+        return self._bq_client
+
+    def load_snapshots(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''
+        Pulls the latest and second-latest map search results for every location, along with the last stored scrape of each, from BigQuery.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+            (current snapshot, previous snapshot, stations)
+        '''
+        location_ids_table = self.bq_client._make_table_id(self.dataset_name, 'locationID')
+        stations_table = self.bq_client._make_table_id(self.dataset_name, 'stations')
+
+        query = f"""
+        SELECT location_id, parsed_datetime, plug_types, under_repair, snapshot_rank
+        FROM (
+            SELECT
+                location_id,
+                parsed_datetime,
+                plug_types,
+                under_repair,
+                ROW_NUMBER() OVER (PARTITION BY location_id ORDER BY parsed_datetime DESC) AS snapshot_rank
+            FROM `{location_ids_table}`
+        )
+        WHERE snapshot_rank <= 2
+        """
+        df_snapshots = self.bq_client.query_to_dataframe(query)
+        df_current = df_snapshots[df_snapshots['snapshot_rank'] == 1].drop(columns=['snapshot_rank'])
+        df_previous = df_snapshots[df_snapshots['snapshot_rank'] == 2].drop(columns=['snapshot_rank'])
+
+        query = f"""
+        SELECT location_id, last_scraped
+        FROM `{stations_table}`
+        WHERE true
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY location_id ORDER BY last_scraped DESC) = 1
+        """
+        df_stations = self.bq_client.query_to_dataframe(query)
+
+        return df_current, df_previous, df_stations
+
+    def find_changes(
+        self,
+        df_current: pd.DataFrame,
+        df_stations: pd.DataFrame,
+        df_previous: pd.DataFrame = None,
+        now: pd.Timestamp = None
+    ) -> pd.DataFrame:
+        '''
+        Flags every location in the current snapshot that is likely to have changed since we last stored it.
+
+        Parameters
+        ----------
+        df_current : pd.DataFrame
+            Latest map search results, one row per location. Needs location_id, parsed_datetime, plug_types, and under_repair columns (see `region_snapshot()`)
+        df_stations : pd.DataFrame
+            Last stored scrape of each location, with location_id and last_scraped columns
+        df_previous : pd.DataFrame, optional
+            Map search results from the run before `df_current`, in the same form. If None, plug and repair changes can't be detected. Changes between the two are only flagged for locations last scraped before `df_current` was parsed, since a later scrape already picked them up, by default None
+        now : pd.Timestamp, optional
+            Reference time for staleness. If None, uses the current UTC time, by default None
+
+        Returns
+        -------
+        pd.DataFrame
+            location_id and reason (the first of CHANGE_REASONS that applies) for each location worth re-scraping
+        '''
+        if now is None:
+            now = get_current_datetime(date_delimiter=None, time_delimiter=None)
+        now = pd.Timestamp(now)
+        if now.tzinfo is None:
+            now = now.tz_localize('UTC')
+
+        df = df_current.copy()
+        df['location_id'] = df['location_id'].astype(str)
+
+        stations = df_stations[['location_id', 'last_scraped']].copy()
+        stations['location_id'] = stations['location_id'].astype(str)
+        df = df.merge(stations, on='location_id', how='left')
+        last_scraped = pd.to_datetime(df['last_scraped'], utc=True)
+
+        if df_previous is not None and not df_previous.empty:
+            previous = df_previous[['location_id', 'plug_types', 'under_repair']].copy()
+            previous['location_id'] = previous['location_id'].astype(str)
+            df = df.merge(previous, on='location_id', how='left', suffixes=('', '_previous'))
+            # Locations scraped since the latest search already have its changes stored
+            seen_before = df['plug_types_previous'].notnull() \
+                & (last_scraped < pd.to_datetime(df['parsed_datetime'], utc=True))
+            under_repair_changed = seen_before & (
+                df['under_repair'].fillna(False).astype(bool)
+                != df['under_repair_previous'].fillna(False).astype(bool)
+            )
+            plug_types_changed = seen_before & (
+                _sorted_plug_types(df['plug_types']) != _sorted_plug_types(df['plug_types_previous'])
+            )
+        else:
+            under_repair_changed = pd.Series(False, index=df.index)
+            plug_types_changed = pd.Series(False, index=df.index)
+
+        stale = last_scraped.isnull() | (now - last_scraped > self.max_staleness)
+
+        conditions = [
+            # last_scraped is required in the stations table, so missing means never stored
+            df['last_scraped'].isnull(),
+            under_repair_changed,
+            plug_types_changed,
+            stale
+        ]
+        df['reason'] = np.select(
+            [c.fillna(False).astype(bool).values for c in conditions],
+            CHANGE_REASONS,
+            default=None
+        )
+
+        df_changes = df.loc[df['reason'].notnull(), ['location_id', 'reason']].reset_index(drop=True)
+        logger.info(
+            "%s of %s locations likely changed: %s",
+            len(df_changes),
+            len(df),
+            df_changes['reason'].value_counts().to_dict()
+        )
+        return df_changes
+
+    def plan(self) -> List[str]:
+        '''
+        Loads the snapshots from BigQuery and returns the location IDs worth re-scraping, for `MainMapScraper.run()`.
+        '''
+        df_current, df_previous, df_stations = self.load_snapshots()
+        return self.find_changes(df_current, df_stations, df_previous)['location_id'].tolist()
+
+
+class RescrapeScheduler:
+    '''
+    Builds the run queue for a crawl with a fixed time budget as a priority heap, so the budget goes to the locations where our copy is most likely out of date (busy or flaky sites we haven't seen in a while) instead of being spread evenly over dormant ones.
+
+    A location's priority is roughly the number of check-ins it has likely gotten since we last scraped it: days since `last_scraped` times its recent check-in rate, with extra weight for recently-reported problems and a small base rate so that dormant locations still come up eventually. Locations we've never scraped come first.
+    '''
+    def __init__(
+        self,
+        seconds_per_location: float = 10.0,
+        base_checkins_per_day: float = 0.05,
+        problem_weight: float = 1.0,
+        activity_window: timedelta = timedelta(days=90),
+        dataset_name: str = 'plugshare',
+        bq_client: BigQuery = None
+    ):
+        '''
+        Parameters
+        ----------
+        seconds_per_location : float, optional
+            Expected time for one worker to scrape one location, used to fit the queue to the time budget, by default 10 seconds
+        base_checkins_per_day : float, optional
+            Check-in rate assumed for every location on top of its observed one, so that staleness alone eventually gets a location scheduled, by default 0.05
+        problem_weight : float, optional
+            Extra check-ins per day each problem report in `activity_window` counts as, by default 1.0
+        activity_window : timedelta, optional
+            How far back check-ins and problem reports count towards activity, by default 90 days
+        dataset_name : str, optional
+            BigQuery dataset with the stations, evses, and checkins tables, by default 'plugshare'
+        bq_client : BigQuery, optional
+            Client used by `load_signals()`. If None, one is created when first needed, by default None
+        '''
+        if seconds_per_location <= 0:
+            raise ValueError("`seconds_per_location` must be positive")
+        self.seconds_per_location = seconds_per_location
+        self.base_checkins_per_day = base_checkins_per_day
+        self.problem_weight = problem_weight
+        self.activity_window = activity_window
+        self.dataset_name = dataset_name
+        self._bq_client = bq_client
+
+    @property
+    def bq_client(self) -> BigQuery:
+        if self._bq_client is None:
+            self._bq_client = BigQuery(project='evlens')
+        return self._bq_client
+
+    def load_signals(self) -> pd.DataFrame:
+        '''
+        Pulls when each location was last scraped along with its check-in and problem report counts over `activity_window` from BigQuery.
+
+        Returns
+        -------
+        pd.DataFrame
+            location_id, last_scraped, recent_checkins, and recent_problems
+        '''
+        stations_table = self.bq_client._make_table_id(self.dataset_name, 'stations')
+        evses_table = self.bq_client._make_table_id(self.dataset_name, 'evses')
+        checkins_table = self.bq_client._make_table_id(self.dataset_name, 'checkins')
+        window_days = self.activity_window.days
+
+        query = f"""
+        WITH latest AS (
+            SELECT location_id, MAX(last_scraped) AS last_scraped
+            FROM `{stations_table}`
+            GROUP BY location_id
+        ),
+        activity AS (
+            SELECT
+                e.station_id AS location_id,
+                COUNT(DISTINCT c.id) AS recent_checkins,
+                COUNT(DISTINCT IF(c.problem IS NOT NULL, c.id, NULL)) AS recent_problems
+            FROM `{checkins_table}` c
+            JOIN `{evses_table}` e ON c.evse_id = e.id
+            WHERE c.created_at >= CURRENT_TIMESTAMP - INTERVAL {window_days} DAY
+            GROUP BY location_id
+        )
+        SELECT
+            latest.location_id,
+            latest.last_scraped,
+            IFNULL(activity.recent_checkins, 0) AS recent_checkins,
+            IFNULL(activity.recent_problems, 0) AS recent_problems
+        FROM latest
+        LEFT JOIN activity USING (location_id)
+        """
+        return self.bq_client.query_to_dataframe(query)
+
+    def score(
+        self,
+        df_signals: pd.DataFrame,
+        now: pd.Timestamp = None
+    ) -> pd.Series:
+        '''
+        Priority of each location in `df_signals` (higher is more urgent), indexed like it.
+
+        Parameters
+        ----------
+        df_signals : pd.DataFrame
+            Output of `load_signals()`. last_scraped may be missing for locations we've never scraped, and recent_checkins/recent_problems default to 0.
+        now : pd.Timestamp, optional
+            Reference time for staleness. If None, uses the current UTC time, by default None
+        '''
+        if now is None:
+            now = get_current_datetime(date_delimiter=None, time_delimiter=None)
+        now = pd.Timestamp(now)
+        if now.tzinfo is None:
+            now = now.tz_localize('UTC')
+
+        window_days = self.activity_window / timedelta(days=1)
+        checkins = df_signals.get('recent_checkins', pd.Series(0, index=df_signals.index)).fillna(0)
+        problems = df_signals.get('recent_problems', pd.Series(0, index=df_signals.index)).fillna(0)
+        checkins_per_day = self.base_checkins_per_day \
+            + (checkins + self.problem_weight * problems) / window_days
+
+        last_scraped = pd.to_datetime(df_signals['last_scraped'], utc=True)
+        days_stale = ((now - last_scraped) / timedelta(days=1)).clip(lower=0)
+
+        priority = days_stale * checkins_per_day
+        return priority.fillna(np.inf)
+
+    def schedule(
+        self,
+        df_signals: pd.DataFrame,
+        time_budget: timedelta,
+        n_workers: int = 1,
+        location_ids: Iterable[str] = None,
+        now: pd.Timestamp = None
+    ) -> List[str]:
+        '''
+        Pops locations off a priority heap until the run's time budget is used up.
+
+        Parameters
+        ----------
+        df_signals : pd.DataFrame
+            Output of `load_signals()`, plus any locations never scraped before (with last_scraped missing)
+        time_budget : timedelta
+            Wall-clock time the run is allowed to take
+        n_workers : int, optional
+            Number of scrapers running in parallel (e.g. `n_jobs` of `parallelized_data_processing()`), by default 1
+        location_ids : Iterable[str], optional
+            Only schedule these locations, e.g. the output of `ChangeDetectionPlanner.plan()`. Any missing from `df_signals` are treated as never scraped. If None, every location in `df_signals` is a candidate, by default None
+        now : pd.Timestamp, optional
+            Reference time for staleness. If None, uses the current UTC time, by default None
+
+        Returns
+        -------
+        List[str]
+            Location IDs to scrape, most urgent first
+        '''
+        df = df_signals.copy()
+        df['location_id'] = df['location_id'].astype(str)
+        if location_ids is not None:
+            location_ids = set(str(i) for i in location_ids)
+            df = df[df['location_id'].isin(location_ids)]
+            # Candidates without signals (e.g. planned as 'new') have never been scraped
+            never_scraped = sorted(location_ids - set(df['location_id']))
+            df = pd.concat([df, pd.DataFrame({'location_id': never_scraped})], ignore_index=True)
+        df = df.drop_duplicates(subset=['location_id'])
+        df['priority'] = self.score(df, now=now)
+
+        # heapq is a min-heap, so negate. Location ID breaks ties for a deterministic order.
+        heap = list(zip(-df['priority'], df['location_id']))
+        heapq.heapify(heap)
+
+        num_slots = int(time_budget.total_seconds() * n_workers // self.seconds_per_location)
+        scheduled = []
+        while heap and len(scheduled) < num_slots:
+            scheduled.append(heapq.heappop(heap)[1])
+
+        logger.info(
+            "Scheduled %s of %s locations for a %s budget across %s workers",
+            len(scheduled),
+            len(df),
+            time_budget,
+            n_workers
+        )
+        return scheduled
@@ -1,11 +1,15 @@
-from time import sleep
+from time import sleep, time, monotonic
+from collections import deque
+from threading import Condition
 import pandas as pd
 import numpy as np
 import os
 import re
-from typing import Tuple, Set, Union, List
-from urllib.parse import urlparse
+from typing import Tuple, Set, Union, List, Literal, Dict, Iterator
+from functools import partial
+from urllib.parse import urlparse, parse_qs
 
+import json
 from json import loads
 
 # from selenium import webdriver
@@ -30,10 +34,18 @@ from selenium.webdriver.chrome.service import Service
 
 from tqdm import tqdm
 import ray
+from ray.util.queue import Queue
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tenacity import retry, wait_random_exponential, stop_after_delay, stop_after_attempt
 
 from evlens import get_current_datetime
-from evlens.data.google_cloud import upload_file, BigQuery
+from evlens.data.google_cloud import get_background_uploader, BigQuery
+from evlens.data.plugshare_parsing import LocationBatchParser, LocationTableWriter
+from evlens.data.archive import ResponseArchive
+from evlens.data.bulk_load import StagedBulkLoader
+from evlens.data.error_capture import ErrorCapture
 
 from evlens.logs import setup_logger
 logger = setup_logger(__name__)
@@ -54,6 +66,91 @@ ALLOWABLE_PLUG_TYPES = [
 ]
 
 EMBEDDED_DEV_MAP_URL = 'https://developer.plugshare.com/embed'
+PLUGSHARE_API_URL = 'https://api.plugshare.com/v3/'
+COOKIE_DIALOG_LOCATOR = (By.ID, "global-consent-notice")
+LOCATION_API_PATTERN = r'https://api\.plugshare\.com/v3/locations/(\d+)(?:\?|$)'
+REGION_API_PATTERN = r'https://api\.plugshare\.com/v3/locations/region\?'
+LOGIN_DIALOG_EXIT_LOCATOR = (By.XPATH, "//*[@id=\"dialogContent_authenticate\"]/button")
+# Names of the cookies that hold a cookie consent choice. Only these are saved across browser sessions, never session or login cookies
+CONSENT_COOKIE_NAME_PATTERN = r'consent|optanon|euconsent|gdpr|cookie_?notice|_tcf'
+MILES_PER_DEGREE_LATITUDE = 69.0
+# Quadrant name: (north/south, east/west) offset direction of its center
+SEARCH_QUADRANTS = {'ne': (1, 1), 'nw': (1, -1), 'sw': (-1, -1), 'se': (-1, 1)}
+BROWSER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.53 Safari/537.36'
+
+
+def make_api_headers(
+    user_agent: str = BROWSER_USER_AGENT,
+    authorization: str = None
+) -> Dict[str, str]:
+    '''
+    Headers that make direct (browserless) PlugShare API calls look like the ones the web app sends.
+
+    Parameters
+    ----------
+    user_agent : str, optional
+        User-Agent header to send, by default the same one we spoof in Chrome
+    authorization : str, optional
+        Value for the Authorization header the PlugShare web app sends with its API calls. If None, will try the PLUGSHARE_API_AUTH environment variable and send nothing if that isn't set either, by default None
+    '''
+    if authorization is None:
+        authorization = os.getenv('PLUGSHARE_API_AUTH', None)
+        
+    headers = {
+        'User-Agent': user_agent,
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+        'Origin': 'https://www.plugshare.com',
+        'Referer': 'https://www.plugshare.com/'
+    }
+    if authorization is not None:
+        headers['Authorization'] = authorization
+        
+    return headers
+
+
+def make_http_session(
+    pool_size: int = 10,
+    max_retries: int = 3,
+    user_agent: str = BROWSER_USER_AGENT,
+    authorization: str = None
+) -> requests.Session:
+    '''
+    Builds a keep-alive HTTP session for talking to the PlugShare API directly (no browser).
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Number of connections to keep open per host, by default 10
+    max_retries : int, optional
+        How many times to retry connection errors and 429/5xx responses (with exponential backoff) before giving up, by default 3
+    user_agent : str, optional
+        User-Agent header to send, by default the same one we spoof in Chrome
+    authorization : str, optional
+        Passed to `make_api_headers()`, by default None
+
+    Returns
+    -------
+    requests.Session
+        Session with pooled connections, ready to be shared across many location requests
+    '''
+    session = requests.Session()
+    retry_strategy = Retry(
+        total=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET']
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry_strategy
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(make_api_headers(user_agent, authorization))
+
+    return session
 
 
 class CheckIn:
@@ -64,31 +161,24 @@ class CheckIn:
         self,
         checkin_element: WebElement,
         error_screenshot_savepath: str = None,
-        error_screenshot_save_bucket: str = 'plugshare_scraping'
+        error_screenshot_save_bucket: str = 'plugshare_scraping',
+        error_capture: ErrorCapture = None
     ):
         self.element = checkin_element
         self.error_screenshot_savepath = error_screenshot_savepath
         self.error_screenshot_save_bucket = error_screenshot_save_bucket
+        if error_capture is None:
+            # Shared by every check-in in the process so sampling and rate limits apply across them
+            error_capture = ErrorCapture.shared(error_screenshot_savepath, error_screenshot_save_bucket)
+        self.error_capture = error_capture
         
     def save_error_screenshot(self, filename: str):
-        filename = get_current_datetime() \
-            + '_' + str(os.getpid()) + '_' + filename
-            
-        if self.error_screenshot_savepath is None:
+        '''
+        Captures the page for the failure named by `filename` (e.g. "checkin_parsing_error.png"), unless `error_capture` suppresses it.
+        '''
+        if self.error_capture.savepath is None:
             raise ValueError("`error_screenshot_savepath` must not be None")
-        path = os.path.join(self.error_screenshot_savepath, filename)
-        self.element.driver.save_screenshot(path)
-        if self.error_screenshot_save_bucket is not None:
-            upload_file(
-                self.error_screenshot_save_bucket,
-                path,
-                "errors/" + filename
-            )
-            os.remove(path)
-        else:
-            logger.error(
-                "No savepath or GCP bucket provided for error screenshot."
-                )
+        self.error_capture.capture(os.path.splitext(filename)[0], self.element.driver)
             
     @classmethod
     def _get_power_number(cls, text: str) -> int:
@@ -182,6 +272,162 @@ class CheckIn:
         return df_out
     
 
+# Things the location and map pages load that play no part in triggering the
+# v3/locations and v3/locations/region API calls
+DEFAULT_BLOCKED_URL_PATTERNS = [
+    # Images, fonts, and stylesheets
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.css',
+    # Map tiles and imagery (pins come from the API, not the tiles)
+    '*maps.googleapis.com/maps/vt*', '*maps.googleapis.com/maps/api/staticmap*',
+    '*khms*.googleapis.com*', '*maps.gstatic.com/mapfiles/*',
+    # Analytics, ads, and trackers
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*googlesyndication.com*', '*googleadservices.com*', '*adservice.google.com*',
+    '*amazon-adsystem.com*', '*facebook.net*', '*facebook.com/tr*',
+    '*hotjar.com*', '*segment.io*', '*segment.com*', '*sentry.io*',
+    '*branch.io*', '*intercom.io*', '*clarity.ms*'
+]
+
+
+class ResourceBlockingProfile():
+    '''
+    Controls which network requests a scraping browser is allowed to make, so it only downloads what is needed to trigger the PlugShare API calls we capture.
+    '''
+    def __init__(
+        self,
+        blocked_url_patterns: List[str] = DEFAULT_BLOCKED_URL_PATTERNS,
+        allowed_url_patterns: List[str] = None,
+        report_bytes: bool = False
+    ):
+        '''
+        Parameters
+        ----------
+        blocked_url_patterns : List[str], optional
+            URL wildcard patterns (`*` matches anything) that Chrome refuses to load, applied via CDP `Network.setBlockedURLs`, by default DEFAULT_BLOCKED_URL_PATTERNS
+        allowed_url_patterns : List[str], optional
+            If not None, regexes for the only URLs the browser may load (e.g. just the plugshare.com documents/scripts and the API). Everything else is aborted via selenium-wire request interception, which means every request has to pass through the interception proxy, by default None
+        report_bytes : bool, optional
+            If True, reads Chrome's network events after each page to report bytes transferred, requests blocked, and bytes saved relative to an unblocked baseline page load (made once at the start of every `MainMapScraper.run()`), by default False
+        '''
+        self.blocked_url_patterns = blocked_url_patterns if blocked_url_patterns is not None else []
+        self.allowed_url_patterns = allowed_url_patterns
+        self.report_bytes = report_bytes
+        
+    def is_allowed(self, url: str) -> bool:
+        if self.allowed_url_patterns is None:
+            return True
+        return any(re.match(pattern, url) for pattern in self.allowed_url_patterns)
+        
+    def __str__(self):
+        out = f"Resource blocking profile with {len(self.blocked_url_patterns)} blocked URL patterns"
+        if self.allowed_url_patterns is not None:
+            out += f" and an allowlist of {len(self.allowed_url_patterns)} URL patterns"
+        return out + "."
+    
+    def __repr__(self):
+        return str(self)
+
+
+class LocationResponseRouter():
+    '''
+    Matches location API responses, caught on selenium-wire's proxy thread, to the tabs waiting on them in pipelined (multi-tab) scraping, by location ID.
+
+    Each awaited location gets `timeout` seconds of waiting, counted only while the router isn't paused. The scraper pauses it while its caller processes (and maybe saves) a result, so a slow checkpoint doesn't use up the time of pages still loading in other tabs.
+    '''
+    def __init__(self):
+        self._condition = Condition()
+        # location ID: (time it was launched, total time paused as of then)
+        self._awaited: Dict[str, Tuple[float, float]] = dict()
+        # location ID: (status code, body or None if not a 200)
+        self._captured: Dict[str, Tuple[int, bytes]] = dict()
+        self._paused_total = 0.0
+        self._paused_since = None
+        
+    def _paused_time(self) -> float:
+        if self._paused_since is None:
+            return self._paused_total
+        return self._paused_total + monotonic() - self._paused_since
+        
+    def expect(self, location_id: str):
+        '''
+        Starts the clock on a location whose page was just launched.
+        '''
+        with self._condition:
+            self._awaited[location_id] = (monotonic(), self._paused_time())
+            
+    def is_expected(self, location_id: str) -> bool:
+        with self._condition:
+            return location_id in self._awaited
+        
+    def deliver(
+        self,
+        location_id: str,
+        status_code: int,
+        body: bytes
+    ) -> bool:
+        '''
+        Hands a caught response to whoever is waiting on its location.
+
+        Returns
+        -------
+        bool
+            True if the location was being waited on, False if the response was ignored
+        '''
+        with self._condition:
+            if location_id not in self._awaited:
+                return False
+            self._captured[location_id] = (status_code, body)
+            self._condition.notify_all()
+            return True
+        
+    def pause(self):
+        with self._condition:
+            if self._paused_since is None:
+                self._paused_since = monotonic()
+            
+    def resume(self):
+        with self._condition:
+            if self._paused_since is not None:
+                self._paused_total += monotonic() - self._paused_since
+                self._paused_since = None
+                
+    def time_left(self, location_id: str, timeout: float) -> float:
+        '''
+        Seconds of `timeout` an awaited location has left, not counting time spent paused since it was launched.
+        '''
+        with self._condition:
+            launched, paused_at_launch = self._awaited[location_id]
+            waited = monotonic() - launched - (self._paused_time() - paused_at_launch)
+        return max(0, timeout - waited)
+            
+    def wait(
+        self,
+        location_id: str,
+        timeout: float
+    ) -> Tuple[int, bytes]:
+        '''
+        Waits for the response to an expected location, for whatever is left of its `timeout`, and stops expecting it.
+
+        Returns
+        -------
+        Tuple[int, bytes]
+            (status code, body or None if not a 200), or None if nothing came back in time
+        '''
+        with self._condition:
+            self._condition.wait_for(
+                lambda: location_id in self._captured,
+                timeout=self.time_left(location_id, timeout)
+            )
+            self._awaited.pop(location_id, None)
+            return self._captured.pop(location_id, None)
+        
+    def clear(self):
+        with self._condition:
+            self._awaited.clear()
+            self._captured.clear()
+
+
 class SearchCriterion():
     def __init__(
         self,
@@ -190,7 +436,9 @@ class SearchCriterion():
         radius_in_miles: float,
         search_cell_id: str,
         search_cell_id_type: str,
-        wait_time_for_map_pan: float
+        wait_time_for_map_pan: float,
+        depth: int = 0,
+        root_cell_id: str = None
     ):
         self.cell_id = search_cell_id
         self.cell_type = search_cell_id_type # Can be "NREL" or "Manual"
@@ -198,6 +446,35 @@ class SearchCriterion():
         self.longitude = longitude
         self.radius = radius_in_miles
         self.time_to_pan = wait_time_for_map_pan
+        self.depth = depth
+        # ID of the search tile this cell was split from (see `split()`), i.e. what its results are saved under
+        self.root_cell_id = search_cell_id if root_cell_id is None else root_cell_id
+        
+    def split(self) -> List['SearchCriterion']:
+        '''
+        Splits this search circle into four circles of radius r/sqrt(2), centered on the quadrants of the square around it, so together they cover all of it (and a bit more).
+
+        Returns
+        -------
+        List[SearchCriterion]
+            Children with cell IDs "<this cell ID>/<quadrant>", e.g. "1234/ne", and this cell's type and root cell ID
+        '''
+        offset = self.radius / 2
+        latitude_offset = offset / MILES_PER_DEGREE_LATITUDE
+        longitude_offset = offset / (MILES_PER_DEGREE_LATITUDE * np.cos(np.radians(self.latitude)))
+        return [
+            SearchCriterion(
+                latitude=round(self.latitude + north * latitude_offset, 6),
+                longitude=round(self.longitude + east * longitude_offset, 6),
+                radius_in_miles=round(self.radius / np.sqrt(2), 3),
+                search_cell_id=f"{self.cell_id}/{quadrant}",
+                search_cell_id_type=self.cell_type,
+                wait_time_for_map_pan=self.time_to_pan,
+                depth=self.depth + 1,
+                root_cell_id=self.root_cell_id
+            )
+            for quadrant, (north, east) in SEARCH_QUADRANTS.items()
+        ]
         
     def __str__(self):
         out = f"Search cell of type '{self.cell_type}' at lat/long ({self.latitude}, {self.longitude}), with a search radius of {self.radius} miles."
@@ -207,7 +484,7 @@ class SearchCriterion():
     def __repr__(self):
         return str(self)
 
-class MainMapScraper:
+class MainMapScraper(LocationTableWriter):
 
     def __init__(
         self,
@@ -215,27 +492,153 @@ class MainMapScraper:
         error_screenshot_save_bucket: str = 'plugshare_scraping',
         save_every: int = 100,
         timeout: int = 3,
-        page_load_pause: int = 1,
+        page_load_pause: float = 0,
         headless: bool = True,
         progress_bars: bool = True,
-        selenium_wire_scopes: Union[str, List[str]] = 'https://api.plugshare.com/v3/locations/'
+        selenium_wire_scopes: Union[str, List[str]] = 'https://api.plugshare.com/v3/locations/',
+        fetch_mode: Literal['browser', 'http'] = 'browser',
+        api_base_url: str = PLUGSHARE_API_URL,
+        http_pool_size: int = 10,
+        consent_cookie_path: str = None,
+        dialog_probe_timeout: float = 0.5,
+        page_load_strategy: str = 'eager',
+        network_idle_time: float = 0.5,
+        n_tabs: int = 1,
+        resource_blocking: ResourceBlockingProfile = None,
+        archive_path: str = None,
+        parse_responses: bool = True,
+        output_queue: Queue = None,
+        key_index_path: str = None,
+        ledger_path: str = None,
+        write_behind: bool = False,
+        outbox_path: str = None,
+        bulk_loader: StagedBulkLoader = None,
+        warehouse: BigQuery = None,
+        error_capture: ErrorCapture = None
     ):
+        '''
+        Parameters
+        ----------
+        error_screenshot_savepath : str, optional
+            Local directory for error screenshots, by default None
+        error_screenshot_save_bucket : str, optional
+            GCS bucket error screenshots are uploaded to, by default 'plugshare_scraping'
+        save_every : int, optional
+            Number of locations to scrape between BigQuery checkpoints, by default 100
+        timeout : int, optional
+            Ceiling (in seconds) on every wait for a page element or API response. Waits end as soon as the thing they are waiting for shows up, by default 3
+        page_load_pause : float, optional
+            Politeness floor: minimum number of seconds between starting one location/search and starting the next. 0 means go as fast as responses come back, by default 0
+        headless : bool, optional
+            If True, runs Chrome without a window, by default True
+        progress_bars : bool, optional
+            If True, shows tqdm progress bars, by default True
+        selenium_wire_scopes : Union[str, List[str]], optional
+            URL prefixes of the requests selenium-wire should capture, by default 'https://api.plugshare.com/v3/locations/'
+        fetch_mode : Literal['browser', 'http'], optional
+            'browser' loads each location page in Chrome and catches the API response it triggers, 'http' calls the API endpoint directly without a browser, by default 'browser'
+        api_base_url : str, optional
+            Root of the PlugShare API used in 'http' mode, by default PLUGSHARE_API_URL
+        http_pool_size : int, optional
+            Number of keep-alive connections to pool in 'http' mode, by default 10
+        consent_cookie_path : str, optional
+            JSON file to save cookie consent cookies to (and load them from in later sessions), by default None
+        dialog_probe_timeout : float, optional
+            Seconds to look for the login dialog once we've seen that it doesn't show up in this session, by default 0.5
+        page_load_strategy : str, optional
+            Selenium page load strategy. 'eager' returns from navigation once the DOM is ready rather than after every image/tile has loaded, since we only care about the API calls the page makes, by default 'eager'
+        network_idle_time : float, optional
+            Seconds without new or pending API requests before the page is considered settled (e.g. after a map search), by default 0.5
+        n_tabs : int, optional
+            Number of tabs to keep loading location pages in at once in 'browser' mode. With more than one, the next pages load while the current response is parsed and saved, by default 1
+        resource_blocking : ResourceBlockingProfile, optional
+            Which requests the browser may make. If None, the browser loads everything the pages ask for, by default None
+        archive_path : str, optional
+            Local directory to append every raw API response body to (see `ResponseArchive`) before it is parsed, so tables can be re-derived later without re-scraping. If None, bodies are not kept, by default None
+        parse_responses : bool, optional
+            If False, `run()` only captures responses (into `archive_path` and/or `output_queue`, one of which must be set) and leaves parsing and saving to a separate parser pool (see `evlens.data.plugshare_pipeline`), by default True
+        output_queue : ray.util.queue.Queue, optional
+            Bounded queue that `run()` puts (location_id, body) onto for each captured response. Blocks when the queue is full, so the browser can't outrun the parsers, by default None
+        key_index_path : str, optional
+            SQLite file of a `KeyIndex` shared by every scraper on this host. If provided, saves skip rows whose keys are already stored, and `run(skip_known=True)` skips locations that are already stored, by default None
+        ledger_path : str, optional
+            File of a `ProgressLedger` shared by every scraper in the job. If provided, `run()` skips items (locations or search cells) already recorded as done and records each one as in flight, then done once its data is saved (or failed), so an interrupted or retried job never repeats finished work. With `parse_responses=False`, locations only count as done here once archived, otherwise the `LocationParser` that saves them marks them done, by default None
+        write_behind : bool, optional
+            If True, checkpoints are handed to a background `WriteBehindUploader` instead of being saved in the scrape loop, so scraping never waits on BigQuery. Ledger items are marked done once their checkpoint is saved or safely in the outbox, by default False
+        outbox_path : str, optional
+            Local directory the write-behind uploader spills checkpoints to when BigQuery is slow or down, and retries them from. If None, failed saves are retried in memory, by default None
+        bulk_loader : StagedBulkLoader, optional
+            If provided, checkpoints are staged as compressed files rather than loaded, and nothing reaches BigQuery until `bulk_loader.load()` is called (e.g. once every scraper is done), by default None
+        warehouse : BigQuery, optional
+            Where tables are saved, e.g. a `LocalWarehouse` to keep everything on this machine. If None, a BigQuery client is created when first needed, by default None
+        error_capture : ErrorCapture, optional
+            Decides which failures get a screenshot or page snapshot (with sampling, rate limits, and de-duplication), so failure storms don't slow scraping down. If None, one that takes screenshots into `error_screenshot_savepath` and `error_screenshot_save_bucket` is used, by default None
+        '''
         self.timeout = timeout
         self.error_screenshot_savepath = error_screenshot_savepath
         self.error_screenshot_save_bucket = error_screenshot_save_bucket
         self.save_every = save_every
         self.page_load_pause = page_load_pause
-        self.use_tqdm = progress_bars        
-        self._bq_client = BigQuery(project='evlens')
+        self.use_tqdm = progress_bars
+        self.headless = headless
+        self.fetch_mode = fetch_mode
+        self.api_base_url = api_base_url
+        self.http_pool_size = http_pool_size
+        self.consent_cookie_path = consent_cookie_path
+        self.dialog_probe_timeout = dialog_probe_timeout
+        self.page_load_strategy = page_load_strategy
+        self.network_idle_time = network_idle_time
+        self.n_tabs = n_tabs
+        self.resource_blocking = resource_blocking
+        if not parse_responses and archive_path is None and output_queue is None:
+            raise ValueError("With `parse_responses=False`, responses must go to `archive_path` and/or `output_queue`, or they would be thrown away")
+        self.archive = ResponseArchive(archive_path) if archive_path is not None else None
+        self.parse_responses = parse_responses
+        self.output_queue = output_queue
+        # Captured locations whose archive copy makes them safe to count as done
+        self._archived_location_ids = set()
+        self.key_index_path = key_index_path
+        self.ledger_path = ledger_path
+        self._ledger = None
+        self.write_behind = write_behind
+        self.outbox_path = outbox_path
+        self.bulk_loader = bulk_loader
+        self._baseline_page_bytes = None
+        self.bytes_transferred_total = 0
+        self.bytes_saved_total = 0
+        self._last_item_started = None
+        self._bq_client = warehouse
         self._bq_dataset_name = 'plugshare'
         
         if self.error_screenshot_savepath is not None:    
             if not os.path.exists(self.error_screenshot_savepath):
                 logger.warning("Error screenshot save filepath does not exist, creating it...")
                 os.makedirs(self.error_screenshot_savepath)
+        if error_capture is None:
+            error_capture = ErrorCapture(
+                savepath=self.error_screenshot_savepath,
+                bucket_name=self.error_screenshot_save_bucket
+            )
+        self.error_capture = error_capture
                 
+        # Only request URLs containing URL patterns defined in init will be captured and stored by selenium-wire
+        if isinstance(selenium_wire_scopes, str):
+            selenium_wire_scopes = [selenium_wire_scopes]
+        self.selenium_wire_scopes = selenium_wire_scopes
+        
+        # Browser and HTTP session are only spun up for the fetch mode(s) actually used
+        self.driver = None
+        self.session = None
+        if self.fetch_mode == 'browser':
+            self.start_driver()
+        elif self.fetch_mode == 'http':
+            self.start_http_session()
+        else:
+            raise ValueError("`fetch_mode` must be one of ['browser', 'http']")
         
+    def start_driver(self):
         self.chrome_options = Options()
+        self.chrome_options.page_load_strategy = self.page_load_strategy
         
         # Required to avoid issues spinning up Chrome in docker/Linux
         self.chrome_options.add_argument('--no-sandbox')
@@ -250,7 +653,7 @@ class MainMapScraper:
         self.chrome_options.add_argument("--disable-blink-features=AutomationControlled")
         
         # Run without window open
-        if headless:
+        if self.headless:
             self.chrome_options.add_argument('--headless=new')
         
         # Get rid of kruft that will slow us down
@@ -261,10 +664,18 @@ class MainMapScraper:
         self.prefs = {"profile.default_content_setting_values.geolocation":2} 
         self.chrome_options.add_experimental_option("prefs", self.prefs)
         
+        # Network events let us tally bytes per page
+        if self.resource_blocking is not None and self.resource_blocking.report_bytes:
+            self.chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        
+        # An allowlist has to see (and so store) every request, not just the API ones
+        allowlisting = self.resource_blocking is not None \
+            and self.resource_blocking.allowed_url_patterns is not None
+        
         # Make sure we don't store requests on disk (where they can run out of space) and we don't keep too many in memory either
         self.selenium_wire_options = SeleniumWireOptions(
             request_storage="memory",
-            request_storage_max_size=100  # Store no more than 100 requests in memory
+            request_storage_max_size=1000 if allowlisting else 100  # Store no more than 100 requests in memory
         )
         
         self.driver = webdriver.Chrome(
@@ -272,151 +683,172 @@ class MainMapScraper:
             service=None,
             seleniumwire_options=self.selenium_wire_options
         )
-        
-        # Only request URLs containing URL patterns defined in init will be captured and stored by selenium-wire
-        if isinstance(selenium_wire_scopes, str):
-            selenium_wire_scopes = [selenium_wire_scopes]
-        self.driver.scopes = selenium_wire_scopes
+        # Out-of-scope responses are streamed straight through the proxy instead of being buffered and stored
+        if not allowlisting:
+            self.driver.include_urls = [re.escape(scope) for scope in self.selenium_wire_scopes]
+        self.apply_resource_blocking()
         
         self.wait = WebDriverWait(self.driver, self.timeout)
         
         # Make sure we look less bot-like
         # Thanks to https://stackoverflow.com/a/53040904/8630238
         self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {"userAgent": 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.53 Safari/537.36'})
+        self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {"userAgent": BROWSER_USER_AGENT})
         
-    def _parse_api_response(
-        self,
-        r: Request
-    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-        body = decode(
-            r.response.body,
-            r.response.headers.get("Content-Encoding", "identity")
-        )
-
-        # Station
-        # df_station = pd.json_normalize(loads(body))
-        df_station = pd.DataFrame([loads(body)])
-        df_station.connector_types = df_station.connector_types.str.join(";")
-        
-        #TODO: needs to translate from enum values to string values
-        df_station.amenities = pd.DataFrame(df_station.loc[0,'amenities'])['type'].astype(str).str.cat(sep=';')
-        df_station.photos = ';'.join([p['url'] for p in df_station.loc[0, 'photos']])
-        
-        # Grab data needed for other tables before dropping columns
-        df_evses = pd.DataFrame(df_station.loc[0, 'stations'])
-        df_checkins = pd.DataFrame(df_station.loc[0, 'reviews'])\
-            .drop(columns=['problem'])
-        
-        # We can return df_plugs if we want, but currently seem too detailed to be useful
-        df_plugs = pd.DataFrame(df_evses['outlets'].explode().tolist())
-        df_plugs['evse_id'] = df_evses.explode('outlets')['id'].values
-        
-        df_station.rename(columns={
-            'id': 'location_id',
-            'poi_name': 'location_type',
-            'station_count': 'evse_count',
-            'total_reviews': 'checkin_count',
-            'parking_attributes': 'parking',
-            'score': 'plugscore',
-            'hours': 'service_hours'
-        }, inplace=True)
-        
-        # Make a string for consistency with locationID table PK
-        df_station.location_id = df_station.location_id.astype(str)
-        df_station.parking = df_station.parking.str.join(';')
-        
-        cols_of_interest = [
-            'location_id',
-            'name',
-            'description',
-            'amenities',
-            'photos',
-            'plugscore',
-            'evse_count',
-            'access',
-            'phone',
-            'address',
-            'location_type',
-            'service_hours',
-            'open247',
-            'coming_soon',
-            'parking',
-            'parking_level',
-            'overhead_clearance_meters',
-            'checkin_count'
-        ]
-        df_station = df_station[cols_of_interest]
-        
-        # EVSEs
-        network_name = pd.DataFrame(df_evses['network'].tolist())['name']\
-            .dropna().drop_duplicates()
-        if len(network_name) > 1:
-            network_names = network_name.str.join(";")
-        else:
-            network_names = network_name.iloc[0]
-            
-        df_evses['network_names'] = network_names
-        df_evses.rename(columns={
-            'location_id': 'station_id'
-        }, inplace=True)
+        # Dialog state only holds for this browser session. For the dialogs' "seen" flags, None = haven't looked yet
+        self._consent_handled = self._load_consent_cookies()
+        self._cookie_dialog_seen = None
+        self._login_dialog_seen = None
         
-        cols_of_interest = [
-            'id',
-            'name',
-            'network_names',
-            'kilowatts',
-            'manufacturer',
-            'model',
-            'station_id',
-            'available'
-        ]
-        df_evses = df_evses[cols_of_interest]
-        df_evses.station_id = df_evses.station_id.astype(str)
+        # Location API responses caught by the interceptor in pipelined (multi-tab) mode
+        self._location_responses = LocationResponseRouter()
         
-        df_station['kilowatts_max'] = df_evses['kilowatts'].max()
-        df_station['network'] = df_evses.loc[0, 'network_names']
+    def _abort_disallowed_request(self, request: Request):
+        if not self.resource_blocking.is_allowed(request.url):
+            request.abort()
+            
+    def apply_resource_blocking(self, enabled: bool = True):
+        '''
+        Turns the resource blocking profile (if any) on or off for the current browser session.
+        '''
+        if self.resource_blocking is None:
+            return
         
-        # Reviews/check-ins data
-        df_checkins = df_checkins[
-            df_checkins['spam_category_description'].isnull()
-        ]
+        self.driver.execute_cdp_cmd('Network.enable', {})
+        self.driver.execute_cdp_cmd('Network.setBlockedURLs', {
+            'urls': self.resource_blocking.blocked_url_patterns if enabled else []
+        })
+        if self.resource_blocking.allowed_url_patterns is not None:
+            if enabled:
+                self.driver.request_interceptor = self._abort_disallowed_request
+            else:
+                del self.driver.request_interceptor
         
-        df_checkins.rename(columns={
-            'station_id': 'evse_id',
-            'problem_description': 'problem',
-            'kilowatts': 'charge_power_kilowatts'
-        }, inplace=True)
+    def get_page_transfer_stats(self) -> Dict[str, int]:
+        '''
+        Tallies Chrome's network events since the last call (requires a profile with `report_bytes=True`).
+
+        Returns
+        -------
+        Dict[str, int]
+            'bytes_transferred' (encoded bytes over the wire), 'requests_finished', and 'requests_blocked'
+        '''
+        stats = {'bytes_transferred': 0, 'requests_finished': 0, 'requests_blocked': 0}
+        for entry in self.driver.get_log('performance'):
+            message = loads(entry['message'])['message']
+            if message['method'] == 'Network.loadingFinished':
+                stats['bytes_transferred'] += int(message['params'].get('encodedDataLength', 0))
+                stats['requests_finished'] += 1
+            elif message['method'] == 'Network.loadingFailed' \
+                and (message['params'].get('blockedReason') is not None
+                     or 'ERR_BLOCKED' in message['params'].get('errorText', '')
+                     or 'ERR_ABORTED' in message['params'].get('errorText', '')):
+                stats['requests_blocked'] += 1
+        return stats
+    
+    def measure_baseline_page_bytes(self, location_id: str) -> int:
+        '''
+        Loads one location page with blocking turned off so later pages can report how many bytes blocking saved.
+        '''
+        if self.resource_blocking is None or not self.resource_blocking.report_bytes:
+            raise ValueError("Need a resource blocking profile with `report_bytes=True` to measure page bytes")
         
-        # Get how long it took
-        df_checkins['finished'] = pd.to_datetime(df_checkins['finished'])
-        df_checkins['created_at'] = pd.to_datetime(df_checkins['created_at'])
-        # df_checkins['charging_time'] = df_checkins['finished'] - df_checkins['created_at']
+        self.apply_resource_blocking(enabled=False)
+        self.get_page_transfer_stats()
+        self.driver.get(f"https://www.plugshare.com/location/{location_id}")
+        self.wait_for_network_idle(timeout=self.timeout)
+        self._baseline_page_bytes = self.get_page_transfer_stats()['bytes_transferred']
+        self.apply_resource_blocking(enabled=True)
+        del self.driver.requests
         
-        # Extract year from strings structured like 'Hyundai Ioniq Electric 2019'
-        df_checkins['vehicle_year'] = df_checkins.loc[:, 'vehicle_name'].str.extract(r'(\d{4}$)').astype(float)
+        logger.info("Baseline (unblocked) page load was %s bytes", self._baseline_page_bytes)
+        return self._baseline_page_bytes
+    
+    def _record_page_transfer(self, location_id: str):
+        stats = self.get_page_transfer_stats()
+        self.bytes_transferred_total += stats['bytes_transferred']
+        if self._baseline_page_bytes is not None:
+            bytes_saved = self._baseline_page_bytes - stats['bytes_transferred']
+            self.bytes_saved_total += bytes_saved
+        else:
+            bytes_saved = None
+            
+        logger.debug(
+            "Location %s: %s bytes transferred, %s requests blocked, %s bytes saved",
+            location_id,
+            stats['bytes_transferred'],
+            stats['requests_blocked'],
+            bytes_saved
+        )
         
-        #TODO: map enum values to connector names for connector_type
+    def start_http_session(self):
+        self.session = make_http_session(pool_size=self.http_pool_size)
         
-        cols_of_interest = [
-            'id',
-            'evse_id',
-            'comment',
-            'created_at',
-            'finished',
-            # 'charging_time', # TODO: need to calculate this in BQ directly as a RANGE type
-            'connector_type',
-            'charge_power_kilowatts',
-            'problem',
-            'rating',
-            'vehicle_name',
-            'vehicle_year'
-        ]
-        df_checkins = df_checkins[cols_of_interest]
+    def quit(self):
+        '''
+        Closes the browser and/or HTTP session, whichever are open.
+        '''
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        if self.archive is not None:
+            self.archive.close()
+        if self._uploader is not None:
+            # Everything still buffered gets saved (or spilled) before we let go
+            self._uploader.close()
+            self._uploader = None
+        if self._ledger is not None:
+            self._ledger.close()
+        self.error_capture.log_summary()
+        # Captures still uploading would be lost if the process goes away right after this. They may not be
+        # this scraper's own, since the capture (and the uploader) can be shared by the whole process
+        uploader = get_background_uploader(create=False)
+        if uploader is not None:
+            uploader.flush()
+            
+    def _archive_body(self, kind: str, key: str, body: bytes):
+        if self.archive is None or body is None:
+            return
+        try:
+            self.archive.append(kind, key, body)
+        except Exception:
+            logger.error("Failed to archive %s response for %s", kind, key, exc_info=True)
+            return
+        if kind == 'location' and not self.parse_responses:
+            self._archived_location_ids.add(key)
         
-        return df_station, df_checkins, df_evses#, df_plugs
+    def _parse_api_response(
+        self,
+        r: Request
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        body = decode(
+            r.response.body,
+            r.response.headers.get("Content-Encoding", "identity")
+        )
+        return self._parse_api_response_body(body)
+    
+    @classmethod
+    def _parse_api_response_body(
+        cls,
+        body: Union[str, bytes]
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''
+        Parses the raw JSON from a `v3/locations/<id>` API response, however it was obtained (browser capture or direct HTTP fetch).
+        '''
+        return LocationBatchParser.parse(body)
         
-    def _catch_api_response(self, location_id: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    def _catch_api_body(self, location_id: str) -> bytes:
+        '''
+        Waits for the location API response triggered by the current page load.
+
+        Returns
+        -------
+        bytes
+            Decoded response body, or None if there wasn't a successful response
+        '''
         try:
             #WARNING: there may be multiple requests with this URL, but the last one is probably the successful one that actually has a response JSON to parse
             r = self.driver.wait_for_request(
@@ -424,10 +856,14 @@ class MainMapScraper:
                 timeout=self.timeout
             )
             if r.response.status_code == 200 or r.response.status_code == '200':
-                df_station, df_checkins, df_evses = self._parse_api_response(r)
+                body = decode(
+                    r.response.body,
+                    r.response.headers.get("Content-Encoding", "identity")
+                )
                 del self.driver.requests
+                self._archive_body('location', location_id, body)
                 
-                return df_station, df_checkins, df_evses
+                return body
             
             else:
                 logger.error("Response code is %s for location ID %s, moving on", r.response.status_code, location_id)
@@ -441,34 +877,136 @@ class MainMapScraper:
             logger.error("Unknown exception when waiting for data at location %s", location_id, exc_info=True)
             return None
         
-    def save_error_screenshot(self, filename: str):
-        filename = get_current_datetime() \
-            + '_' + str(os.getpid()) + '_' + filename
+    def _fetch_api_body(self, location_id: str) -> bytes:
+        '''
+        Browserless alternative to `_catch_api_body()`: calls the location API endpoint directly over the pooled HTTP session.
+        '''
+        try:
+            # requests handles gzip/deflate decoding for us
+            response = self.session.get(
+                self.api_base_url + 'locations/' + location_id,
+                timeout=self.timeout
+            )
+            if response.status_code == 200:
+                self._archive_body('location', location_id, response.content)
+                return response.content
+            
+            else:
+                logger.error("Response code is %s for location ID %s, moving on", response.status_code, location_id)
+                return None
             
-        if self.error_screenshot_savepath is None:
+        except requests.exceptions.RequestException:
+            logger.error("Request failed for location %s, moving on!", location_id, exc_info=True)
+            return None
+        
+        except:
+            logger.error("Unknown exception when fetching data at location %s", location_id, exc_info=True)
+            return None
+        
+    def _get_location_body(self, location_id: str) -> bytes:
+        if self.fetch_mode == 'http':
+            return self._fetch_api_body(location_id)
+        else:
+            return self._catch_api_body(location_id)
+        
+    def _parse_location_body(
+        self,
+        location_id: str,
+        body: bytes
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        if body is None:
+            return None
+        try:
+            return self._parse_api_response_body(body)
+        except:
+            logger.error("Unknown exception when parsing data at location %s", location_id, exc_info=True)
+            return None
+        
+    def _catch_api_response(self, location_id: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        return self._parse_location_body(location_id, self._catch_api_body(location_id))
+        
+    def _fetch_api_response(self, location_id: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        '''
+        Browserless alternative to `_catch_api_response()`: calls the location API endpoint directly over the pooled HTTP session.
+        '''
+        return self._parse_location_body(location_id, self._fetch_api_body(location_id))
+        
+    def save_error_screenshot(self, filename: str):
+        '''
+        Captures the page for the failure named by `filename` (e.g. "selenium_login_not_found.png"), unless `error_capture` suppresses it.
+        '''
+        if self.error_capture.savepath is None:
             raise ValueError("`error_screenshot_savepath` must not be None")
-        path = os.path.join(self.error_screenshot_savepath, filename)
-        self.driver.save_screenshot(path)
-        if self.error_screenshot_save_bucket is not None:
-            upload_file(
-                self.error_screenshot_save_bucket,
-                path,
-                "errors/" + filename
+        self.error_capture.capture(os.path.splitext(filename)[0], self.driver)
+
+    def _load_consent_cookies(self) -> bool:
+        '''
+        Adds cookie consent cookies saved by a previous browser session (if any) so the cookie banner never shows up.
+
+        Returns
+        -------
+        bool
+            True if saved consent cookies were loaded
+        '''
+        if self.consent_cookie_path is None or not os.path.exists(self.consent_cookie_path):
+            return False
+        
+        with open(self.consent_cookie_path, 'r') as f:
+            cookies = [c for c in json.load(f) if self._is_consent_cookie(c)]
+        if len(cookies) == 0:
+            return False
+            
+        # CDP lets us set cookies for a domain without navigating to it first
+        for cookie in cookies:
+            cdp_cookie = {
+                k: cookie[k] for k in ['name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite']
+                if k in cookie
+            }
+            if 'expiry' in cookie:
+                cdp_cookie['expires'] = cookie['expiry']
+            self.driver.execute_cdp_cmd('Network.setCookie', cdp_cookie)
+            
+        logger.info("Loaded %s saved consent cookies", len(cookies))
+        return True
+    
+    @classmethod
+    def _is_consent_cookie(cls, cookie: Dict[str, str]) -> bool:
+        return re.search(CONSENT_COOKIE_NAME_PATTERN, cookie.get('name', ''), flags=re.IGNORECASE) is not None
+    
+    def _save_consent_cookies(self):
+        '''
+        Saves just the cookie consent cookies (see CONSENT_COOKIE_NAME_PATTERN) for later sessions. Session and login cookies are left out.
+        '''
+        if self.consent_cookie_path is None:
+            return
+        
+        cookies = [c for c in self.driver.get_cookies() if self._is_consent_cookie(c)]
+        if len(cookies) == 0:
+            logger.warning("No cookie consent cookies found to save")
+            return
+        
+        directory = os.path.split(self.consent_cookie_path)[0]
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.consent_cookie_path, 'w') as f:
+            json.dump(cookies, f)
+    
+    def _find_visible(self, locator: Tuple[str, str], timeout: float) -> WebElement:
+        '''
+        Returns the element at `locator` if it becomes visible within `timeout` seconds (0 = check once, right now), None otherwise.
+        '''
+        try:
+            return WebDriverWait(self.driver, timeout).until(
+                EC.visibility_of_element_located(locator)
             )
-            os.remove(path)
-        else:
-            logger.error(
-                "No GCP bucket provided for error screenshot."
-                )
+        except (NoSuchElementException, TimeoutException):
+            return None
 
     #TODO: make logger.info into logger.debug everywhere?
-    def reject_all_cookies_dialog(self):
+    def reject_all_cookies_dialog(self) -> bool:
         try:
             # Wait for the cookie dialog to appear
-            iframe = self.wait.until(EC.visibility_of_element_located((
-                By.ID,
-                "global-consent-notice"
-            )))        
+            iframe = self.wait.until(EC.visibility_of_element_located(COOKIE_DIALOG_LOCATOR))        
             logger.info("Found the cookie banner!")
             
             # Adapted from https://stackoverflow.com/a/21476147
@@ -501,29 +1039,135 @@ class MainMapScraper:
             logger.info("Switching back to main page content...")
             self.driver.switch_to.default_content()
             
+            # Consent choice lives in cookies, so keep them for future sessions too
+            self._save_consent_cookies()
+            return True
+            
         except (NoSuchElementException, TimeoutException) as e_cookies:
                 logger.error("Cookie banner or 'Manage Settings' link not found. Assuming cookies are not rejected.")
                 self.driver.switch_to.default_content()
+                return False
                 
-    def exit_login_dialog(self):
+    def exit_login_dialog(
+        self,
+        timeout: float = None,
+        screenshot_if_missing: bool = True
+    ) -> bool:
+        '''
+        Clicks the exit button on the login dialog.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait for the dialog. If None, uses the scraper's `timeout`, by default None
+        screenshot_if_missing : bool, optional
+            If True, saves an error screenshot when the dialog isn't found, by default True
+
+        Returns
+        -------
+        bool
+            True if the dialog was found and exited
+        '''
         logger.info("Attempting to exit login dialog...")
+        wait = self.wait if timeout is None else WebDriverWait(self.driver, timeout)
         try:
             # Wait for the exit button
-            esc_button = self.wait.until(EC.element_to_be_clickable((
-                By.XPATH,
-                "//*[@id=\"dialogContent_authenticate\"]/button"
-            )))
+            esc_button = wait.until(EC.element_to_be_clickable(LOGIN_DIALOG_EXIT_LOCATOR))
             esc_button.click()
             logger.info("Successfully exited the login dialog!")
+            return True
 
         except (NoSuchElementException, TimeoutException):
             logger.error("Login dialog exit button not found.")
-            self.save_error_screenshot("selenium_login_not_found.png")
-            
+            if screenshot_if_missing:
+                self.save_error_screenshot("selenium_login_not_found.png")
+            return False
 
         except Exception as e:
             logger.error(f"Unknown error trying to exit login dialog, saving error screenshot for later debugging", exc_info=True)
             self.save_error_screenshot("unknown_exit_dialog_error.png")
+            return False
+            
+    def handle_dialogs(self):
+        '''
+        Gets the cookie and login dialogs out of the way, remembering what we learned about them for the rest of the browser session so we only pay the full `timeout` wait when a dialog actually shows up.
+        '''
+        # Cookie consent is stored in the session's cookies, so we only expect the banner once
+        # Only counts as handled once rejecting actually worked, otherwise we try again on the next page,
+        # but after one full wait came up empty only when a quick peek says the banner is there
+        if not self._consent_handled:
+            if self._cookie_dialog_seen is not False \
+                or self._find_visible(COOKIE_DIALOG_LOCATOR, self.dialog_probe_timeout) is not None:
+                self._consent_handled = self.reject_all_cookies_dialog()
+                self._cookie_dialog_seen = self._consent_handled
+        elif self._find_visible(COOKIE_DIALOG_LOCATOR, 0) is not None:
+            logger.warning("Cookie banner is back despite prior handling, rejecting again...")
+            self._consent_handled = self.reject_all_cookies_dialog()
+        
+        # If we already know the login dialog isn't showing up, just take a quick peek for it
+        if self._login_dialog_seen is False:
+            self._login_dialog_seen = self.exit_login_dialog(
+                timeout=self.dialog_probe_timeout,
+                screenshot_if_missing=False
+            )
+        else:
+            self._login_dialog_seen = self.exit_login_dialog()
+    
+    def _wait_for_politeness_floor(self):
+        '''
+        Sleeps only for whatever is left of `page_load_pause` since the previous item started, then marks the start of a new item.
+        '''
+        if self._last_item_started is not None and self.page_load_pause > 0:
+            remaining = self.page_load_pause - (time() - self._last_item_started)
+            if remaining > 0:
+                logger.debug("Sleeping for %s seconds", remaining)
+                sleep(remaining)
+        self._last_item_started = time()
+        
+    def _in_scope(self, url: str) -> bool:
+        return any(url.startswith(scope) for scope in self.selenium_wire_scopes)
+        
+    def wait_for_network_idle(
+        self,
+        timeout: float,
+        idle_time: float = None,
+        poll_interval: float = 0.1
+    ) -> bool:
+        '''
+        Waits until no in-scope request (i.e. API call) has been pending or newly started for `idle_time` seconds.
+
+        Parameters
+        ----------
+        timeout : float
+            Ceiling on the wait, in seconds
+        idle_time : float, optional
+            Quiet period that counts as idle. If None, uses `network_idle_time`, by default None
+        poll_interval : float, optional
+            Seconds between checks of the captured requests, by default 0.1
+
+        Returns
+        -------
+        bool
+            True if the network went idle, False if we hit `timeout` first
+        '''
+        if idle_time is None:
+            idle_time = self.network_idle_time
+            
+        deadline = time() + timeout
+        last_activity = time()
+        last_count = None
+        while time() < deadline:
+            api_requests = [r for r in self.driver.requests if self._in_scope(r.url)]
+            num_pending = sum(r.response is None for r in api_requests)
+            if num_pending > 0 or len(api_requests) != last_count:
+                last_activity = time()
+                last_count = len(api_requests)
+            elif time() - last_activity >= idle_time:
+                return True
+            sleep(poll_interval)
+            
+        logger.debug("Network still busy after %s seconds", timeout)
+        return False
     
     #TODO: clean up and try to more elegantly extract things en masse
     def scrape_location(
@@ -548,18 +1192,17 @@ class MainMapScraper:
             logger.warning("location_id came through as int, should be str. Casting to str...")
             location_id = str(location_id).zfill(6)
             
-        results = self._catch_api_response(location_id)
+        results = self._parse_location_body(
+            location_id,
+            self._get_location_body(location_id)
+        )
         if results is None:
             return None
         else:
             df_station, df_checkins, df_evses = results
             
         logger.info("Page scrape complete!")
-        df_station['id'] = BigQuery.make_uuid()
-        df_station['last_scraped'] = get_current_datetime(
-            date_delimiter=None,
-            time_delimiter=None
-        )
+        self._stamp_station(df_station)
         
         return (
             df_station,
@@ -567,115 +1210,301 @@ class MainMapScraper:
             df_evses
         )
     
-    def save_to_bigquery(
+    def _intercept_location_response(self, request: Request, response):
+        '''
+        selenium-wire response interceptor (runs on the proxy thread) that hands location API responses to whichever tab is waiting on them.
+        '''
+        match = re.match(LOCATION_API_PATTERN, request.url)
+        if match is None:
+            return
+        
+        location_id = match.group(1)
+        if not self._location_responses.is_expected(location_id):
+            return
+        if response.status_code == 200 or response.status_code == '200':
+            body = decode(
+                response.body,
+                response.headers.get("Content-Encoding", "identity")
+            )
+        else:
+            body = None
+        self._location_responses.deliver(location_id, response.status_code, body)
+            
+    def _wait_for_captured_body(
         self,
-        data: pd.DataFrame,
-        table_name: str,
-        merge_columns: Union[str, List[str]] = 'location_id'
-    ):
-        logger.info(
-            "Saving %s rows to BigQuery table '%s'...",
-            len(data),
-            table_name
+        location_id: str
+    ) -> bytes:
+        captured = self._location_responses.wait(location_id, timeout=self.timeout)
+        if captured is None:
+            logger.error("No station at location %s, moving on!", location_id)
+            return None
+        
+        status_code, body = captured
+        if body is None:
+            logger.error("Response code is %s for location ID %s, moving on", status_code, location_id)
+            return None
+        
+        self._archive_body('location', location_id, body)
+        return body
+    
+    def _open_tabs(self, n_tabs: int) -> List[str]:
+        while len(self.driver.window_handles) < n_tabs:
+            self.driver.switch_to.new_window('tab')
+        return self.driver.window_handles[:n_tabs]
+    
+    def _start_ledger_items(self, keys: List[str]) -> List[str]:
+        '''
+        Drops items the ledger says are done and records the rest as in flight.
+        '''
+        keys = [str(k) for k in keys]
+        if self.ledger is None:
+            return keys
+        keys = self.ledger.remaining(keys)
+        self.ledger.mark_in_flight(keys)
+        return keys
+    
+    def _filter_known_locations(self, locations: List[str]) -> List[str]:
+        '''
+        Drops locations the key index says are already in the stations table.
+        '''
+        locations = [str(location_id) for location_id in locations]
+        if self.key_index is None:
+            return locations
+        
+        new_locations = self.key_index.filter_new(
+            f"{self._bq_dataset_name}.stations",
+            locations
         )
-        if data.empty:
-            logger.error("`data` empty, not saving to BigQuery`")
-        else:
-            self._bq_client.insert_data(
-                data,
-                self._bq_dataset_name,
-                table_name,
-                merge_columns=merge_columns
+        if len(new_locations) < len(locations):
+            logger.info(
+                "Skipping %s locations that are already stored",
+                len(locations) - len(new_locations)
             )
+        return new_locations
         
-    def run(self, locations: List[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        logger.info("Beginning scraping!")
+    def _iter_sequential_bodies(
+        self,
+        locations: List[str]
+    ) -> Iterator[Tuple[str, bytes]]:
+        for location_id in locations:
+            self._wait_for_politeness_floor()
+            if self.fetch_mode == 'browser':
+                url = f"https://www.plugshare.com/location/{location_id}"
+                self.driver.get(url)
 
-        all_stations = []
-        all_checkins = []
-        all_evses = []
-        if self.use_tqdm:
-            iterator = enumerate(tqdm(
-                locations,
-                desc="Parsing stations"
-            ))
+                self.handle_dialogs()
+            
+            yield location_id, self._get_location_body(location_id)
+            
+    def _iter_pipelined_bodies(
+        self,
+        locations: List[str]
+    ) -> Iterator[Tuple[str, bytes]]:
+        '''
+        Keeps `n_tabs` location pages loading at once in the one browser. Tab k+1 is already navigating while tab k's response is parsed (and saved by the caller), and responses are matched back to their tabs by location ID.
+        '''
+        locations = [str(location_id) for location_id in locations]
+        if len(locations) == 0:
+            return
+        
+        # Get the session-wide cookie banner out of the way on a normal page load first
+        first_location_id = locations[0]
+        self._wait_for_politeness_floor()
+        self.driver.get(f"https://www.plugshare.com/location/{first_location_id}")
+        self.handle_dialogs()
+        yield first_location_id, self._catch_api_body(first_location_id)
+        
+        idle_tabs = deque(self._open_tabs(self.n_tabs))
+        in_flight = deque()
+        remaining = iter(locations[1:])
+        
+        def launch_next() -> bool:
+            location_id = next(remaining, None)
+            if location_id is None:
+                return False
+            
+            tab = idle_tabs.popleft()
+            self._wait_for_politeness_floor()
+            self._location_responses.expect(location_id)
+            self.driver.switch_to.window(tab)
+            # Non-blocking navigation, unlike driver.get(), so we can move on to the next tab right away
+            self.driver.execute_script(
+                "window.location.href = arguments[0];",
+                f"https://www.plugshare.com/location/{location_id}"
+            )
+            in_flight.append((location_id, tab))
+            return True
+        
+        self.driver.response_interceptor = self._intercept_location_response
+        try:
+            while len(idle_tabs) > 0 and launch_next():
+                pass
+            
+            while len(in_flight) > 0:
+                location_id, tab = in_flight.popleft()
+                body = self._wait_for_captured_body(location_id)
+                
+                # Get this tab loading its next page before handing back results to be processed
+                idle_tabs.append(tab)
+                launch_next()
+                
+                # Time the caller spends parsing and saving doesn't count against pages still loading
+                self._location_responses.pause()
+                yield location_id, body
+                self._location_responses.resume()
+                
+        finally:
+            del self.driver.response_interceptor
+            self._location_responses.resume()
+            self._location_responses.clear()
+            del self.driver.requests
+        
+    def _start_fetching(
+        self,
+        locations: List[str],
+        fetch_mode: Literal['browser', 'http'] = None
+    ):
+        '''
+        Switches to `fetch_mode` (if given) and starts whatever it needs that isn't running yet, measuring the baseline page size first if resource blocking savings are being reported.
+        '''
+        if fetch_mode is not None:
+            self.fetch_mode = fetch_mode
+        if self.fetch_mode == 'browser' and self.driver is None:
+            self.start_driver()
+        elif self.fetch_mode == 'http' and self.session is None:
+            self.start_http_session()
+            
+        if self.fetch_mode == 'browser' and self.resource_blocking is not None \
+            and self.resource_blocking.report_bytes and len(locations) > 0:
+            # One unblocked page load per run for every blocked one to be compared against
+            try:
+                self.measure_baseline_page_bytes(locations[0])
+            except Exception:
+                logger.error("Couldn't measure baseline page bytes, bytes saved won't be reported", exc_info=True)
+                self.apply_resource_blocking(enabled=True)
+                
+    def _iter_location_bodies(
+        self,
+        locations: List[str]
+    ) -> Iterator[Tuple[str, bytes]]:
+        '''
+        Fetches each location's API response body with the current fetch mode, spread across tabs if there are several.
+        '''
+        if self.fetch_mode == 'browser' and self.n_tabs > 1:
+            bodies = self._iter_pipelined_bodies(locations)
         else:
-            iterator = enumerate(locations)
+            bodies = self._iter_sequential_bodies(locations)
+        if self.use_tqdm:
+            bodies = tqdm(bodies, total=len(locations), desc="Parsing stations")
             
-        #TODO: add some retry logic for rare "database can't connect" error
-        for i, location_id in iterator:
-            url = f"https://www.plugshare.com/location/{location_id}"
-            self.driver.get(url)
-
-            self.reject_all_cookies_dialog()                
-            self.exit_login_dialog()
+        for location_id, body in bodies:
+            if self.driver is not None and self.resource_blocking is not None \
+                and self.resource_blocking.report_bytes:
+                self._record_page_transfer(location_id)
+            yield location_id, body
             
-            results = self.scrape_location(location_id)
-            if results is None:
-                logger.error("No data found at location_id %s", location_id)
+    def _add_body(
+        self,
+        parser: LocationBatchParser,
+        location_id: str,
+        body: bytes
+    ) -> bool:
+        '''
+        Hands one location's response body to the output queue and/or `parser`, marking the location in the ledger if nothing is left to do for it.
+
+        Returns
+        -------
+        bool
+            True if the location was parsed and only counts as done once `parser`'s batch is saved
+        '''
+        if body is None:
+            logger.error("No data found at location_id %s", location_id)
+            self._mark_ledger([location_id], 'failed', detail="No data found")
+            return False
+        
+        if self.output_queue is not None:
+            self.output_queue.put((location_id, body))
+        if not self.parse_responses:
+            # Queued bodies are only safe once a parser has saved them, so it marks them done instead
+            if location_id in self._archived_location_ids:
+                self._archived_location_ids.discard(location_id)
+                self._mark_ledger([location_id], 'done')
+            return False
+        
+        try:
+            parser.add(body)
+        except Exception as e:
+            logger.error("Unknown exception when parsing data at location %s", location_id, exc_info=True)
+            self._mark_ledger([location_id], 'failed', detail=repr(e))
+            return False
+        return True
+        
+    def run(
+        self,
+        locations: List[str],
+        fetch_mode: Literal['browser', 'http'] = None,
+        close_when_done: bool = True,
+        skip_known: bool = False
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        '''
+        Scrapes every location in `locations` and saves the results to BigQuery every `save_every` locations.
+
+        Parameters
+        ----------
+        locations : List[str]
+            PlugShare location IDs to scrape
+        fetch_mode : Literal['browser', 'http'], optional
+            Overrides the fetch mode set at instantiation for this run only. 'browser' loads each location page in Chrome and catches the API response it triggers, 'http' calls the API endpoint directly without a browser, by default None
+        close_when_done : bool, optional
+            If False, leaves the browser/HTTP session open afterwards so the next `run()` call (e.g. the next chunk from `parallelized_data_processing(chunk_size=...)`) can reuse it. Call `quit()` when finished, by default True
+        skip_known : bool, optional
+            If True (and `key_index_path` is set), skips locations that are already in the stations table. Meant for fresh discovery jobs, not re-scrapes of known locations (e.g. from `ChangeDetectionPlanner` or `RescrapeScheduler`), by default False
+        '''
+        logger.info("Beginning scraping!")
+        if skip_known:
+            locations = self._filter_known_locations(locations)
+        locations = self._start_ledger_items(locations)
+        self._start_fetching(locations, fetch_mode)
+
+        parser = LocationBatchParser()
+        # Locations only count as done in the ledger once their data is saved
+        unsaved_location_ids = []
+        
+        #TODO: add some retry logic for rare "database can't connect" error
+        for i, (location_id, body) in enumerate(self._iter_location_bodies(locations)):
+            if not self._add_body(parser, location_id, body):
                 continue
-            else:
-                df_station, df_checkins, df_evses = results
-            
-            if not df_station.empty:
-                all_stations.append(df_station)
-            if not df_checkins.empty:
-                all_checkins.append(df_checkins)
-            if not df_evses.empty:
-                all_evses.append(df_evses)
+            unsaved_location_ids.append(location_id)
             
             # Save to BQ
-            if len(all_stations) >= self.save_every:
+            if len(parser) >= self.save_every:
                 logger.info(f"Saving checkpoint at index {i} and location {location_id}")
-                
-                df_stations_checkpoint = pd.concat(all_stations, ignore_index=True)
-                df_checkins_checkpoint = pd.concat(all_checkins, ignore_index=True)
-                df_evses_checkpoint = pd.concat(all_evses, ignore_index=True)
-                self.save_to_bigquery(
-                    df_stations_checkpoint,
-                    'stations',
-                    merge_columns='location_id'
-                )
-                self.save_to_bigquery(
-                    df_checkins_checkpoint,
-                    'checkins',
-                    merge_columns='id'
+                self._save_batch(
+                    parser,
+                    on_durable=partial(self._mark_ledger, unsaved_location_ids, 'done')
                 )
-                self.save_to_bigquery(
-                    df_evses_checkpoint,
-                    'evses',
-                    merge_columns='id'
-                )
-                
-                all_stations = []
-                all_checkins = []
-                all_evses = []
+                unsaved_location_ids = []
 
-            #TODO: tune between page switches
-            logger.info(f"Sleeping for {self.page_load_pause} seconds")
-            sleep(self.page_load_pause)
-
-        self.driver.quit()
+        if self.resource_blocking is not None and self.resource_blocking.report_bytes:
+            logger.info(
+                "%s bytes transferred in total, %s bytes saved by resource blocking",
+                self.bytes_transferred_total,
+                self.bytes_saved_total if self._baseline_page_bytes is not None else 'unknown'
+            )
+        
+        if not self.parse_responses:
+            if close_when_done:
+                self.quit()
+            logger.info("Capture complete!")
+            return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
         
         #TODO: add station location integers as column
-        df_all_stations = pd.concat(all_stations, ignore_index=True)        
-        df_all_checkins = pd.concat(all_checkins, ignore_index=True)
-        df_all_evses = pd.concat(all_evses, ignore_index=True)
-        self.save_to_bigquery(
-            df_all_stations,
-            'stations',
-            merge_columns='location_id'
-        )
-        self.save_to_bigquery(
-            df_all_checkins,
-            'checkins',
-            merge_columns='id'
-        )
-        self.save_to_bigquery(
-            df_all_evses,
-            'evses',
-            merge_columns='id'
+        df_all_stations, df_all_checkins, df_all_evses = self._save_batch(
+            parser,
+            on_durable=partial(self._mark_ledger, unsaved_location_ids, 'done')
         )
+        if close_when_done:
+            self.quit()
         
         logger.info("Scraping complete!")
         return df_all_stations, df_all_checkins, df_all_evses
@@ -698,14 +1527,116 @@ class ParallelMainMapScraper(MainMapScraper):
     
 class LocationIDScraper(MainMapScraper):
     
+    _settled_region_request = None
+    
+    @classmethod
+    def _region_viewport(cls, url: str) -> Tuple[float, float, float, float]:
+        '''
+        (latitude, longitude, latitude span, longitude span) of the map viewport a region API request was made for, or None if the URL doesn't say.
+        '''
+        query = parse_qs(urlparse(url).query)
+        try:
+            return tuple(float(query[k][0]) for k in ['latitude', 'longitude', 'spanLat', 'spanLng'])
+        except (KeyError, IndexError, ValueError):
+            return None
+    
+    @classmethod
+    def _pick_region_request(
+        cls,
+        requests: List[Request],
+        search_criterion: SearchCriterion
+    ) -> Request:
+        '''
+        The completed region API request for where the map settled: the latest one whose viewport contains the search center, or just the latest one if no viewport does (or none can be read).
+        '''
+        completed = [
+            r for r in requests
+            if r.response is not None and re.search(REGION_API_PATTERN, r.url)
+        ]
+        if len(completed) == 0:
+            return None
+        
+        if search_criterion is not None:
+            for r in reversed(completed):
+                viewport = cls._region_viewport(r.url)
+                if viewport is None:
+                    continue
+                latitude, longitude, span_latitude, span_longitude = viewport
+                if abs(search_criterion.latitude - latitude) <= span_latitude / 2 \
+                    and abs(search_criterion.longitude - longitude) <= span_longitude / 2:
+                    return r
+        return completed[-1]
+    
+    def wait_for_map_idle(
+        self,
+        search_criterion: SearchCriterion,
+        timeout: float,
+        idle_time: float = None,
+        poll_interval: float = 0.1
+    ) -> Request:
+        '''
+        Waits for the map to settle after a search: it has asked for pins at least once, every pin request it made has been answered, and it hasn't asked for pins again (i.e. panned or zoomed) for `idle_time` seconds.
+
+        Parameters
+        ----------
+        search_criterion : SearchCriterion
+            Search the map is settling on, used to pick the region response for the final viewport
+        timeout : float
+            Ceiling on the wait, in seconds
+        idle_time : float, optional
+            Quiet period that counts as idle. If None, uses `network_idle_time`, by default None
+        poll_interval : float, optional
+            Seconds between checks of the captured requests, by default 0.1
+
+        Returns
+        -------
+        seleniumwire2.request.Request
+            Region API request for where the map settled, or None if it never got a response
+        '''
+        if idle_time is None:
+            idle_time = self.network_idle_time
+            
+        deadline = time() + timeout
+        last_activity = time()
+        last_count = 0
+        while True:
+            region_requests = [r for r in self.driver.requests if re.search(REGION_API_PATTERN, r.url)]
+            num_pending = sum(r.response is None for r in region_requests)
+            if len(region_requests) != last_count or num_pending > 0:
+                last_activity = time()
+                last_count = len(region_requests)
+            elif last_count > 0 and time() - last_activity >= idle_time:
+                return self._pick_region_request(region_requests, search_criterion)
+            
+            if time() >= deadline:
+                break
+            sleep(poll_interval)
+            
+        logger.debug("Map still not idle after %s seconds", timeout)
+        return self._pick_region_request(region_requests, search_criterion)
+    
     def _catch_api_response(self, search_cell_id: str) -> pd.DataFrame:
+        '''
+        Locations from the map's region API response for the current search.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per location, empty if the search cell has no pins. None if the search failed (error response, no response, or a bad body), so the cell can be retried.
+        '''
         try:
-            r = self.driver.wait_for_request(
-                r'https://api.plugshare.com/v3/locations/region?',
-                timeout=self.timeout
-            )
+            # Normally the search already waited for the map to settle and picked its response
+            r = self._settled_region_request
+            self._settled_region_request = None
+            if r is None:
+                r = self.driver.wait_for_request(
+                    REGION_API_PATTERN,
+                    timeout=self.timeout
+                )
+                
             if r.response.status_code == 200 or r.response.status_code == '200':
                 body = decode(r.response.body, r.response.headers.get("Content-Encoding", "identity"))
+                self._archive_body('region', search_cell_id, body)
 
                 df = pd.DataFrame(loads(body))
                 del self.driver.requests
@@ -717,11 +1648,13 @@ class LocationIDScraper(MainMapScraper):
                 return None
             
         except (TimeoutException, NoSuchElementException):
-            logger.error("No pins found in search cell %s, moving on!", search_cell_id, exc_info=False)
+            # Cells without pins still get a (empty) response, so this is a failed search
+            logger.error("No region response for search cell %s, moving on!", search_cell_id, exc_info=False)
             return None
         
         except:
             logger.error("Unknown exception when waiting for pin data in search cell %s", search_cell_id, exc_info=True)
+            return None
     
     def pick_plug_filters(
         self,
@@ -779,10 +1712,18 @@ class LocationIDScraper(MainMapScraper):
         search_button = self.wait.until(
             EC.element_to_be_clickable((By.XPATH, '//*[@id="geocode"]'))
         )
+        # Forget responses from earlier searches so we only wait on this one
+        del self.driver.requests
         search_button.click()
         
-        # Give the iframe a moment to pan
-        sleep(search_criterion.time_to_pan)
+        # Done once the map has asked for its pins and stopped panning/re-querying,
+        # with `time_to_pan` as the ceiling rather than a fixed sleep
+        self._settled_region_request = self.wait_for_map_idle(
+            search_criterion,
+            timeout=search_criterion.time_to_pan
+        )
+        if self._settled_region_request is None:
+            logger.debug("No region response within %s seconds of searching", search_criterion.time_to_pan)
         
     
     def scroll_back_to_map_view(self, map_iframe: WebElement):
@@ -838,15 +1779,182 @@ class LocationIDScraper(MainMapScraper):
         search_criterion: SearchCriterion
         ) -> pd.DataFrame:
             
-        # Capture the API response that populates the map
+        # Capture the API response that populates the map (None if the search failed)
         return self._catch_api_response(search_criterion.cell_id)
     
+    @classmethod
+    def is_saturated(
+        cls,
+        search_criterion: SearchCriterion,
+        df_locations_found: pd.DataFrame,
+        saturation_threshold: int = 500,
+        max_locations_per_square_mile: float = None
+    ) -> bool:
+        '''
+        Whether a search looks like it hit the map's cap on results (or is dense enough that it likely missed some), i.e. whether its tile should be searched again as smaller tiles.
+        '''
+        if df_locations_found is None or df_locations_found.empty:
+            return False
+        num_found = df_locations_found['id'].nunique()
+        if num_found >= saturation_threshold:
+            return True
+        if max_locations_per_square_mile is not None:
+            return num_found / (np.pi * search_criterion.radius**2) >= max_locations_per_square_mile
+        return False
+    
+    def _split_saturated_cell(
+        self,
+        search_criterion: SearchCriterion,
+        df_locations_found: pd.DataFrame,
+        saturation_threshold: int = 500,
+        max_locations_per_square_mile: float = None,
+        min_radius_in_miles: float = 0.5,
+        max_depth: int = 6
+    ) -> List[SearchCriterion]:
+        '''
+        Smaller tiles to search again if this search looks saturated and its tile can still be split, leaving out any the ledger already has as done. Empty if the tile needs no more searching.
+        '''
+        if not self.is_saturated(
+            search_criterion,
+            df_locations_found,
+            saturation_threshold=saturation_threshold,
+            max_locations_per_square_mile=max_locations_per_square_mile
+        ):
+            return []
+        if search_criterion.depth >= max_depth or search_criterion.radius <= min_radius_in_miles:
+            logger.warning(
+                "Search cell %s is still saturated at the smallest allowed size, some of its locations may be missed",
+                search_criterion.cell_id
+            )
+            return []
+        
+        children = search_criterion.split()
+        remaining_child_ids = set(self._start_ledger_items([c.cell_id for c in children]))
+        children = [c for c in children if c.cell_id in remaining_child_ids]
+        logger.debug(
+            "Search cell %s looks saturated, splitting it into %s smaller cells",
+            search_criterion.cell_id,
+            len(children)
+        )
+        return children
+    
+    def _track_children(
+        self,
+        search_criterion: SearchCriterion,
+        children: List[SearchCriterion]
+    ):
+        '''
+        Holds off on finishing a split cell until each of its `children` is finished.
+        '''
+        self._num_children_left[search_criterion.cell_id] = len(children)
+        for child in children:
+            self._parent_cell_ids[child.cell_id] = search_criterion.cell_id
+    
+    def _finish_cell(self, cell_id: str):
+        '''
+        Queues a searched cell to be marked done with the next save, along with any parent cell it was the last unfinished child of.
+        '''
+        self._unsaved_cell_ids.append(cell_id)
+        parent_cell_id = self._parent_cell_ids.pop(cell_id, None)
+        if parent_cell_id is not None:
+            self._num_children_left[parent_cell_id] -= 1
+            if self._num_children_left[parent_cell_id] == 0:
+                del self._num_children_left[parent_cell_id]
+                self._finish_cell(parent_cell_id)
+    
+    def _make_location_rows(
+        self,
+        search_criterion: SearchCriterion,
+        df_locations_found: pd.DataFrame
+    ) -> pd.DataFrame:
+        '''
+        Formats the locations one search found as locationID table rows.
+        '''
+        if search_criterion.cell_type == 'NREL':
+            cell_id_column = 'search_cell_id_nrel'
+            unused_cell_id_column = 'search_cell_id'
+        else:
+            cell_id_column = 'search_cell_id'
+            unused_cell_id_column = 'search_cell_id_nrel'
+        
+        num_locations_found = len(df_locations_found)
+        print(f"{num_locations_found=:,}")
+        try:
+            return pd.DataFrame({
+                'id': [BigQuery.make_uuid() for _ in range(num_locations_found)],
+                'parsed_datetime': [get_current_datetime(date_delimiter=None, time_delimiter=None)] * num_locations_found,
+                'plug_types': df_locations_found['connector_types'].str.join(';'),
+                'location_id': df_locations_found['id'].astype(str),
+                'latitude': df_locations_found['latitude'],
+                'longitude': df_locations_found['longitude'],
+                # Split cells' IDs aren't in the search tile tables, so they're saved under the tile they came from
+                cell_id_column: [search_criterion.root_cell_id] * num_locations_found,
+                unused_cell_id_column: [None] * num_locations_found,
+                'under_repair': df_locations_found['under_repair']
+            }).drop_duplicates(subset=['location_id'])
+        except KeyError as e:
+            logger.error("Something went wrong with appending the data, running df.info() before raising error...")
+            df_locations_found.info()
+            raise e
+    
+    def _save_locations(self, dfs: List[pd.DataFrame]) -> pd.DataFrame:
+        '''
+        Saves the locations found since the last save, marking the cells finished since then as done once they're stored.
+        '''
+        df_locations = pd.concat(dfs, ignore_index=True)\
+            .drop_duplicates(subset=['location_id'])
+        self._save_table_group(
+            [(df_locations, 'locationID', 'location_id')],
+            on_durable=partial(self._mark_ledger, self._unsaved_cell_ids, 'done')
+        )
+        self._unsaved_cell_ids = []
+        return df_locations
+    
     def run(
         self,
         search_criteria: List[SearchCriterion],
         plugs_to_include: List[str] = ALLOWABLE_PLUG_TYPES,
+        close_when_done: bool = True,
+        adaptive: bool = False,
+        saturation_threshold: int = 500,
+        max_locations_per_square_mile: float = None,
+        min_radius_in_miles: float = 0.5,
+        max_depth: int = 6
         ) -> pd.DataFrame:
+        '''
+        Searches the map for every search tile in `search_criteria` and saves the locations found to the locationID table.
+
+        Parameters
+        ----------
+        search_criteria : List[SearchCriterion]
+            Search tiles to search
+        plugs_to_include : List[str], optional
+            Plug type filters to search with, by default ALLOWABLE_PLUG_TYPES
+        close_when_done : bool, optional
+            If True, closes the browser once done, by default True
+        adaptive : bool, optional
+            If True, tiles whose search looks saturated (see `is_saturated()`) are split into four smaller tiles (see `SearchCriterion.split()`) and searched again, recursively, so sparse areas get covered by a few large tiles and dense ones by as many small ones as they need. Tiles with no results are never split, by default False
+        saturation_threshold : int, optional
+            Number of locations in one search response that counts as hitting the map's result cap, by default 500
+        max_locations_per_square_mile : float, optional
+            If provided, searches at least this dense count as saturated too, by default None
+        min_radius_in_miles : float, optional
+            Tiles at or below this radius aren't split any further, by default 0.5
+        max_depth : int, optional
+            Most times an original tile gets split, by default 6
+
+        Returns
+        -------
+        pd.DataFrame
+            Locations found in the searches since the last checkpoint
+        '''
         logger.info("Beginning location ID scraping!")
+        remaining_cell_ids = set(self._start_ledger_items([sc.cell_id for sc in search_criteria]))
+        search_criteria = [sc for sc in search_criteria if str(sc.cell_id) in remaining_cell_ids]
+        
+        # Map searches only work through the browser
+        if self.driver is None:
+            self.start_driver()
         
         # Load up the page
         self.driver.get(EMBEDDED_DEV_MAP_URL)
@@ -855,75 +1963,72 @@ class LocationIDScraper(MainMapScraper):
         self.pick_plug_filters(plugs_to_include)
         
         dfs = []
-        if self.use_tqdm:
-            iterator = tqdm(
-                search_criteria,
-                desc="Searching map tiles"
-            )
-        else:
-            iterator = search_criteria
+        # Search cells only count as done in the ledger once their locations are saved
+        self._unsaved_cell_ids = []
+        # Split cells only count as done once all their children are, so a resumed job re-splits
+        # them and searches just the children that weren't finished
+        self._parent_cell_ids = dict()
+        self._num_children_left = dict()
+        
+        queue = deque(search_criteria)
+        progress_bar = tqdm(total=len(queue), desc="Searching map tiles", disable=not self.use_tqdm)
         
-        for i, search_criterion in enumerate(iterator):
+        while len(queue) > 0:
+            search_criterion = queue.popleft()
+            self._wait_for_politeness_floor()
             self.search_location(search_criterion)
             df_locations_found = self.grab_location_ids(search_criterion)
-            if df_locations_found is None or df_locations_found.empty:
+            progress_bar.update(1)
+            
+            if df_locations_found is None:
+                # Left out of the done cells (and so is its parent, if it has one) so a resumed job searches it again
+                self._mark_ledger([search_criterion.cell_id], 'failed', detail="Map search failed")
                 continue
             
-            if search_criterion.cell_type == 'NREL':
-                cell_id_column = 'search_cell_id_nrel'
-                unused_cell_id_column = 'search_cell_id'
+            children = []
+            if adaptive:
+                children = self._split_saturated_cell(
+                    search_criterion,
+                    df_locations_found,
+                    saturation_threshold=saturation_threshold,
+                    max_locations_per_square_mile=max_locations_per_square_mile,
+                    min_radius_in_miles=min_radius_in_miles,
+                    max_depth=max_depth
+                )
+            if len(children) > 0:
+                # Depth-first, so the map doesn't have to pan far for the next search
+                queue.extendleft(reversed(children))
+                self._track_children(search_criterion, children)
+                progress_bar.total += len(children)
             else:
-                cell_id_column = 'search_cell_id'
-                unused_cell_id_column = 'search_cell_id_nrel'
+                self._finish_cell(search_criterion.cell_id)
             
-            num_locations_found = len(df_locations_found)
-            print(f"{num_locations_found=:,}")
-            try:
-                dfs.append(pd.DataFrame({
-                    'id': [BigQuery.make_uuid() for _ in range(num_locations_found)],
-                    'parsed_datetime': [get_current_datetime(date_delimiter=None, time_delimiter=None)] * num_locations_found,
-                    'plug_types': df_locations_found['connector_types'].str.join(';'),
-                    'location_id': df_locations_found['id'].astype(str),
-                    'latitude': df_locations_found['latitude'],
-                    'longitude': df_locations_found['longitude'],
-                    cell_id_column: [search_criterion.cell_id] * num_locations_found,
-                    unused_cell_id_column: [None] * num_locations_found,
-                    'under_repair': df_locations_found['under_repair']
-                }).drop_duplicates(subset=['location_id']))
-            except KeyError as e:
-                logger.error("Something went wrong with appending the data, running df.info() before raising error...")
-                df_locations_found.info()
-                raise e
-                
+            if df_locations_found.empty:
+                continue
+            dfs.append(self._make_location_rows(search_criterion, df_locations_found))
             
             # Save checkpoint
-            if len(dfs) > 0 and sum([len(df) for df in dfs]) >= self.save_every:
+            if sum([len(df) for df in dfs]) >= self.save_every:
                 logger.info("Saving checkpoint...")
-                df_locations_checkpoint = pd.concat(dfs, ignore_index=True)\
-                    .drop_duplicates(subset=['location_id'])
-                self.save_to_bigquery(
-                    df_locations_checkpoint,
-                    'locationID'
-                )
-                # Try to save some memory
-                # del dfs
-                # del df_locations_checkpoint
-                # gc.collect()
+                self._save_locations(dfs)
                 dfs = []
 
+        progress_bar.close()
         # self.driver.switch_to.default_content()
-        self.driver.quit()
-
         if len(dfs) > 0:
-            df_locations_found = pd.concat(dfs, ignore_index=True)\
-                .drop_duplicates(subset=['location_id'])
-            self.save_to_bigquery(df_locations_found, "locationID")
+            df_locations_found = self._save_locations(dfs)
             logger.info("All location IDs scraped (that we could)!")
-            return df_locations_found
         
         else:
+            # Nothing left to save, these cells just had no pins
+            self._mark_ledger(self._unsaved_cell_ids, 'done')
             logger.error("Something went horribly wrong, why do we have ZERO locations?!")
-            return None
+            df_locations_found = None
+        
+        # Only after the last save, so the uploader gets flushed
+        if close_when_done:
+            self.quit()
+        return df_locations_found
 
 
 
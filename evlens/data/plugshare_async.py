@@ -0,0 +1,369 @@
+from typing import Tuple, List, Dict, Iterable, AsyncIterator, Any, Union
+from functools import partial
+import asyncio
+import json
+import math
+import random
+from urllib.parse import urlparse
+
+import aiohttp
+import pandas as pd
+import ray
+from tqdm import tqdm
+from tenacity import retry, wait_random_exponential, stop_after_delay, stop_after_attempt
+
+from evlens.concurrency import AIMDLimiter
+from evlens.data.plugshare import (
+    MainMapScraper,
+    SearchCriterion,
+    PLUGSHARE_API_URL,
+    BROWSER_USER_AGENT,
+    MILES_PER_DEGREE_LATITUDE,
+    make_api_headers
+)
+from evlens.data.plugshare_parsing import LocationBatchParser
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+# Same filters the map applies when only our ALLOWABLE_PLUG_TYPES are checked:
+# CHAdeMO, CCS (DC power only), and Tesla Supercharger
+REGION_OUTLET_FILTERS = [
+    {"connector": 3},
+    {"connector": 6, "power": 1},
+    {"connector": 13}
+]
+
+# Max number of locations the region endpoint will return for one search
+REGION_RESULT_CAP = 500
+
+
+def make_region_params(
+    search_criterion: SearchCriterion,
+    count: int = REGION_RESULT_CAP
+) -> Dict[str, Any]:
+    '''
+    Builds the query parameters for a `v3/locations/region` call that covers the same area as a map search for `search_criterion`.
+    '''
+    span_lat = 2 * search_criterion.radius / MILES_PER_DEGREE_LATITUDE
+    span_lng = span_lat / math.cos(math.radians(search_criterion.latitude))
+
+    return {
+        'minimal': 1,
+        'count': count,
+        'latitude': search_criterion.latitude,
+        'longitude': search_criterion.longitude,
+        'spanLng': span_lng,
+        'spanLat': span_lat,
+        'outlets': json.dumps(REGION_OUTLET_FILTERS, separators=(',', ':')),
+        'access': 1
+    }
+
+
+class AsyncPlugShareClient:
+    '''
+    Asyncio engine that keeps many PlugShare API requests in flight at once, with a per-host concurrency cap that adapts (AIMD) to what the upstream tolerates.
+    '''
+    def __init__(
+        self,
+        api_base_url: str = PLUGSHARE_API_URL,
+        initial_concurrency: int = 16,
+        max_concurrency: int = 256,
+        timeout: float = 10,
+        max_retries: int = 3,
+        max_backoff: float = 30,
+        user_agent: str = BROWSER_USER_AGENT,
+        authorization: str = None
+    ):
+        '''
+        Parameters
+        ----------
+        api_base_url : str, optional
+            Root of the API, by default PLUGSHARE_API_URL
+        initial_concurrency : int, optional
+            Requests allowed in flight per host to start with, by default 16
+        max_concurrency : int, optional
+            Most requests that will ever be in flight per host, by default 256
+        timeout : float, optional
+            Seconds before a single request is abandoned (and counted as a sign of overload), by default 10
+        max_retries : int, optional
+            Retries per request on 429/5xx/timeouts, by default 3
+        max_backoff : float, optional
+            Longest we'll sleep between retries of a single request, in seconds, by default 30
+        user_agent : str, optional
+            Passed to `make_api_headers()`, by default BROWSER_USER_AGENT
+        authorization : str, optional
+            Passed to `make_api_headers()`, by default None
+        '''
+        self.api_base_url = api_base_url
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.headers = make_api_headers(user_agent, authorization)
+        self.limiters: Dict[str, AIMDLimiter] = {}
+
+    def _limiter_for(self, url: str) -> AIMDLimiter:
+        host = urlparse(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = AIMDLimiter(
+                initial_limit=min(self.initial_concurrency, self.max_concurrency),
+                max_limit=self.max_concurrency
+            )
+        return self.limiters[host]
+
+    def _backoff_seconds(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                pass
+        return min(self.max_backoff, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def _get(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        params: Dict[str, Any] = None
+    ) -> bytes:
+        '''
+        GETs `url`, retrying throttled/failed requests and reporting each outcome to the host's limiter.
+
+        Returns
+        -------
+        bytes
+            Response body, or None if the request never succeeded
+        '''
+        limiter = self._limiter_for(url)
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            status = None
+            retry_after = None
+            try:
+                async with session.get(url, params=params) as response:
+                    body = await response.read()
+                    status = response.status
+                    retry_after = response.headers.get('Retry-After')
+
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                logger.debug("Request to %s failed (%s), attempt %s", url, type(e).__name__, attempt + 1)
+
+            finally:
+                # Also on cancellation or unexpected errors, so the slot is never lost
+                healthy = status is not None and status != 429 and status < 500
+                await limiter.release(healthy=healthy)
+
+            if not healthy:
+                if status is not None:
+                    logger.debug("Response code %s from %s, attempt %s", status, url, attempt + 1)
+                await asyncio.sleep(self._backoff_seconds(attempt, retry_after))
+                continue
+
+            if status == 200:
+                return body
+
+            logger.error("Response code is %s for %s, moving on", status, url)
+            return None
+
+        logger.error("Giving up on %s after %s attempts", url, self.max_retries + 1)
+        return None
+
+    async def iter_responses(
+        self,
+        jobs: Iterable[Tuple[Any, str, Dict[str, Any]]]
+    ) -> AsyncIterator[Tuple[Any, bytes]]:
+        '''
+        Fetches every job concurrently and yields results in completion order.
+
+        Parameters
+        ----------
+        jobs : Iterable[Tuple[Any, str, Dict[str, Any]]]
+            (key, url, params) for each request. `key` is handed back alongside the body so results can be matched to inputs.
+
+        Yields
+        ------
+        Tuple[Any, bytes]
+            (key, body) for each job, with body None if the request failed
+        '''
+        job_queue = asyncio.Queue()
+        num_jobs = 0
+        for job in jobs:
+            job_queue.put_nowait(job)
+            num_jobs += 1
+        if num_jobs == 0:
+            return
+
+        results = asyncio.Queue()
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.max_concurrency,
+            ttl_dns_cache=300
+        )
+        async with aiohttp.ClientSession(
+            headers=self.headers,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as session:
+
+            # Workers only bound the theoretical max, the limiters set the actual pace
+            workers = [
+                asyncio.create_task(self._work_through(session, job_queue, results))
+                for _ in range(min(self.max_concurrency, num_jobs))
+            ]
+            try:
+                for _ in range(num_jobs):
+                    yield await results.get()
+            finally:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _work_through(
+        self,
+        session: aiohttp.ClientSession,
+        job_queue: asyncio.Queue,
+        results: asyncio.Queue
+    ):
+        '''
+        Fetches jobs from `job_queue` one after another until it's empty, putting (key, body) for each on `results`.
+        '''
+        while True:
+            try:
+                key, url, params = job_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                body = await self._get(session, url, params)
+            except Exception:
+                logger.error("Unknown exception when fetching %s", url, exc_info=True)
+                body = None
+            await results.put((key, body))
+
+    def iter_locations(self, location_ids: Iterable[str]) -> AsyncIterator[Tuple[str, bytes]]:
+        return self.iter_responses(
+            (str(location_id), self.api_base_url + 'locations/' + str(location_id), None)
+            for location_id in location_ids
+        )
+
+    def iter_regions(
+        self,
+        search_criteria: Iterable[SearchCriterion]
+    ) -> AsyncIterator[Tuple[SearchCriterion, bytes]]:
+        return self.iter_responses(
+            (sc, self.api_base_url + 'locations/region', make_region_params(sc))
+            for sc in search_criteria
+        )
+
+
+class AsyncMainMapScraper(MainMapScraper):
+    '''
+    Browserless MainMapScraper that runs its locations through an AsyncPlugShareClient, so hundreds of locations can be in flight at once instead of one page at a time.
+    '''
+    def __init__(
+        self,
+        save_every: int = 100,
+        timeout: int = 10,
+        progress_bars: bool = True,
+        api_base_url: str = PLUGSHARE_API_URL,
+        initial_concurrency: int = 16,
+        max_concurrency: int = 256,
+        **kwargs
+    ):
+        kwargs.pop('fetch_mode', None)
+        super().__init__(
+            save_every=save_every,
+            timeout=timeout,
+            progress_bars=progress_bars,
+            fetch_mode='http',
+            api_base_url=api_base_url,
+            **kwargs
+        )
+        self.client = AsyncPlugShareClient(
+            api_base_url=api_base_url,
+            initial_concurrency=initial_concurrency,
+            max_concurrency=max_concurrency,
+            timeout=timeout
+        )
+
+    def start_http_session(self):
+        # Requests go through `self.client`, which opens its own aiohttp session for each run
+        pass
+
+    async def _run(self, locations: List[str]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        parser = LocationBatchParser()
+        progress = tqdm(
+            total=len(locations),
+            desc="Parsing stations",
+            disable=not self.use_tqdm
+        )
+
+        num_done = 0
+        unsaved_location_ids = []
+        async for location_id, body in self.client.iter_locations(locations):
+            progress.update(1)
+            num_done += 1
+            if body is None:
+                logger.error("No data found at location_id %s", location_id)
+                self._mark_ledger([location_id], 'failed', detail="No data found")
+                continue
+            self._archive_body('location', location_id, body)
+
+            try:
+                parser.add(body)
+            except Exception as e:
+                logger.error("Unknown exception when parsing data at location %s", location_id, exc_info=True)
+                self._mark_ledger([location_id], 'failed', detail=repr(e))
+                continue
+            unsaved_location_ids.append(location_id)
+
+            if len(parser) >= self.save_every:
+                logger.info("Saving checkpoint after %s locations", num_done)
+                # Keep fetching while BigQuery does its thing
+                await asyncio.to_thread(
+                    self._save_tables,
+                    *self._flush_batch(parser),
+                    on_durable=partial(self._mark_ledger, unsaved_location_ids, 'done')
+                )
+                unsaved_location_ids = []
+        progress.close()
+
+        for host, limiter in self.client.limiters.items():
+            logger.info("Final concurrency limit for %s: %s", host, limiter.current_limit)
+
+        return self._save_batch(
+            parser,
+            on_durable=partial(self._mark_ledger, unsaved_location_ids, 'done')
+        )
+
+    def run(
+        self,
+        locations: List[str],
+        close_when_done: bool = True,
+        skip_known: bool = False
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        logger.info("Beginning async scraping!")
+        # Only fresh discovery jobs skip stored locations, re-scrapes need to fetch them again
+        if skip_known:
+            locations = self._filter_known_locations(locations)
+        locations = self._start_ledger_items(locations)
+        results = asyncio.run(self._run(locations))
+        if close_when_done:
+            self.quit()
+        logger.info("Scraping complete!")
+        return results
+
+
+@ray.remote(max_restarts=3, max_task_retries=3)
+class ParallelAsyncMainMapScraper(AsyncMainMapScraper):
+    def save_to_bigquery(
+        self,
+        data: pd.DataFrame,
+        table_name: str,
+        merge_columns: Union[str, List[str]] = 'location_id'
+    ):
+        retry_strategy = retry(
+            wait=wait_random_exponential(multiplier=0.5, min=0, max=10),
+            stop=(stop_after_delay(10) | stop_after_attempt(5))
+        )
+        retry_strategy(super().save_to_bigquery)(data, table_name, merge_columns=merge_columns)
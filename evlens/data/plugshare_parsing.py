@@ -0,0 +1,362 @@
+from typing import Tuple, List, Dict, Union, Any, Callable
+import threading
+
+import orjson
+import pandas as pd
+
+from evlens import get_current_datetime
+from evlens.data.google_cloud import BigQuery
+from evlens.data.key_index import KeyIndex, make_keys
+from evlens.data.ledger import ProgressLedger
+from evlens.data.write_behind import WriteBehindUploader
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# (output column, API field) for each table, in output order
+STATION_FIELDS = [
+    ('location_id', 'id'),
+    ('name', 'name'),
+    ('description', 'description'),
+    ('amenities', 'amenities'),
+    ('photos', 'photos'),
+    ('plugscore', 'score'),
+    ('evse_count', 'station_count'),
+    ('access', 'access'),
+    ('phone', 'phone'),
+    ('address', 'address'),
+    ('location_type', 'poi_name'),
+    ('service_hours', 'hours'),
+    ('open247', 'open247'),
+    ('coming_soon', 'coming_soon'),
+    ('parking', 'parking_attributes'),
+    ('parking_level', 'parking_level'),
+    ('overhead_clearance_meters', 'overhead_clearance_meters'),
+    ('checkin_count', 'total_reviews')
+]
+STATION_COLUMNS = [c for c, _ in STATION_FIELDS] + ['kilowatts_max', 'network']
+
+EVSE_FIELDS = [
+    ('id', 'id'),
+    ('name', 'name'),
+    ('network_names', None),
+    ('kilowatts', 'kilowatts'),
+    ('manufacturer', 'manufacturer'),
+    ('model', 'model'),
+    ('station_id', 'location_id'),
+    ('available', 'available')
+]
+EVSE_COLUMNS = [c for c, _ in EVSE_FIELDS]
+
+CHECKIN_FIELDS = [
+    ('id', 'id'),
+    ('evse_id', 'station_id'),
+    ('comment', 'comment'),
+    ('created_at', 'created_at'),
+    ('finished', 'finished'),
+    ('connector_type', 'connector_type'),
+    ('charge_power_kilowatts', 'kilowatts'),
+    ('problem', 'problem_description'),
+    ('rating', 'rating'),
+    ('vehicle_name', 'vehicle_name')
+]
+CHECKIN_COLUMNS = [c for c, _ in CHECKIN_FIELDS] + ['vehicle_year']
+
+# Every scrape of a location adds a stations row, so the table keeps each location's history
+# (what `ChangeDetectionPlanner` and `RescrapeScheduler` read) instead of only its first scrape
+STATION_MERGE_COLUMNS = ['location_id', 'last_scraped']
+
+
+def _join(values: List[Any]) -> str:
+    if values is None:
+        return None
+    return ';'.join(str(v) for v in values)
+
+
+class LocationBatchParser:
+    '''
+    Accumulates raw `v3/locations/<id>` API payloads and builds the stations, checkins, and EVSEs tables for all of them in one columnar pass, instead of building (and later concatenating) a handful of small DataFrames per location.
+    '''
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._stations = {c: [] for c in STATION_COLUMNS}
+        self._evses = {c: [] for c in EVSE_COLUMNS}
+        self._checkins = {c: [] for c, _ in CHECKIN_FIELDS}
+        self.num_locations = 0
+
+    def __len__(self) -> int:
+        return self.num_locations
+
+    def add(self, body: Union[str, bytes, Dict[str, Any]]):
+        '''
+        Extracts one location's rows into the pending columns.
+
+        Parameters
+        ----------
+        body : Union[str, bytes, Dict[str, Any]]
+            Raw JSON of the API response, or the already-decoded payload
+
+        Raises
+        ------
+        ValueError
+            If `body` isn't valid JSON or isn't a location payload. Nothing from a payload that fails is added.
+        '''
+        location = orjson.loads(body) if isinstance(body, (str, bytes, bytearray, memoryview)) else body
+        if not isinstance(location, dict) or location.get('id') is None:
+            raise ValueError("Payload is not a PlugShare location")
+        location_id = str(location['id'])
+
+        # Extract everything before touching the columns so a bad payload leaves them consistent
+        evses = location.get('stations') or []
+        network_names = []
+        for evse in evses:
+            name = (evse.get('network') or {}).get('name')
+            if name is not None and name not in network_names:
+                network_names.append(name)
+        network_names = ';'.join(network_names) if network_names else None
+
+        evse_rows = []
+        for evse in evses:
+            row = [evse.get(field) for _, field in EVSE_FIELDS[:2]]
+            row += [
+                network_names,
+                evse.get('kilowatts'),
+                evse.get('manufacturer'),
+                evse.get('model'),
+                str(evse['location_id']) if evse.get('location_id') is not None else location_id,
+                evse.get('available')
+            ]
+            evse_rows.append(row)
+
+        checkin_rows = [
+            [review.get(field) for _, field in CHECKIN_FIELDS]
+            for review in (location.get('reviews') or [])
+            if review.get('spam_category_description') is None
+        ]
+
+        station_row = [location.get(field) for _, field in STATION_FIELDS]
+        station_row[0] = location_id
+        station_row[3] = _join([a['type'] for a in location.get('amenities') or []])
+        station_row[4] = _join([p['url'] for p in location.get('photos') or []])
+        station_row[14] = _join(station_row[14])
+        kilowatts = [e.get('kilowatts') for e in evses if e.get('kilowatts') is not None]
+        station_row += [
+            max(kilowatts) if kilowatts else None,
+            network_names if evses else None
+        ]
+
+        for column, value in zip(STATION_COLUMNS, station_row):
+            self._stations[column].append(value)
+        for row in evse_rows:
+            for column, value in zip(EVSE_COLUMNS, row):
+                self._evses[column].append(value)
+        for row in checkin_rows:
+            for (column, _), value in zip(CHECKIN_FIELDS, row):
+                self._checkins[column].append(value)
+        self.num_locations += 1
+
+    def flush(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''
+        Builds the tables for everything added since the last flush and starts a fresh batch.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+            (stations, checkins, evses), one row per location, non-spam check-in, and EVSE respectively
+        '''
+        df_stations = pd.DataFrame(self._stations, columns=STATION_COLUMNS)
+        df_evses = pd.DataFrame(self._evses, columns=EVSE_COLUMNS)
+        df_checkins = pd.DataFrame(self._checkins, columns=CHECKIN_COLUMNS[:-1])
+        self._reset()
+
+        df_stations['kilowatts_max'] = df_stations['kilowatts_max'].astype(float)
+        df_evses['kilowatts'] = df_evses['kilowatts'].astype(float)
+
+        df_checkins['created_at'] = pd.to_datetime(df_checkins['created_at'], utc=True)
+        df_checkins['finished'] = pd.to_datetime(df_checkins['finished'], utc=True)
+        # Extract year from strings structured like 'Hyundai Ioniq Electric 2019'
+        df_checkins['vehicle_year'] = df_checkins['vehicle_name'].astype(object)\
+            .str.extract(r'(\d{4}$)', expand=False).astype(float)
+
+        return df_stations, df_checkins, df_evses
+
+    @classmethod
+    def parse(cls, body: Union[str, bytes]) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''
+        Parses a single location's payload. Same output as `add()` then `flush()`.
+        '''
+        parser = cls()
+        parser.add(body)
+        return parser.flush()
+
+
+class LocationTableWriter:
+    '''
+    Turns batches of parsed locations into the stations, checkins, and EVSEs BigQuery tables. Shared by everything that produces those tables, whether it scrapes the responses itself or only parses them.
+
+    Subclasses are expected to set `_bq_client` (None to create one lazily) and `_bq_dataset_name`, and optionally `key_index_path` to skip saving rows that are already stored `write_behind` (with `outbox_path`) to save from a background thread, and `bulk_loader` (a `StagedBulkLoader`) to stage saves for one bulk load per table instead of loading each one, and `ledger_path` to record items in a `ProgressLedger`.
+    '''
+    _bq_client = None
+    _bq_dataset_name = 'plugshare'
+    _key_indexes = None
+    key_index_path = None
+    _uploader = None
+    write_behind = False
+    outbox_path = None
+    bulk_loader = None
+    ledger_path = None
+    _ledger = None
+
+    @property
+    def bq_client(self) -> BigQuery:
+        # Lazy so that scrapers which never save (e.g. tests) don't need GCP credentials
+        if self._bq_client is None:
+            self._bq_client = BigQuery(project='evlens')
+        return self._bq_client
+
+    @property
+    def key_index(self) -> KeyIndex:
+        # Opened lazily (and per process) since SQLite connections can't be pickled over to Ray actors,
+        # and per thread since they can't be shared with the thread that saves in the background either
+        if self.key_index_path is None:
+            return None
+        if self._key_indexes is None:
+            self._key_indexes = dict()
+        thread_id = threading.get_ident()
+        if thread_id not in self._key_indexes:
+            self._key_indexes[thread_id] = KeyIndex(self.key_index_path)
+        return self._key_indexes[thread_id]
+
+    @property
+    def uploader(self) -> WriteBehindUploader:
+        if self._uploader is None and self.write_behind:
+            self._uploader = WriteBehindUploader(
+                lambda data, table_name, merge_columns: self.save_to_bigquery(
+                    data,
+                    table_name,
+                    merge_columns=merge_columns
+                ),
+                outbox_path=self.outbox_path
+            )
+        return self._uploader
+
+    @property
+    def ledger(self) -> ProgressLedger:
+        # Opened lazily so each Ray actor gets its own file handle
+        if self._ledger is None and self.ledger_path is not None:
+            self._ledger = ProgressLedger(self.ledger_path)
+        return self._ledger
+
+    def _mark_ledger(self, keys: List[str], state: str, detail: str = None):
+        if self.ledger is not None:
+            self.ledger.mark(keys, state, detail=detail)
+
+    @classmethod
+    def _stamp_station(cls, df_station: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Adds the row IDs and scrape time to freshly-parsed station data (in place).
+        '''
+        df_station['id'] = [BigQuery.make_uuid() for _ in range(len(df_station))]
+        df_station['last_scraped'] = get_current_datetime(
+            date_delimiter=None,
+            time_delimiter=None
+        )
+        return df_station
+
+    def save_to_bigquery(
+        self,
+        data: pd.DataFrame,
+        table_name: str,
+        merge_columns: Union[str, List[str]] = 'location_id'
+    ):
+        logger.info(
+            "Saving %s rows to BigQuery table '%s'...",
+            len(data),
+            table_name
+        )
+        if data.empty:
+            logger.error("`data` empty, not saving to BigQuery`")
+            return
+
+        # The key index tracks which locations have stations rows at all (what `run(skip_known=True)` checks),
+        # not which scrapes of them, so it can't be used to skip station rows
+        namespace = f"{self._bq_dataset_name}.{table_name}"
+        key_index = self.key_index if table_name != 'stations' else None
+        if self.bulk_loader is not None:
+            # Nothing is in the table until the bulk load, so only use the key index to skip rows
+            if key_index is not None:
+                keys = make_keys(data, merge_columns)
+                data = data[~keys.isin(key_index.filter_known(namespace, keys))]
+            if not data.empty:
+                self.bulk_loader.stage(data, table_name, merge_columns=merge_columns)
+        else:
+            self.bq_client.insert_data(
+                data,
+                self._bq_dataset_name,
+                table_name,
+                merge_columns=merge_columns,
+                key_index=key_index
+            )
+            if table_name == 'stations' and self.key_index is not None:
+                self.key_index.add(namespace, data['location_id'].astype(str))
+
+    def _save_table_group(
+        self,
+        tables: List[Tuple[pd.DataFrame, str, Union[str, List[str]]]],
+        on_durable: Callable[[], Any] = None
+    ):
+        '''
+        Saves (data, table_name, merge_columns) for each table, through the write-behind uploader if there is one, then calls `on_durable` once they're all safe.
+        '''
+        if self.uploader is not None:
+            self.uploader.submit(tables, on_durable=on_durable)
+            return
+
+        for data, table_name, merge_columns in tables:
+            self.save_to_bigquery(data, table_name, merge_columns=merge_columns)
+        if on_durable is not None:
+            on_durable()
+
+    def _save_batch(
+        self,
+        parser: LocationBatchParser,
+        on_durable: Callable[[], Any] = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''
+        Builds the tables for every location pending in `parser` and saves them to BigQuery.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+            The (stations, checkins, evses) that were saved
+        '''
+        return self._save_tables(*self._flush_batch(parser), on_durable=on_durable)
+
+    def _flush_batch(
+        self,
+        parser: LocationBatchParser
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        df_stations, df_checkins, df_evses = parser.flush()
+        self._stamp_station(df_stations)
+        return df_stations, df_checkins, df_evses
+
+    def _save_tables(
+        self,
+        df_stations: pd.DataFrame,
+        df_checkins: pd.DataFrame,
+        df_evses: pd.DataFrame,
+        on_durable: Callable[[], Any] = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        self._save_table_group(
+            [
+                (df_stations, 'stations', STATION_MERGE_COLUMNS),
+                (df_checkins, 'checkins', 'id'),
+                (df_evses, 'evses', 'id')
+            ],
+            on_durable=on_durable
+        )
+
+        return df_stations, df_checkins, df_evses
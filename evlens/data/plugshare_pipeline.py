@@ -0,0 +1,355 @@
+from typing import Tuple, List, Dict, Iterable, Any, Union
+from functools import partial
+
+import pandas as pd
+import ray
+import ray.exceptions
+from ray.util.queue import Queue, Empty
+from tenacity import retry, wait_random_exponential, stop_after_delay, stop_after_attempt
+
+from evlens.concurrency import parse_n_jobs, get_batches_by_worker
+from evlens.data.archive import ResponseArchive
+from evlens.data.plugshare_parsing import LocationBatchParser, LocationTableWriter
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# Put on the queue once per parser to tell it no more bodies are coming
+END_OF_STREAM = None
+
+
+class LocationParser(LocationTableWriter):
+    '''
+    Parse stage of the capture -> parse pipeline: turns raw `v3/locations/<id>` response bodies into the stations, checkins, and EVSEs tables and saves them, without needing a browser.
+    '''
+    def __init__(
+        self,
+        save_every: int = 1000,
+        save: bool = True,
+        key_index_path: str = None,
+        ledger_path: str = None
+    ):
+        '''
+        Parameters
+        ----------
+        save_every : int, optional
+            Number of locations to parse between saves to BigQuery, by default 1000
+        save : bool, optional
+            If False, tables are kept in memory and returned by `finish()` instead of being saved (e.g. for testing), by default True
+        key_index_path : str, optional
+            SQLite file of a `KeyIndex` to skip saving rows that are already stored, by default None
+        ledger_path : str, optional
+            File of the capture scrapers' `ProgressLedger`. If provided, locations are marked done once their rows are saved, or failed if they can't be parsed, by default None
+        '''
+        self.save_every = save_every
+        self.save = save
+        self.key_index_path = key_index_path
+        self.ledger_path = ledger_path
+        self._bq_client = None
+        self._bq_dataset_name = 'plugshare'
+
+        self.parser = LocationBatchParser()
+        self.num_parsed = 0
+        self.num_failed = 0
+        self._unsaved_tables = []
+        self._unsaved_location_ids = []
+
+    def _checkpoint(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        if self.save:
+            tables = self._save_batch(
+                self.parser,
+                on_durable=partial(self._mark_ledger, self._unsaved_location_ids, 'done')
+            )
+            self._unsaved_location_ids = []
+            return tables
+
+        tables = self._flush_batch(self.parser)
+        self._unsaved_tables.append(tables)
+        return tables
+
+    def parse(self, items: Iterable[Tuple[str, bytes]]) -> int:
+        '''
+        Parses (location_id, body) pairs, checkpointing every `save_every` locations.
+
+        Returns
+        -------
+        int
+            Number of bodies successfully parsed
+        '''
+        num_parsed = 0
+        for location_id, body in items:
+            try:
+                self.parser.add(body)
+            except Exception as e:
+                logger.error("Unknown exception when parsing data at location %s", location_id, exc_info=True)
+                self._mark_ledger([location_id], 'failed', detail=repr(e))
+                self.num_failed += 1
+                continue
+            self._unsaved_location_ids.append(location_id)
+            num_parsed += 1
+
+            if len(self.parser) >= self.save_every:
+                logger.info("Saving checkpoint after %s locations", self.num_parsed + num_parsed)
+                self._checkpoint()
+
+        self.num_parsed += num_parsed
+        return num_parsed
+
+    def consume(
+        self,
+        queue: Queue,
+        batch_size: int = 100,
+        timeout: float = None
+    ) -> Dict[str, int]:
+        '''
+        Parses everything put on `queue` until it receives END_OF_STREAM, then saves whatever is left.
+
+        Parameters
+        ----------
+        queue : Queue
+            Queue of (location_id, body) pairs, e.g. the `output_queue` of capture-only scrapers
+        batch_size : int, optional
+            Most items taken off the queue in one call, to amortize the round trip to the queue actor, by default 100
+        timeout : float, optional
+            Seconds to wait for the next item before giving up. If None, waits forever, by default None
+
+        Returns
+        -------
+        Dict[str, int]
+            Counts of bodies parsed and failed
+        '''
+        done = False
+        while not done:
+            try:
+                items = [queue.get(block=True, timeout=timeout)]
+            except Empty:
+                logger.error("Nothing on the queue for %s seconds, stopping", timeout)
+                break
+
+            num_waiting = min(batch_size - 1, queue.qsize())
+            if num_waiting > 0:
+                try:
+                    items.extend(queue.get_nowait_batch(num_waiting))
+                except Empty:
+                    # Another parser got there first
+                    pass
+
+            if END_OF_STREAM in items:
+                done = True
+                # Hand back any end markers meant for the other parsers
+                for _ in range(items.count(END_OF_STREAM) - 1):
+                    queue.put(END_OF_STREAM)
+                items = [item for item in items if item is not END_OF_STREAM]
+            self.parse(items)
+
+        self.finish()
+        return {'parsed': self.num_parsed, 'failed': self.num_failed}
+
+    def parse_archive(
+        self,
+        archive_path: str,
+        segments: List[str] = None
+    ) -> Dict[str, int]:
+        '''
+        Re-derives the tables from location responses in a `ResponseArchive`, no browsers needed.
+
+        Parameters
+        ----------
+        archive_path : str
+            Directory of the archive
+        segments : List[str], optional
+            Only parse these segment files. If None, parses the whole archive, by default None
+
+        Returns
+        -------
+        Dict[str, int]
+            Counts of bodies parsed and failed
+        '''
+        archive = ResponseArchive(archive_path)
+        self.parse(
+            (key, body) for _, key, body in archive.iter_records(kind='location', segments=segments)
+        )
+        archive.close()
+        self.finish()
+        return {'parsed': self.num_parsed, 'failed': self.num_failed}
+
+    def finish(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        '''
+        Saves any locations parsed since the last checkpoint.
+
+        Returns
+        -------
+        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+            If `save` is False, everything this parser produced. Otherwise just the final checkpoint.
+        '''
+        if self.save:
+            if len(self.parser) == 0:
+                return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+            return self._checkpoint()
+
+        if len(self.parser) > 0 or not self._unsaved_tables:
+            self._checkpoint()
+        return tuple(
+            pd.concat([t[i] for t in self._unsaved_tables], ignore_index=True)
+            for i in range(3)
+        )
+
+
+@ray.remote(max_restarts=3, max_task_retries=3)
+class ParallelLocationParser(LocationParser):
+    def save_to_bigquery(
+        self,
+        data: pd.DataFrame,
+        table_name: str,
+        merge_columns: Union[str, List[str]] = 'location_id'
+    ):
+        retry_strategy = retry(
+            wait=wait_random_exponential(multiplier=0.5, min=0, max=10),
+            stop=(stop_after_delay(10) | stop_after_attempt(5))
+        )
+        retry_strategy(super().save_to_bigquery)(data, table_name, merge_columns=merge_columns)
+
+
+def capture_and_parse(
+    scraper: Any,
+    locations: List[str],
+    n_browsers: int = 2,
+    n_parsers: int = 1,
+    queue_size: int = 1000,
+    parser_batch_size: int = 100,
+    parser_save_every: int = 1000,
+    **scraper_kwargs
+) -> Dict[str, int]:
+    '''
+    Runs the scraping pipeline as two independently-sized pools: capture-only scrapers that put raw response bodies on a bounded queue, and parsers that take them off, build the tables, and save them.
+
+    Parameters
+    ----------
+    scraper : Any
+        Ray actor class for the capture stage, e.g. `ParallelMainMapScraper`
+    locations : List[str]
+        PlugShare location IDs to scrape
+    n_browsers : int, optional
+        Number of capture actors, by default 2
+    n_parsers : int, optional
+        Number of parser actors, by default 1
+    queue_size : int, optional
+        Most bodies waiting to be parsed at once. Capture actors block when it's full, by default 1000
+    parser_batch_size : int, optional
+        Passed to `LocationParser.consume()`, by default 100
+    parser_save_every : int, optional
+        Locations each parser parses between saves, by default 1000
+    scraper_kwargs
+        Passed to each capture actor on instantiation, e.g. `archive_path` to also keep the raw bodies on disk. Any `ledger_path` is also given to the parsers, which mark locations done once they're saved
+
+    Returns
+    -------
+    Dict[str, int]
+        Counts of bodies parsed and failed across all parsers
+    '''
+    # Just in case
+    ray.shutdown()
+    n_jobs = parse_n_jobs(n_browsers + n_parsers)
+    ray.init(
+        num_cpus=n_jobs,
+        include_dashboard=False
+    )
+
+    queue = Queue(maxsize=queue_size)
+    parsers = [
+        ParallelLocationParser.remote(
+            save_every=parser_save_every,
+            ledger_path=scraper_kwargs.get('ledger_path')
+        )
+        for _ in range(n_parsers)
+    ]
+    parse_results = [
+        p.consume.remote(queue, batch_size=parser_batch_size) for p in parsers
+    ]
+
+    location_batches = get_batches_by_worker(locations, n_browsers)
+    scrapers = [
+        scraper.remote(parse_responses=False, output_queue=queue, **scraper_kwargs)
+        for _ in range(len(location_batches))
+    ]
+    logger.info(
+        "Capturing with %s browsers and parsing with %s parsers, batches of sizes %s",
+        len(scrapers),
+        n_parsers,
+        [len(batch) for batch in location_batches]
+    )
+
+    try:
+        ray.get([s.run.remote(batch) for s, batch in zip(scrapers, location_batches)])
+        for _ in parsers:
+            queue.put(END_OF_STREAM)
+        results = ray.get(parse_results)
+
+    except (ray.exceptions.RayTaskError, ray.exceptions.RayActorError) as e:
+        logger.error("Ray had an error. See the dashboard for more information.")
+        raise e
+
+    finally:
+        ray.shutdown()
+
+    return {
+        'parsed': sum(r['parsed'] for r in results),
+        'failed': sum(r['failed'] for r in results)
+    }
+
+
+def reparse_archive(
+    archive_path: str,
+    n_jobs: int = -1,
+    save_every: int = 1000
+) -> Dict[str, int]:
+    '''
+    Rebuilds the tables from every location response in a `ResponseArchive`, splitting the segment files across a pool of parsers.
+
+    Parameters
+    ----------
+    archive_path : str
+        Directory of the archive
+    n_jobs : int, optional
+        Number of parser actors. -1 uses all but one CPU, by default -1
+    save_every : int, optional
+        Locations each parser parses between saves, by default 1000
+
+    Returns
+    -------
+    Dict[str, int]
+        Counts of bodies parsed and failed across all parsers
+    '''
+    segments = ResponseArchive(archive_path).segments()
+    if len(segments) == 0:
+        logger.error("No segments found in archive %s", archive_path)
+        return {'parsed': 0, 'failed': 0}
+
+    ray.shutdown()
+    n_jobs = min(parse_n_jobs(n_jobs), len(segments))
+    ray.init(
+        num_cpus=n_jobs,
+        include_dashboard=False
+    )
+
+    # Round-robin so parsers get a similar mix of old and new segments
+    segment_batches = [segments[i::n_jobs] for i in range(n_jobs)]
+    parsers = [ParallelLocationParser.remote(save_every=save_every) for _ in segment_batches]
+    try:
+        results = ray.get([
+            p.parse_archive.remote(archive_path, segments=batch)
+            for p, batch in zip(parsers, segment_batches)
+        ])
+
+    except (ray.exceptions.RayTaskError, ray.exceptions.RayActorError) as e:
+        logger.error("Ray had an error. See the dashboard for more information.")
+        raise e
+
+    finally:
+        ray.shutdown()
+
+    return {
+        'parsed': sum(r['parsed'] for r in results),
+        'failed': sum(r['failed'] for r in results)
+    }
@@ -0,0 +1,259 @@
+from typing import Callable, List, Dict, Tuple, Union, Any
+from threading import Thread, Lock
+from time import monotonic, sleep, time_ns
+import os
+import pickle
+import queue
+
+import pandas as pd
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+OUTBOX_SUFFIX = '.pkl'
+
+
+class _DurabilityTracker:
+    '''
+    Calls `callback` once every part of a submission is either saved or spilled to the outbox.
+    '''
+    def __init__(self, num_parts: int, callback: Callable[[], Any]):
+        self.num_parts = num_parts
+        self.callback = callback
+        self._lock = Lock()
+
+    def part_durable(self):
+        with self._lock:
+            self.num_parts -= 1
+            done = self.num_parts == 0
+        if done and self.callback is not None:
+            try:
+                self.callback()
+            except Exception:
+                logger.error("`on_durable` callback failed", exc_info=True)
+
+
+class WriteBehindUploader:
+    '''
+    Background thread that takes table saves off the scrape loop. Submitted DataFrames are buffered per table and saved once enough rows or bytes pile up (or enough time passes), and any batch the warehouse can't take right now, because a save fails or the queue is full, is spilled to a local outbox on disk and retried until it goes through. Nothing submitted is dropped.
+    '''
+    def __init__(
+        self,
+        save: Callable[[pd.DataFrame, str, Union[str, List[str]]], Any],
+        outbox_path: str = None,
+        max_queued: int = 32,
+        flush_rows: int = 5_000,
+        flush_bytes: int = 64 * 1024**2,
+        flush_interval: float = 60,
+        retry_interval: float = 30
+    ):
+        '''
+        Parameters
+        ----------
+        save : Callable[[pd.DataFrame, str, Union[str, List[str]]], Any]
+            Does the actual save given (data, table_name, merge_columns), e.g. a scraper's `save_to_bigquery`. Should raise if the data wasn't saved.
+        outbox_path : str, optional
+            Local directory for batches that couldn't be saved yet. Batches left there by an earlier run are retried too. If None, failed saves are retried in memory and submissions block once the queue is full, by default None
+        max_queued : int, optional
+            Most submissions waiting for the background thread before new ones go straight to the outbox (or block, without one), by default 32
+        flush_rows : int, optional
+            Rows buffered for a table before it's saved, by default 5,000
+        flush_bytes : int, optional
+            Bytes buffered for a table before it's saved, by default 64 MB
+        flush_interval : float, optional
+            Most seconds a buffered table waits before it's saved anyway, by default 60
+        retry_interval : float, optional
+            Seconds between attempts to drain the outbox (or re-save a failed batch) after a failure, by default 30
+        '''
+        self.save = save
+        self.outbox_path = outbox_path
+        if outbox_path is not None:
+            os.makedirs(outbox_path, exist_ok=True)
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        # (table_name, merge_columns) -> (DataFrames, their trackers, rows, bytes, time of first one)
+        self._buffers: Dict[Tuple[str, Any], List] = dict()
+        self._next_retry = 0
+        self._closed = False
+        self.num_saved = 0
+        self.num_spilled = 0
+
+        self._thread = Thread(target=self._work, name='write-behind-uploader', daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        tables: List[Tuple[pd.DataFrame, str, Union[str, List[str]]]],
+        on_durable: Callable[[], Any] = None
+    ):
+        '''
+        Queues tables to be saved in the background.
+
+        Parameters
+        ----------
+        tables : List[Tuple[pd.DataFrame, str, Union[str, List[str]]]]
+            (data, table_name, merge_columns) for each table, e.g. one checkpoint's stations, checkins, and EVSEs
+        on_durable : Callable[[], Any], optional
+            Called (from the background thread) once every table in `tables` has been saved or spilled to the outbox, e.g. to mark the checkpoint's items done in a `ProgressLedger`, by default None
+        '''
+        if self._closed:
+            raise RuntimeError("Uploader is closed")
+        tables = [t for t in tables if not t[0].empty]
+        if len(tables) == 0:
+            # Nothing to save means nothing to lose
+            _DurabilityTracker(1, on_durable).part_durable()
+            return
+        tracker = _DurabilityTracker(len(tables), on_durable)
+
+        for data, table_name, merge_columns in tables:
+            item = (data, table_name, merge_columns, tracker)
+            if self.outbox_path is None:
+                self._queue.put(item)
+                continue
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                # Warehouse isn't keeping up, don't make the scraper wait on it
+                logger.warning("Upload queue full, spilling %s rows for '%s' to the outbox", len(data), table_name)
+                self._spill(data, table_name, merge_columns)
+                tracker.part_durable()
+
+    def flush(self):
+        '''
+        Blocks until everything submitted so far has been saved or spilled.
+        '''
+        self._queue.put(('flush', None, None, None))
+        self._queue.join()
+
+    def close(self, timeout: float = None):
+        '''
+        Saves (or spills) everything still buffered, makes one last attempt to drain the outbox, and stops the background thread. Anything left in the outbox is retried by the next uploader that uses it.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(('close', None, None, None))
+        self._thread.join(timeout)
+
+    def pending_outbox(self) -> List[str]:
+        '''
+        Outbox files waiting to be saved, oldest first.
+        '''
+        if self.outbox_path is None:
+            return []
+        return sorted(f for f in os.listdir(self.outbox_path) if f.endswith(OUTBOX_SUFFIX))
+
+    def _spill(self, data: pd.DataFrame, table_name: str, merge_columns: Union[str, List[str]]):
+        filename = f"{time_ns()}-{os.getpid()}-{table_name}{OUTBOX_SUFFIX}"
+        path = os.path.join(self.outbox_path, filename)
+        # Write-then-rename so a crash never leaves a half-written batch to be retried
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(
+                {'data': data, 'table_name': table_name, 'merge_columns': merge_columns},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.num_spilled += 1
+
+    def _try_save(self, data: pd.DataFrame, table_name: str, merge_columns: Union[str, List[str]]) -> bool:
+        try:
+            self.save(data, table_name, merge_columns)
+        except Exception:
+            logger.error("Couldn't save %s rows to '%s'", len(data), table_name, exc_info=True)
+            self._next_retry = monotonic() + self.retry_interval
+            return False
+        self.num_saved += 1
+        return True
+
+    def _flush_buffer(self, buffer_key: Tuple[str, Any]):
+        frames, trackers, _, _, _ = self._buffers.pop(buffer_key)
+        table_name, _ = buffer_key
+        merge_columns = frames[0][1]
+        data = pd.concat([f for f, _ in frames], ignore_index=True)
+
+        # Don't pile more saves on a warehouse that just failed
+        saved = monotonic() >= self._next_retry and self._try_save(data, table_name, merge_columns)
+        while not saved:
+            if self.outbox_path is not None:
+                self._spill(data, table_name, merge_columns)
+                break
+            sleep(max(0, self._next_retry - monotonic()))
+            saved = self._try_save(data, table_name, merge_columns)
+
+        for tracker in trackers:
+            tracker.part_durable()
+
+    def _drain_outbox(self):
+        for filename in self.pending_outbox():
+            if monotonic() < self._next_retry:
+                return
+            path = os.path.join(self.outbox_path, filename)
+            try:
+                with open(path, 'rb') as f:
+                    batch = pickle.load(f)
+            except Exception:
+                logger.error("Unreadable outbox file %s, leaving it in place", path, exc_info=True)
+                continue
+            if not self._try_save(batch['data'], batch['table_name'], batch['merge_columns']):
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another uploader sharing the outbox saved it too, which the merge dedupe makes harmless
+                pass
+            logger.info("Saved %s outbox rows to '%s'", len(batch['data']), batch['table_name'])
+
+    def _add_to_buffer(self, data: pd.DataFrame, table_name: str, merge_columns: Union[str, List[str]], tracker):
+        buffer_key = (table_name, str(merge_columns))
+        if buffer_key not in self._buffers:
+            self._buffers[buffer_key] = [[], [], 0, 0, monotonic()]
+        buffer = self._buffers[buffer_key]
+        buffer[0].append((data, merge_columns))
+        buffer[1].append(tracker)
+        buffer[2] += len(data)
+        buffer[3] += int(data.memory_usage(deep=True).sum())
+
+    def _flush_due_buffers(self, force: bool = False):
+        # Save anything flushed on request or big or old enough
+        for buffer_key in list(self._buffers.keys()):
+            _, _, num_rows, num_bytes, started = self._buffers[buffer_key]
+            if force \
+                or num_rows >= self.flush_rows \
+                or num_bytes >= self.flush_bytes \
+                or monotonic() - started >= self.flush_interval:
+                self._flush_buffer(buffer_key)
+
+    def _drain_outbox_if_due(self, force: bool = False):
+        if self.outbox_path is not None and (force or monotonic() >= self._next_retry):
+            self._drain_outbox()
+
+    def _work(self):
+        while True:
+            command = None
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                data, table_name, merge_columns, tracker = item
+                if isinstance(data, str):
+                    command = data
+                else:
+                    self._add_to_buffer(data, table_name, merge_columns, tracker)
+
+            self._flush_due_buffers(force=command is not None)
+            self._drain_outbox_if_due(force=command is not None)
+
+            if item is not None:
+                self._queue.task_done()
+            if command == 'close':
+                return
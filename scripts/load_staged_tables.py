@@ -0,0 +1,37 @@
+from evlens.data.bulk_load import StagedBulkLoader, GCSStagingBucket
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "prefix",
+        type=str,
+        help="Blob name prefix the scrapers' `StagedBulkLoader` staged files under."
+    )
+    parser.add_argument(
+        "--bucket",
+        type=str,
+        default='plugshare_scraping',
+        help="GCS bucket the files were staged in."
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default='plugshare',
+        help="BigQuery dataset holding the tables."
+    )
+    parser.add_argument(
+        "--tables",
+        default=None,
+        nargs='+',
+        help="Only load these tables. Should be passed as --tables table1 table2 ... Loads every staged table if not provided."
+    )
+    args = parser.parse_args()
+    
+    loader = StagedBulkLoader(bucket=GCSStagingBucket(args.bucket), prefix=args.prefix, dataset_name=args.dataset)
+    num_rows = loader.load(table_names=args.tables)
+    print(f"Staged tables loaded: {num_rows}")
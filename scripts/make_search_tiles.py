@@ -0,0 +1,65 @@
+from evlens.data.nrel_api import AFDC
+from evlens.data.geo import make_search_tiles
+from evlens.data.google_cloud import BigQuery
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--max_radius",
+        type=float,
+        default=1.0,
+        help="Largest search tile radius in miles. Every station ends up within this distance of a tile center."
+    )
+    parser.add_argument(
+        "--min_radius",
+        type=float,
+        default=0.1,
+        help="Smallest search tile radius in miles."
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default='plugshare',
+        help="BigQuery dataset holding the search tile table."
+    )
+    parser.add_argument(
+        "--table",
+        type=str,
+        default='searchTilesNREL',
+        help="Search tile table to write to."
+    )
+    parser.add_argument(
+        "--replace",
+        action='store_true',
+        help="Clear the table before writing the new tiles, rather than only adding tiles for stations not already used as tile centers."
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="If provided, writes the tiles to this local Parquet file instead of BigQuery."
+    )
+    args = parser.parse_args()
+    
+    df_stations = AFDC().get_stations()
+    df_tiles = make_search_tiles(
+        df_stations,
+        max_radius_in_miles=args.max_radius,
+        min_radius_in_miles=args.min_radius
+    )
+    print(f"{len(df_tiles):,} search tiles cover {len(df_stations):,} stations")
+    
+    if args.output_path is not None:
+        df_tiles.to_parquet(args.output_path, index=False)
+    
+    else:
+        bq = BigQuery()
+        if args.replace:
+            bq.clear_table(args.dataset, args.table)
+        num_inserted = bq.insert_data(df_tiles, args.dataset, args.table, merge_columns='id')
+        print(f"{num_inserted:,} search tiles written to {args.dataset}.{args.table}")
@@ -0,0 +1,91 @@
+import os
+
+from evlens import get_current_datetime
+from evlens.data.nrel_api import AFDC
+from evlens.data.matching import StationMatcher
+from evlens.data.google_cloud import BigQuery
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+CROSSWALK_SCHEMA_PATH = os.path.join(
+    os.path.dirname(__file__),
+    '..',
+    'cloud',
+    'bq_plugshare_afdcCrosswalkTable_config.json'
+)
+
+
+def make_locations_query(bq: BigQuery, dataset: str) -> str:
+    '''
+    Latest coordinates, plug types, and network of every PlugShare location scraped so far.
+    '''
+    return f"""
+    SELECT
+        l.location_id,
+        l.latitude,
+        l.longitude,
+        l.plug_types,
+        s.network
+    FROM `{bq._make_table_id(dataset, 'locationID')}` l
+    LEFT JOIN (
+        SELECT location_id, network
+        FROM `{bq._make_table_id(dataset, 'stations')}`
+        WHERE true
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY location_id ORDER BY last_scraped DESC) = 1
+    ) s
+    ON l.location_id = s.location_id
+    WHERE true
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY l.location_id ORDER BY l.parsed_datetime DESC) = 1
+    """
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--max_distance",
+        type=float,
+        default=0.25,
+        help="Farthest apart (in miles) a PlugShare location and an AFDC station can be and still match."
+    )
+    parser.add_argument(
+        "--min_confidence",
+        type=float,
+        default=0.5,
+        help="Lowest match confidence (0 to 1) kept in the crosswalk."
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default='plugshare',
+        help="BigQuery dataset holding the PlugShare tables and the crosswalk."
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="If provided, writes the crosswalk to this local Parquet file instead of replacing the afdcCrosswalk table."
+    )
+    args = parser.parse_args()
+    
+    bq = BigQuery()
+    df_locations = bq.query_to_dataframe(make_locations_query(bq, args.dataset))
+    df_stations = AFDC().get_stations()
+    
+    matcher = StationMatcher(
+        max_distance_miles=args.max_distance,
+        min_confidence=args.min_confidence
+    )
+    df_crosswalk = matcher.match(df_locations, df_stations)
+    df_crosswalk['matched_datetime'] = get_current_datetime(date_delimiter=None, time_delimiter=None)
+    print(f"{len(df_crosswalk):,} of {len(df_locations):,} PlugShare locations matched to {len(df_stations):,} AFDC stations")
+    
+    if args.output_path is not None:
+        df_crosswalk.to_parquet(args.output_path, index=False)
+    
+    else:
+        # Every run re-matches everything, so it replaces the last crosswalk
+        if not bq.table_exists(args.dataset, 'afdcCrosswalk'):
+            bq.setup_table(args.dataset, 'afdcCrosswalk', CROSSWALK_SCHEMA_PATH)
+        bq.replace_table(df_crosswalk, args.dataset, 'afdcCrosswalk')
@@ -0,0 +1,48 @@
+from evlens.data.google_cloud import BigQuery
+from evlens.data.key_index import KeyIndex
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# Table name: primary key column(s) used when saving it
+TABLE_KEYS = {
+    'stations': 'location_id',
+    'checkins': 'id',
+    'evses': 'id',
+    'locationID': 'location_id'
+}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "key_index_path",
+        type=str,
+        help="SQLite file for the key index. Every scraper on this host should be pointed at the same file via `key_index_path`."
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default='plugshare',
+        help="BigQuery dataset holding the tables."
+    )
+    parser.add_argument(
+        "--tables",
+        default=list(TABLE_KEYS.keys()),
+        nargs='+',
+        help=f"Tables to rebuild the index for. Should be passed as --tables table1 table2 ... Any of {list(TABLE_KEYS.keys())}."
+    )
+    args = parser.parse_args()
+    
+    bq = BigQuery()
+    key_index = KeyIndex(args.key_index_path)
+    for table_name in args.tables:
+        key_column = TABLE_KEYS[table_name]
+        query = f"SELECT DISTINCT {key_column} FROM `{bq._make_table_id(args.dataset, table_name)}`"
+        keys = bq.query_to_dataframe(query)[key_column].dropna()
+        key_index.rebuild(f"{args.dataset}.{table_name}", keys.astype(str))
+        
+    key_index.close()
+    print("Key index rebuilt!")
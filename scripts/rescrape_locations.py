@@ -0,0 +1,119 @@
+from datetime import timedelta
+import os
+
+from evlens.data.plugshare import ParallelMainMapScraper
+from evlens.data.planning import ChangeDetectionPlanner, RescrapeScheduler
+from evlens.concurrency import parallelized_data_processing, parse_n_jobs
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__, send_to_gcp=True)
+
+from datetime import date, datetime
+TODAY_STRING = date.today().strftime("%m-%d-%Y")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--time_budget_hours",
+        type=float,
+        default=8,
+        help="Wall-clock hours the run is allowed to take. The most urgent of the likely-changed locations that fit in it are scraped."
+    )
+    parser.add_argument(
+        "--max_staleness_days",
+        type=int,
+        default=30,
+        help="Locations not scraped for this many days are re-scraped even if nothing about them looks different."
+    )
+    parser.add_argument(
+        "--seconds_per_location",
+        type=float,
+        default=10,
+        help="Expected time for one worker to scrape one location, used to fit the run to --time_budget_hours."
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default='plugshare',
+        help="BigQuery dataset holding the PlugShare tables."
+    )
+    parser.add_argument(
+        '--n_jobs',
+        type=int,
+        default=-1,
+        help='Number of parallel workers to use. If -1, will use num_cpus - 1'
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=100,
+        help='Hands locations out to workers in chunks of this size as they free up, most urgent chunks first.'
+    )
+    parser.add_argument(
+        '--ledger_path',
+        type=str,
+        default=None,
+        help='Local file to record each location as in flight, done, or failed. Every run gets its own file next to it, named after --run_id, since locations done in one run are due again in the next.'
+    )
+    parser.add_argument(
+        '--run_id',
+        type=str,
+        default=datetime.now().strftime("%Y%m%d-%H%M%S"),
+        help='Names this run\'s ledger file. Pass the ID of an interrupted run to resume it. Defaults to the current time.'
+    )
+    parser.add_argument(
+        '--dry_run',
+        action='store_true',
+        help='Only print how many locations would be scraped, without scraping them.'
+    )
+    args = parser.parse_args()
+
+    planner = ChangeDetectionPlanner(
+        max_staleness=timedelta(days=args.max_staleness_days),
+        dataset_name=args.dataset
+    )
+    planned = planner.plan()
+
+    scheduler = RescrapeScheduler(
+        seconds_per_location=args.seconds_per_location,
+        dataset_name=args.dataset
+    )
+    n_jobs = parse_n_jobs(args.n_jobs)
+    locations = scheduler.schedule(
+        scheduler.load_signals(),
+        timedelta(hours=args.time_budget_hours),
+        n_workers=n_jobs,
+        location_ids=planned
+    )
+    print(f"Scheduled {len(locations):,} of {len(planned):,} likely-changed locations")
+    if args.dry_run or len(locations) == 0:
+        exit()
+
+    # Setup save directory so we don't have a race condition setting it up
+    error_path = f"data/external/plugshare/{TODAY_STRING}/errors/"
+    if not os.path.exists(error_path):
+        logger.warning("Error screenshot save filepath does not exist, creating it...")
+        os.makedirs(error_path)
+
+    ledger_path = None
+    if args.ledger_path is not None:
+        root, extension = os.path.splitext(args.ledger_path)
+        ledger_path = f"{root}_{args.run_id}{extension}"
+        logger.info("Recording progress in %s", ledger_path)
+
+    results = parallelized_data_processing(
+        ParallelMainMapScraper,
+        locations,
+        n_jobs=n_jobs,
+        chunk_size=args.chunk_size,
+        ledger_path=ledger_path,
+        error_screenshot_savepath=error_path,
+        timeout=5,
+        headless=True,
+        progress_bars=False,
+        save_every=100
+    )
+    num_failed = sum(not r.ok for r in results)
+    print(f"Re-scraping done! {num_failed} of {len(results)} chunks failed")
@@ -4,6 +4,7 @@ from time import time
 from evlens.data.plugshare import ParallelLocationIDScraper, SearchCriterion
 from evlens.data.google_cloud import BigQuery
 from evlens.concurrency import parallelized_data_processing, get_batch_indices_from_identifiers
+from evlens.data.ledger import ProgressLedger
 
 from selenium.common.exceptions import NoSuchElementException, TimeoutException
 import pandas as pd
@@ -32,7 +33,7 @@ def make_criteria(
     tile_type : Union[Literal[&#39;Manual&#39;], Literal[&#39;NREL&#39;]]
         Indicates which type of search tile (brute force manual or NREL-derived) we are using
     map_pan_time : float, optional
-        Timeout (in seconds) used for waiting for the map to do something, be that pan to a new location or load its pins up fully, by default 3
+        Ceiling (in seconds) on waiting for the map to do something, be that pan to a new location or load its pins up fully. The scraper moves on as soon as the map's API calls settle, by default 3
 
     Returns
     -------
@@ -49,7 +50,6 @@ def make_criteria(
     )
 
 
-#TODO: tune how long we need to sleep and timeout
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
@@ -80,14 +80,50 @@ if __name__ == '__main__':
         '--map_pan_time',
         type=int,
         default=2,
-        help='Time in seconds to wait after entering a new lat/long coordinate (for the map to pan to new location)'
+        help='Max time in seconds to wait after entering a new lat/long coordinate (for the map to pan to new location and load its pins). Moves on as soon as the map settles.'
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=None,
+        help='If provided, hands search tiles out to workers in chunks of this size as they free up instead of one fixed batch per worker. Not compatible with --starting_ids.'
+    )
+    parser.add_argument(
+        '--ledger_path',
+        type=str,
+        default=None,
+        help='Local file to record each search tile as in flight, done, or failed. Workers skip tiles already recorded as done.'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Only hand out the search tiles --ledger_path does not have as done yet, however many workers are used. Replaces --starting_ids.'
+    )
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help='Split search tiles whose results look capped into four smaller tiles (recursively) and search those too, so dense areas are fully covered without shrinking every tile.'
+    )
+    parser.add_argument(
+        '--saturation_threshold',
+        type=int,
+        default=500,
+        help='With --adaptive, number of locations returned by one search that counts as hitting the map result cap.'
     )
     args = parser.parse_args()
+    if args.resume and args.ledger_path is None:
+        parser.error("--resume requires --ledger_path")
     
     # Get the search tiles from BigQuery
     bq = BigQuery()
     search_tiles = bq.query_to_dataframe(args.map_tile_query)
     
+    if args.resume:
+        ledger = ProgressLedger(args.ledger_path)
+        remaining_ids = set(ledger.remaining(search_tiles['id']))
+        search_tiles = search_tiles[search_tiles['id'].astype(str).isin(remaining_ids)].reset_index(drop=True)
+        logger.info("Resuming with %s search tiles left (%s)", len(search_tiles), ledger.summary())
+    
     tqdm.pandas(desc="Creating SearchCriterion objects")
     tiles = search_tiles.progress_apply(
         make_criteria,
@@ -117,6 +153,9 @@ if __name__ == '__main__':
         tiles,
         n_jobs=-1,
         checkpoint_indices=checkpoint_indices,
+        chunk_size=args.chunk_size,
+        run_kwargs={'adaptive': args.adaptive, 'saturation_threshold': args.saturation_threshold},
+        ledger_path=args.ledger_path,
         error_screenshot_savepath=error_path,
         timeout=5,
         headless=True,
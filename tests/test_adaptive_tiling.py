@@ -0,0 +1,145 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from evlens.data.plugshare import LocationIDScraper, SearchCriterion, MILES_PER_DEGREE_LATITUDE
+from evlens.data.ledger import ProgressLedger
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+RESULT_CAP = 50
+
+
+def make_locations(seed: int = 42) -> pd.DataFrame:
+    '''
+    A dense "metro" in one corner of an otherwise sparse area. Near the equator so a degree of longitude is (almost exactly) a degree of latitude.
+    '''
+    rng = np.random.default_rng(seed)
+    metro = rng.normal(loc=[0.5, 0.5], scale=0.04, size=(300, 2))
+    rural = rng.uniform(low=-0.9, high=0.9, size=(100, 2))
+    points = np.vstack([metro, rural])
+    return pd.DataFrame({
+        'id': np.arange(len(points)),
+        'latitude': points[:, 0],
+        'longitude': points[:, 1],
+        'connector_types': [['2', '3']] * len(points),
+        'under_repair': False
+    })
+
+
+class StandInMap:
+    '''
+    Just enough of a browser for `LocationIDScraper.run()` to load the map with.
+    '''
+    def get(self, url: str):
+        pass
+
+    def quit(self):
+        pass
+
+
+class StandInLocationIDScraper(LocationIDScraper):
+    '''
+    Searches a fixed set of locations, returning at most RESULT_CAP of them per search like the real map caps its results.
+    '''
+    def __init__(self, locations: pd.DataFrame, failing_cell_ids=(), **kwargs):
+        super().__init__(fetch_mode='http', progress_bars=False, **kwargs)
+        self.driver = StandInMap()
+        self.locations = locations
+        self.failing_cell_ids = set(failing_cell_ids)
+        self.searches = []
+
+    def pick_plug_filters(self, plugs_to_use):
+        pass
+
+    def search_location(self, search_criterion: SearchCriterion):
+        self.searches.append(search_criterion)
+
+    def grab_location_ids(self, search_criterion: SearchCriterion) -> pd.DataFrame:
+        if search_criterion.cell_id in self.failing_cell_ids:
+            # E.g. a 429 from the region API
+            return None
+        distances = MILES_PER_DEGREE_LATITUDE * np.hypot(
+            self.locations['latitude'] - search_criterion.latitude,
+            self.locations['longitude'] - search_criterion.longitude
+        )
+        return self.locations[distances <= search_criterion.radius].head(RESULT_CAP).reset_index(drop=True)
+
+    def save_to_bigquery(self, data, table_name, merge_columns='location_id'):
+        self.saved = data if getattr(self, 'saved', None) is None else pd.concat([self.saved, data])
+
+
+def test_split_covers_parent():
+    parent = SearchCriterion(40.0, -105.0, 10, 1234, 'NREL', 1)
+    children = parent.split()
+    assert [c.cell_id for c in children] == ['1234/ne', '1234/nw', '1234/sw', '1234/se']
+    assert all(c.cell_type == 'NREL' and c.root_cell_id == 1234 and c.depth == 1 for c in children)
+    assert all(c.root_cell_id == 1234 for c in children[0].split()), "Grandchildren should keep the original tile"
+    assert parent.root_cell_id == 1234
+    assert np.isclose(children[0].radius, 10 / np.sqrt(2), atol=1e-3)
+    assert np.isclose((children[0].latitude - parent.latitude) * MILES_PER_DEGREE_LATITUDE, 5, atol=1e-3)
+
+
+def test_adaptive_search():
+    locations = make_locations()
+    # One tile covering the whole area
+    radius = np.sqrt(2) * MILES_PER_DEGREE_LATITUDE
+    tile = SearchCriterion(0.0, 0.0, radius, 1, 'NREL', 1)
+
+    fixed = StandInLocationIDScraper(locations, save_every=10_000)
+    fixed.run([tile])
+    assert fixed.saved['location_id'].nunique() == RESULT_CAP, "A capped search should miss locations"
+
+    adaptive = StandInLocationIDScraper(locations, save_every=10_000)
+    adaptive.run([tile], adaptive=True, saturation_threshold=RESULT_CAP, min_radius_in_miles=0.01, max_depth=12)
+    found = adaptive.saved['location_id'].nunique()
+    assert found == len(locations), f"Adaptive search found {found} of {len(locations)} locations"
+    assert max(s.depth for s in adaptive.searches) >= 3, "Dense metro should get fine cells"
+
+    # Sparse areas aren't split much, so far fewer searches than tiling everything at the finest size
+    # (squares of side finest * sqrt(2) over the tile's 2r x 2r square)
+    finest = min(s.radius for s in adaptive.searches)
+    num_uniform_tiles = 2 * (radius / finest)**2
+    assert len(adaptive.searches) < num_uniform_tiles / 4, \
+        f"{len(adaptive.searches)} searches vs. {num_uniform_tiles:.0f} uniform tiles"
+    # Found under the NREL tile they came from, whatever cell they were found in
+    assert (adaptive.saved['search_cell_id_nrel'] == 1).all() and adaptive.saved['search_cell_id'].isnull().all()
+
+
+def test_failed_search_is_retried():
+    locations = make_locations()
+    radius = np.sqrt(2) * MILES_PER_DEGREE_LATITUDE
+    tile = SearchCriterion(0.0, 0.0, radius, 1, 'NREL', 1)
+    # Sparse corner, so searched but never split itself
+    failing_cell_id = '1/sw'
+    with tempfile.TemporaryDirectory() as directory:
+        ledger_path = os.path.join(directory, 'ledger.jsonl')
+        s = StandInLocationIDScraper(
+            locations,
+            failing_cell_ids=[failing_cell_id],
+            ledger_path=ledger_path,
+            save_every=10_000
+        )
+        s.run([tile], adaptive=True, saturation_threshold=RESULT_CAP, min_radius_in_miles=0.01, max_depth=12)
+        states = ProgressLedger(ledger_path).states()
+        assert states[failing_cell_id] == 'failed', "Failed search recorded as done"
+        assert states['1'] == 'in_flight', "Parent of a failed search shouldn't be done"
+        assert states['1/ne'] == 'done'
+
+        # Resuming only searches the failed cell again
+        s = StandInLocationIDScraper(locations, ledger_path=ledger_path, save_every=10_000)
+        s.run([tile], adaptive=True, saturation_threshold=RESULT_CAP, min_radius_in_miles=0.01, max_depth=12)
+        searched = [str(c.cell_id) for c in s.searches]
+        assert searched == ['1', failing_cell_id], f"Unexpected searches {searched}"
+        assert ProgressLedger(ledger_path).states()['1'] == 'done'
+
+
+if __name__ == '__main__':
+    test_split_covers_parent()
+    test_adaptive_search()
+    test_failed_search_is_retried()
+    print("SUCCESS!")
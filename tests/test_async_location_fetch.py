@@ -0,0 +1,91 @@
+import asyncio
+
+from evlens.concurrency import AIMDLimiter
+from evlens.data.plugshare_async import AsyncPlugShareClient, AsyncMainMapScraper
+
+from test_mainmap_http_fetch import start_stand_in_server, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def test_aimd_limiter():
+    async def exercise():
+        limiter = AIMDLimiter(initial_limit=8, max_limit=10, cooldown=60)
+        
+        # Healthy responses grow the cap additively
+        for _ in range(8):
+            await limiter.acquire()
+            await limiter.release(healthy=True)
+        assert limiter.current_limit == 9, f"Expected limit of 9, got {limiter.current_limit}"
+        
+        # One failure halves it, others within the cooldown don't compound
+        for _ in range(3):
+            await limiter.acquire()
+            await limiter.release(healthy=False)
+        assert limiter.current_limit == 4, f"Expected limit of 4, got {limiter.current_limit}"
+        assert limiter.in_flight == 0, "Slots leaked"
+        
+    asyncio.run(exercise())
+
+
+def test_async_fetch():
+    server = start_stand_in_server()
+    try:
+        client = AsyncPlugShareClient(
+            api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+            initial_concurrency=4,
+            max_concurrency=8
+        )
+        
+        async def fetch_all():
+            return [r async for r in client.iter_locations([TEST_LOCATION] * 20 + ['000000'])]
+        
+        results = dict()
+        for location_id, body in asyncio.run(fetch_all()):
+            results.setdefault(location_id, []).append(body)
+            
+        assert len(results[TEST_LOCATION]) == 20, "Not every request came back"
+        assert all(b is not None for b in results[TEST_LOCATION]), "Some requests failed"
+        assert results['000000'] == [None], "Missing location should come back as None"
+        
+    finally:
+        server.shutdown()
+
+
+class BrokenSession:
+    '''
+    Stand-in for an aiohttp session whose requests blow up with an error `_get()` doesn't retry.
+    '''
+    def get(self, url, params=None):
+        raise RuntimeError("Unexpected failure")
+
+
+def test_slot_released_on_unexpected_error():
+    client = AsyncPlugShareClient(api_base_url="http://127.0.0.1/v3/", initial_concurrency=1)
+    
+    async def fetch():
+        try:
+            await client._get(BrokenSession(), client.api_base_url + 'locations/1')
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Unexpected error should have been raised")
+    
+    asyncio.run(fetch())
+    limiter = client.limiters['127.0.0.1']
+    assert limiter.in_flight == 0, "Slot leaked after an unexpected error"
+
+
+def test_no_requests_session():
+    scraper = AsyncMainMapScraper(progress_bars=False)
+    assert scraper.session is None, "Async scraper shouldn't open a requests session it never uses"
+    scraper.quit()
+
+
+if __name__ == '__main__':
+    test_aimd_limiter()
+    test_async_fetch()
+    test_slot_released_on_unexpected_error()
+    test_no_requests_session()
+    print("SUCCESS!")
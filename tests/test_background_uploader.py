@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from google.api_core.exceptions import PreconditionFailed
+
+from evlens.data import google_cloud
+from evlens.data.google_cloud import BackgroundUploader, _get_client, get_background_uploader
+from evlens.data.plugshare import MainMapScraper
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class FlakyBucket:
+    '''
+    Stands in for `upload_file()`, copying into a local directory and failing the first `num_failures` calls.
+    '''
+    def __init__(self, directory: str, num_failures: int = 0):
+        self.directory = directory
+        self.num_failures = num_failures
+        self.num_calls = 0
+
+    def __call__(self, bucket_name: str, source_filepath: str, destination_blob_name: str = None):
+        self.num_calls += 1
+        if self.num_calls <= self.num_failures:
+            raise ConnectionError("Bucket unavailable")
+        path = os.path.join(self.directory, bucket_name, destination_blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(source_filepath, path)
+
+
+def _reuses_parent_client(queue):
+    parent_client = google_cloud._CLIENTS[(os.getppid(), 'test')]
+    queue.put(_get_client('test', object) is parent_client)
+
+
+def test_client_registry():
+    client = _get_client('test', object)
+    assert _get_client('test', object) is client, "Clients should be reused within a process"
+    assert _get_client('test', object, 'other-project') is not client, "Clients are per set of arguments"
+
+    # A forked worker must not reuse the parent's client (and its connections)
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_reuses_parent_client, args=(queue,))
+    process.start()
+    reused = queue.get(timeout=30)
+    process.join()
+    assert not reused, "Forked process reused its parent's client"
+
+
+def test_background_uploads():
+    upload_file = google_cloud.upload_file
+    with tempfile.TemporaryDirectory() as directory:
+        bucket = FlakyBucket(os.path.join(directory, 'gcs'), num_failures=2)
+        google_cloud.upload_file = bucket
+        try:
+            uploader = BackgroundUploader(max_workers=1, max_attempts=3)
+            path = os.path.join(directory, 'screenshot.png')
+            with open(path, 'wb') as f:
+                f.write(b'png')
+            assert uploader.submit('errors_bucket', path, 'errors/screenshot.png', remove_after=True).result(timeout=60), \
+                "Upload should succeed after retrying"
+            assert os.path.exists(os.path.join(directory, 'gcs', 'errors_bucket', 'errors', 'screenshot.png'))
+            assert not os.path.exists(path), "Uploaded file should be removed locally"
+
+            # Every attempt fails, so the file stays put
+            bucket.num_failures = 100
+            path = os.path.join(directory, 'kept.png')
+            with open(path, 'wb') as f:
+                f.write(b'png')
+            uploader.submit('errors_bucket', path, 'errors/kept.png', remove_after=True)
+            uploader.close()
+            assert os.path.exists(path), "Files that couldn't be uploaded should be kept"
+            assert (uploader.num_uploaded, uploader.num_failed) == (1, 1)
+        finally:
+            google_cloud.upload_file = upload_file
+
+
+class SlowBucket(FlakyBucket):
+    def __call__(self, *args, **kwargs):
+        time.sleep(1)
+        super().__call__(*args, **kwargs)
+
+
+class LostResponseBucket(FlakyBucket):
+    '''
+    Uploads go through but the first response never makes it back, like a timeout after a server-side success.
+    '''
+    def __call__(self, bucket_name: str, source_filepath: str, destination_blob_name: str = None):
+        path = os.path.join(self.directory, bucket_name, destination_blob_name)
+        if os.path.exists(path):
+            # What `if_generation_match=0` gets back for a blob that's already there
+            raise PreconditionFailed("At least one of the pre-conditions you specified did not hold.")
+        super().__call__(bucket_name, source_filepath, destination_blob_name)
+        raise ConnectionError("Connection reset")
+
+
+def test_retry_after_lost_response():
+    upload_file = google_cloud.upload_file
+    with tempfile.TemporaryDirectory() as directory:
+        google_cloud.upload_file = LostResponseBucket(os.path.join(directory, 'gcs'))
+        try:
+            uploader = BackgroundUploader(max_workers=1, max_attempts=3)
+            path = os.path.join(directory, 'screenshot.png')
+            with open(path, 'wb') as f:
+                f.write(b'png')
+            assert uploader.submit('errors_bucket', path, 'errors/screenshot.png', remove_after=True).result(timeout=60), \
+                "Blob left by an earlier attempt should count as uploaded"
+            uploader.close()
+            assert (uploader.num_uploaded, uploader.num_failed) == (1, 0)
+            assert not os.path.exists(path), "Uploaded file should be removed locally"
+        finally:
+            google_cloud.upload_file = upload_file
+
+
+def test_quit_flushes_process_uploader():
+    upload_file = google_cloud.upload_file
+    with tempfile.TemporaryDirectory() as directory:
+        google_cloud.upload_file = SlowBucket(os.path.join(directory, 'gcs'))
+        try:
+            # Queued by someone else in the process, e.g. a capture shared through `ErrorCapture.shared()`
+            path = os.path.join(directory, 'screenshot.png')
+            with open(path, 'wb') as f:
+                f.write(b'png')
+            upload = get_background_uploader().submit('errors_bucket', path, 'errors/screenshot.png')
+            assert get_background_uploader(create=False) is get_background_uploader()
+
+            s = MainMapScraper(fetch_mode='http', progress_bars=False)
+            assert sum(s.error_capture.captured.values()) == 0
+            s.quit()
+            assert upload.done(), "Scraper quit before the process's uploads were done"
+        finally:
+            google_cloud.upload_file = upload_file
+
+
+def _has_uploader(queue):
+    queue.put(get_background_uploader(create=False) is not None)
+
+
+def test_uploader_not_created_on_lookup():
+    get_background_uploader()
+    # A fresh (forked) process hasn't used one yet
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=_has_uploader, args=(queue,))
+    process.start()
+    has_uploader = queue.get(timeout=30)
+    process.join()
+    assert not has_uploader, "Looking up the uploader shouldn't start one"
+
+
+if __name__ == '__main__':
+    test_client_registry()
+    test_background_uploads()
+    test_retry_after_lost_response()
+    test_quit_flushes_process_uploader()
+    test_uploader_not_created_on_lookup()
+    print("SUCCESS!")
@@ -0,0 +1,156 @@
+import re
+
+import duckdb
+import pandas as pd
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+from evlens.data.google_cloud import BigQuery
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class DuckDBJob:
+    def __init__(self, relation: duckdb.DuckDBPyRelation = None, num_dml_affected_rows: int = None):
+        self.relation = relation
+        self.num_dml_affected_rows = num_dml_affected_rows
+        
+    def result(self):
+        return self
+    
+    def to_dataframe(self) -> pd.DataFrame:
+        return self.relation.df()
+
+
+class DuckDBTable:
+    def __init__(self, schema, num_rows: int):
+        self.schema = schema
+        self.num_rows = num_rows
+
+
+class DuckDBClient:
+    '''
+    Local SQL stand-in for the parts of `bigquery.Client` that `BigQuery.insert_data()` uses. Fully-qualified table IDs become single quoted table names.
+    '''
+    def __init__(self):
+        self.connection = duckdb.connect()
+        self.queries = []
+        
+    @classmethod
+    def _translate(cls, query: str) -> str:
+        return re.sub(r'`([^`]+)`', r'"\1"', query)
+    
+    def _exists(self, table_id: str) -> bool:
+        return self.connection.execute(
+            "SELECT count(*) FROM information_schema.tables WHERE table_name = ?",
+            [table_id]
+        ).fetchone()[0] > 0
+        
+    def get_table(self, table_id: str) -> DuckDBTable:
+        if not self._exists(table_id):
+            raise NotFound(table_id)
+        columns = self.connection.execute(f'DESCRIBE "{table_id}"').fetchall()
+        num_rows = self.connection.execute(f'SELECT count(*) FROM "{table_id}"').fetchone()[0]
+        return DuckDBTable([bigquery.SchemaField(c[0], 'STRING') for c in columns], num_rows)
+        
+    def load_table_from_dataframe(self, df: pd.DataFrame, table_id: str, job_config=None, timeout=None) -> DuckDBJob:
+        truncate = job_config is not None \
+            and job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+        if truncate or not self._exists(table_id):
+            self.connection.execute(f'CREATE OR REPLACE TABLE "{table_id}" AS SELECT * FROM df')
+        else:
+            self.connection.execute(f'INSERT INTO "{table_id}" BY NAME SELECT * FROM df')
+        return DuckDBJob()
+    
+    def query(self, query: str) -> DuckDBJob:
+        self.queries.append(query)
+        query = self._translate(query)
+        if query.strip().upper().startswith('MERGE'):
+            num_rows = self.connection.execute(query).fetchone()[0]
+            return DuckDBJob(num_dml_affected_rows=num_rows)
+        return DuckDBJob(self.connection.sql(query))
+    
+    def query_and_wait(self, query: str) -> DuckDBJob:
+        return self.query(query)
+    
+    def delete_table(self, table_id: str, not_found_ok: bool = False):
+        if not self._exists(table_id) and not not_found_ok:
+            raise NotFound(table_id)
+        self.connection.execute(f'DROP TABLE IF EXISTS "{table_id}"')
+        
+        
+def make_checkins(ids) -> pd.DataFrame:
+    return pd.DataFrame({
+        'id': ids,
+        'evse_id': [f"evse_{i % 3}" for i in ids],
+        'rating': [1] * len(ids)
+    })
+
+
+def test_merge_upsert():
+    client = DuckDBClient()
+    bq = BigQuery(client=client)
+    table_id = bq._make_table_id('plugshare', 'checkins')
+    client.load_table_from_dataframe(make_checkins([1, 2, 3]), table_id)
+    
+    # Overlapping batch, with a repeat inside the batch too
+    num_inserted = bq.insert_data(
+        make_checkins([3, 4, 4, 5]),
+        'plugshare',
+        'checkins',
+        merge_columns='id'
+    )
+    assert num_inserted == 2, f"Expected 2 new rows, got {num_inserted}"
+    
+    df = client.query(f"SELECT * FROM `{table_id}` ORDER BY id").to_dataframe()
+    assert df['id'].tolist() == [1, 2, 3, 4, 5], "Table should have each ID exactly once"
+    assert not any('staging' in t[0] for t in client.connection.execute('SHOW TABLES').fetchall()), \
+        "Staging table left behind"
+    
+    # Nothing new
+    client.queries = []
+    assert bq.insert_data(make_checkins([1, 5]), 'plugshare', 'checkins', merge_columns='id') == 0, \
+        "Already-present rows inserted"
+    
+    # The target is only ever read through the MERGE join, never pulled into pandas
+    assert all(q.strip().upper().startswith('MERGE') for q in client.queries), "Table pulled client-side"
+        
+    # Composite keys
+    num_inserted = bq.insert_data(
+        make_checkins([5, 6]),
+        'plugshare',
+        'checkins',
+        merge_columns=['id', 'evse_id']
+    )
+    assert num_inserted == 1, f"Expected 1 new row on composite key, got {num_inserted}"
+    
+    # Plain appends report rows added the same way
+    assert bq.insert_data(make_checkins([7, 8]), 'plugshare', 'checkins') == 2, "Append should return rows added"
+    
+    
+def test_merge_query():
+    query = BigQuery._build_merge_query('p.d.t', 'p.d.t_staging', ['a', 'b'], ['a', 'b', 'c'])
+    assert 'ON T.a = S.a AND T.b = S.b' in query, "Join condition wrong"
+    assert 'INSERT (a, b, c) VALUES (S.a, S.b, S.c)' in query, "Insert clause wrong"
+    assert 'WHEN MATCHED' not in query, "Existing rows should never be touched"
+
+
+def test_replace_table():
+    client = DuckDBClient()
+    bq = BigQuery(client=client)
+    assert not bq.table_exists('plugshare', 'afdcCrosswalk')
+    client.load_table_from_dataframe(make_checkins([1, 2, 3]), bq._make_table_id('plugshare', 'afdcCrosswalk'))
+    assert bq.table_exists('plugshare', 'afdcCrosswalk')
+
+    assert bq.replace_table(make_checkins([4, 5]), 'plugshare', 'afdcCrosswalk') == 2
+    df = client.query(f"SELECT id FROM `{bq._make_table_id('plugshare', 'afdcCrosswalk')}` ORDER BY id").to_dataframe()
+    assert df['id'].tolist() == [4, 5], "Old contents should be replaced"
+    assert not any(q.strip().upper().startswith('DELETE') for q in client.queries), "Should be one load job, not a clear then a load"
+
+
+if __name__ == '__main__':
+    test_merge_query()
+    test_merge_upsert()
+    test_replace_table()
+    print("SUCCESS!")
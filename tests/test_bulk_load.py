@@ -0,0 +1,144 @@
+import os
+import tempfile
+
+from google.cloud import bigquery
+import pandas as pd
+
+from evlens.data.google_cloud import BigQuery
+from evlens.data.bulk_load import StagedBulkLoader, LocalStagingBucket
+from evlens.data.local_warehouse import LocalWarehouse
+
+from test_bigquery_merge import DuckDBClient, DuckDBJob, make_checkins
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class DuckDBLoadJob(DuckDBJob):
+    def __init__(self, output_rows: int):
+        super().__init__()
+        self.output_rows = output_rows
+
+
+class DuckDBBulkClient(DuckDBClient):
+    '''
+    DuckDBClient that can also load Parquet files staged in a `LocalStagingBucket`.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.load_jobs = []
+        
+    def load_table_from_uri(self, uris, table_id: str, job_config=None, timeout=None) -> DuckDBLoadJob:
+        self.load_jobs.append(list(uris))
+        files = ', '.join(f"'{u}'" for u in uris)
+        truncate = job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+        if truncate or not self._exists(table_id):
+            self.connection.execute(f'CREATE OR REPLACE TABLE "{table_id}" AS SELECT * FROM read_parquet([{files}])')
+        else:
+            self.connection.execute(f'INSERT INTO "{table_id}" BY NAME SELECT * FROM read_parquet([{files}])')
+        num_rows = self.connection.execute(f"SELECT count(*) FROM read_parquet([{files}])").fetchone()[0]
+        return DuckDBLoadJob(num_rows)
+
+
+def test_staged_bulk_load():
+    client = DuckDBBulkClient()
+    bq = BigQuery(client=client)
+    checkins_id = bq._make_table_id('plugshare', 'checkins')
+    client.load_table_from_dataframe(make_checkins([1, 2, 3]), checkins_id)
+    log_id = bq._make_table_id('plugshare', 'log')
+    client.load_table_from_dataframe(make_checkins([100]), log_id)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        bucket = LocalStagingBucket(os.path.join(directory, 'bucket'))
+        # Two workers staging overlapping checkpoints under one run's prefix
+        for ids in ([3, 4], [4, 5], [5]):
+            StagedBulkLoader(bucket, prefix='run_1', bq_client=bq).stage(make_checkins(ids), 'checkins', merge_columns='id')
+        StagedBulkLoader(bucket, prefix='run_1', bq_client=bq).stage(make_checkins([101, 102]), 'log')
+        assert client.load_jobs == [], "Nothing should be loaded while staging"
+        
+        loader = StagedBulkLoader(bucket, prefix='run_1', bq_client=bq)
+        assert {k: len(v) for k, v in loader.staged().items()} == {('checkins', 'id'): 3, ('log', '_append'): 1}
+        
+        num_rows = loader.load()
+        assert num_rows == {'checkins': 2, 'log': 2}, f"Unexpected rows loaded {num_rows}"
+        assert len(client.load_jobs) == 2 and len(client.load_jobs[0]) + len(client.load_jobs[1]) == 4, \
+            "Should be one load job per table covering every staged file"
+        assert loader.staged() == {}, "Staged files not cleaned up"
+        
+        df = client.query(f"SELECT id FROM `{checkins_id}` ORDER BY id").to_dataframe()
+        assert df['id'].tolist() == [1, 2, 3, 4, 5], "Keys repeated across workers should only be merged once"
+        assert not any('staging' in t[0] for t in client.connection.execute('SHOW TABLES').fetchall()), \
+            "Staging table left behind"
+
+
+def test_load_job_uri_limit():
+    client = DuckDBBulkClient()
+    bq = BigQuery(client=client)
+    checkins_id = bq._make_table_id('plugshare', 'checkins')
+    client.load_table_from_dataframe(make_checkins([1]), checkins_id)
+    log_id = bq._make_table_id('plugshare', 'log')
+    client.load_table_from_dataframe(make_checkins([100]), log_id)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        bucket = LocalStagingBucket(os.path.join(directory, 'bucket'))
+        loader = StagedBulkLoader(bucket, prefix='run_1', bq_client=bq, max_uris_per_job=2)
+        for ids in ([1, 2], [2, 3], [3, 4], [4, 5], [5, 6]):
+            loader.stage(make_checkins(ids), 'checkins', merge_columns='id')
+        for ids in ([101], [102], [103]):
+            loader.stage(make_checkins(ids), 'log')
+        
+        num_rows = loader.load()
+        assert num_rows == {'checkins': 5, 'log': 3}, f"Unexpected rows loaded {num_rows}"
+        assert max(len(uris) for uris in client.load_jobs) == 2, "Load job over the URI limit"
+        assert len(client.load_jobs) == 5, "Merged tables should be staged in batches, appends loaded in batches"
+        assert loader.staged() == {}, "Staged files not cleaned up"
+        
+        df = client.query(f"SELECT id FROM `{checkins_id}` ORDER BY id").to_dataframe()
+        assert df['id'].tolist() == [1, 2, 3, 4, 5, 6], "Every batch should make it into the one MERGE"
+
+
+def make_location_ids(location_ids) -> pd.DataFrame:
+    return pd.DataFrame({
+        'id': [f"row_{i}" for i in location_ids],
+        'location_id': [str(i) for i in location_ids],
+        'plug_types': ['13'] * len(location_ids)
+    })
+
+
+def test_load_into_local_warehouse():
+    with tempfile.TemporaryDirectory() as directory:
+        warehouse = LocalWarehouse(os.path.join(directory, 'warehouse'))
+        warehouse.create_dataset('plugshare')
+        warehouse.setup_plugshare_tables()
+        warehouse.insert_data(make_location_ids([1]), 'plugshare', 'locationID')
+        
+        bucket = LocalStagingBucket(os.path.join(directory, 'bucket'))
+        loader = StagedBulkLoader(bucket, prefix='run_1', bq_client=warehouse)
+        for ids in ([1, 2], [2, 3]):
+            loader.stage(make_location_ids(ids), 'locationID', merge_columns='location_id')
+        loader.stage(make_location_ids([4]), 'locationID')
+        
+        num_rows = loader.load()
+        assert num_rows == {'locationID': 3}, f"Unexpected rows loaded {num_rows}"
+        assert loader.staged() == {}, "Staged files not cleaned up"
+        df = warehouse.query_to_dataframe("SELECT location_id FROM `evlens.plugshare.locationID` ORDER BY location_id")
+        assert df['location_id'].tolist() == ['1', '2', '3', '4'], "Keys repeated across files should only be loaded once"
+        
+        try:
+            warehouse.load_from_uris(['gs://plugshare_scraping/staged.parquet'], 'plugshare', 'locationID')
+            raise AssertionError("GCS files can't be loaded into a local warehouse")
+        except ValueError:
+            pass
+
+
+def test_dedupe_source_query():
+    query = BigQuery._build_merge_query('p.d.t', 'p.d.t_staging', ['a'], ['a', 'b'], dedupe_source=True)
+    assert 'QUALIFY ROW_NUMBER() OVER (PARTITION BY a) = 1' in query, "Source not de-duplicated"
+
+
+if __name__ == '__main__':
+    test_dedupe_source_query()
+    test_staged_bulk_load()
+    test_load_job_uri_limit()
+    test_load_into_local_warehouse()
+    print("SUCCESS!")
@@ -0,0 +1,120 @@
+import os
+import queue
+import tempfile
+
+import ray
+from ray.util.queue import Queue
+
+from evlens.data.archive import ResponseArchive
+from evlens.data.ledger import ProgressLedger
+from evlens.data.local_warehouse import LocalWarehouse
+from evlens.data.plugshare import MainMapScraper
+from evlens.data.plugshare_pipeline import LocationParser, END_OF_STREAM
+
+from test_mainmap_http_fetch import start_stand_in_server, RECORDED_RESPONSE_PATH, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def test_parse_from_queue():
+    with open(RECORDED_RESPONSE_PATH, 'rb') as f:
+        body = f.read()
+    
+    ray.init(num_cpus=1, include_dashboard=False)
+    try:
+        queue = Queue(maxsize=10)
+        for i in range(5):
+            queue.put((str(i), body))
+        queue.put(('bad', b'not json'))
+        # One marker per parser, so the second one should be handed back
+        queue.put(END_OF_STREAM)
+        queue.put(END_OF_STREAM)
+        
+        parser = LocationParser(save_every=2, save=False)
+        counts = parser.consume(queue, batch_size=100)
+        assert counts == {'parsed': 5, 'failed': 1}, f"Unexpected counts {counts}"
+        assert queue.get(timeout=1) is END_OF_STREAM, "Extra end marker not handed back"
+        
+        df_stations, df_checkins, df_evses = parser.finish()
+        assert len(df_stations) == 5, "Not every location made it into the stations table"
+        assert len(df_evses) == 20, "Not every EVSE made it into the EVSEs table"
+        
+    finally:
+        ray.shutdown()
+
+
+def test_capture_only_then_reparse():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            s = MainMapScraper(
+                timeout=3,
+                progress_bars=False,
+                fetch_mode='http',
+                api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+                archive_path=directory,
+                parse_responses=False
+            )
+            df_stations, _, _ = s.run([TEST_LOCATION, '000000'])
+            assert df_stations.empty, "Capture-only run shouldn't parse anything"
+            assert ResponseArchive(directory).keys('location') == [TEST_LOCATION], "Response not archived"
+            
+            try:
+                MainMapScraper(fetch_mode='http', parse_responses=False)
+                raise AssertionError("Capturing without keeping responses anywhere should be refused")
+            except ValueError:
+                pass
+            
+            parser = LocationParser(save=False)
+            counts = parser.parse_archive(directory)
+            assert counts == {'parsed': 1, 'failed': 0}, f"Unexpected counts {counts}"
+            df_stations, _, _ = parser.finish()
+            assert df_stations.loc[0, 'location_id'] == TEST_LOCATION, "Wrong location reparsed"
+            
+    finally:
+        server.shutdown()
+
+
+def test_capture_only_done_once_saved():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ledger.tsv')
+            output_queue = queue.Queue()
+            s = MainMapScraper(
+                timeout=3,
+                progress_bars=False,
+                fetch_mode='http',
+                api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+                parse_responses=False,
+                output_queue=output_queue,
+                ledger_path=path
+            )
+            s.run([TEST_LOCATION, '000000'])
+            states = ProgressLedger(path).states()
+            assert states == {TEST_LOCATION: 'in_flight', '000000': 'failed'}, \
+                f"Queued location shouldn't be done before it's saved {states}"
+            
+            warehouse = LocalWarehouse(os.path.join(directory, 'warehouse'))
+            warehouse.create_dataset('plugshare')
+            warehouse.setup_plugshare_tables()
+            parser = LocationParser(ledger_path=path)
+            parser._bq_client = warehouse
+            items = [output_queue.get_nowait() for _ in range(output_queue.qsize())]
+            parser.parse(items + [('bad', b'not json')])
+            parser.finish()
+            
+            states = ProgressLedger(path).states()
+            assert states[TEST_LOCATION] == 'done', "Saved location not marked done"
+            assert states['bad'] == 'failed', "Unparseable location not marked failed"
+            
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_parse_from_queue()
+    test_capture_only_then_reparse()
+    test_capture_only_done_once_saved()
+    print("SUCCESS!")
@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta
+import os
+import tempfile
+
+import pandas as pd
+
+from evlens.data.local_warehouse import LocalWarehouse
+from evlens.data.plugshare import MainMapScraper
+from evlens.data.planning import ChangeDetectionPlanner, RescrapeScheduler, region_snapshot
+
+from test_mainmap_http_fetch import start_stand_in_server, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+NOW = pd.Timestamp('2024-08-01', tz='UTC')
+
+
+def test_find_changes():
+    df_current = pd.DataFrame({
+        'location_id': ['1', '2', '3', '4', '5', '6', '7'],
+        'plug_types': ['CCS;CHAdeMO', 'CCS', 'CCS', 'CCS', 'CCS', 'Tesla', 'CCS'],
+        'under_repair': [False, True, False, True, False, False, False],
+        'parsed_datetime': [datetime(2024, 7, 30)] * 7
+    })
+    df_previous = pd.DataFrame({
+        'location_id': ['1', '2', '3', '4', '7'],
+        'plug_types': ['CHAdeMO;CCS', 'CCS', 'CHAdeMO', 'CCS', 'CCS'],
+        'under_repair': [False, False, False, False, False]
+    })
+    df_stations = pd.DataFrame({
+        'location_id': ['1', '2', '3', '4', '5', '7'],
+        # 4 went under repair, but was re-scraped after the search that saw it
+        'last_scraped': [datetime(2024, 7, 25)] * 3 + [datetime(2024, 7, 31), datetime(2024, 7, 25), datetime(2024, 1, 1)]
+    })
+    
+    planner = ChangeDetectionPlanner(max_staleness=timedelta(days=30))
+    df_changes = planner.find_changes(df_current, df_stations, df_previous, now=NOW)
+    reasons = df_changes.set_index('location_id')['reason'].to_dict()
+    
+    assert reasons == {
+        '2': 'under_repair_changed',
+        '3': 'plug_types_changed',
+        '6': 'new',
+        '7': 'stale'
+    }, f"Unexpected plan {reasons}"
+    
+    # Without the previous snapshot only new and staleness signals are available
+    df_changes = planner.find_changes(df_current, df_stations, now=NOW)
+    assert df_changes['location_id'].tolist() == ['6', '7'], "Wrong plan without a previous snapshot"
+
+
+def test_region_snapshot():
+    df_region = pd.DataFrame({
+        'id': [252784, 252784, 1],
+        'connector_types': [['6', '13'], ['6', '13'], ['3']],
+        'under_repair': [False, False, True]
+    })
+    df = region_snapshot(df_region)
+    assert df['location_id'].tolist() == ['252784', '1'], "Duplicates not dropped"
+    assert df['plug_types'].tolist() == ['6;13', '3'], "Plug types not joined like the locationID table"
+    assert df['parsed_datetime'].notnull().all(), "Snapshot time not set"
+
+
+def test_rescrape_schedule():
+    df_signals = pd.DataFrame({
+        'location_id': ['dormant', 'busy', 'flaky', 'fresh', 'never'],
+        'last_scraped': [
+            datetime(2024, 5, 1),
+            datetime(2024, 7, 1),
+            datetime(2024, 7, 1),
+            datetime(2024, 7, 31),
+            None
+        ],
+        'recent_checkins': [0, 90, 9, 90, 0],
+        'recent_problems': [0, 0, 9, 0, 0]
+    })
+    scheduler = RescrapeScheduler(seconds_per_location=60, base_checkins_per_day=0.05, problem_weight=10)
+
+    # 5 minutes across 1 worker fits 5 locations, most urgent first
+    order = scheduler.schedule(df_signals, timedelta(minutes=5), now=NOW)
+    assert order == ['never', 'flaky', 'busy', 'dormant', 'fresh'], f"Wrong priority order {order}"
+
+    # Budget is shared across workers
+    order = scheduler.schedule(df_signals, timedelta(minutes=1), n_workers=2, now=NOW)
+    assert order == ['never', 'flaky'], f"Budget not respected {order}"
+
+    order = scheduler.schedule(
+        df_signals,
+        timedelta(hours=1),
+        location_ids=['fresh', 'dormant'],
+        now=NOW
+    )
+    assert order == ['dormant', 'fresh'], f"Candidates not restricted {order}"
+
+
+def make_stale_warehouse(directory: str) -> LocalWarehouse:
+    '''
+    Local warehouse where TEST_LOCATION's plugs changed between the last two map searches, and it was last scraped before either.
+    '''
+    warehouse = LocalWarehouse(os.path.join(directory, 'warehouse'))
+    warehouse.create_dataset('plugshare')
+    warehouse.setup_plugshare_tables()
+    warehouse.insert_data(
+        pd.DataFrame({
+            'id': ['a', 'c'],
+            'parsed_datetime': [pd.Timestamp('2024-07-31'), pd.Timestamp('2024-07-01')],
+            'plug_types': ['6;13', '6'],
+            'location_id': [TEST_LOCATION] * 2,
+            'under_repair': [False] * 2
+        }),
+        'plugshare',
+        'locationID'
+    )
+    warehouse.insert_data(
+        pd.DataFrame({
+            'id': ['b'],
+            'last_scraped': [pd.Timestamp('2024-01-01')],
+            'checkin_count': [1],
+            'location_id': [TEST_LOCATION]
+        }),
+        'plugshare',
+        'stations',
+        merge_columns=['location_id', 'last_scraped']
+    )
+    return warehouse
+
+
+def scrape(warehouse: LocalWarehouse, server, locations: list):
+    MainMapScraper(
+        progress_bars=False,
+        fetch_mode='http',
+        api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+        warehouse=warehouse
+    ).run(locations)
+
+
+def test_plan_scrape_plan():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            warehouse = make_stale_warehouse(directory)
+            planner = ChangeDetectionPlanner(max_staleness=timedelta(days=30), bq_client=warehouse)
+            df_current, df_previous, df_stations = planner.load_snapshots()
+            df_changes = planner.find_changes(df_current, df_stations, df_previous)
+            assert df_changes['location_id'].tolist() == [TEST_LOCATION], "Changed location not planned"
+            assert df_changes['reason'].tolist() == ['plug_types_changed'], "Plug change not detected"
+
+            # Last two searches still differ, but the scrape already stored the change
+            scrape(warehouse, server, [TEST_LOCATION])
+            plan = planner.plan()
+            assert plan == [], f"Re-scraped location still planned {plan}"
+    finally:
+        server.shutdown()
+
+
+def test_schedule_scrape_schedule():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            warehouse = make_stale_warehouse(directory)
+            scheduler = RescrapeScheduler(seconds_per_location=60, bq_client=warehouse)
+            df_signals = scheduler.load_signals()
+            stale_priority = scheduler.score(df_signals).max()
+
+            # Planned locations the signals don't know about yet are scheduled first
+            order = scheduler.schedule(df_signals, timedelta(minutes=5), location_ids=[TEST_LOCATION, 'new'])
+            assert order == ['new', TEST_LOCATION], f"Wrong order {order}"
+
+            scrape(warehouse, server, [TEST_LOCATION])
+            df_signals = scheduler.load_signals()
+            assert len(df_signals) == 1, "Should be one row of signals per location"
+            last_scraped = pd.to_datetime(df_signals['last_scraped'], utc=True).iloc[0]
+            assert last_scraped > pd.Timestamp('2024-01-02', tz='UTC'), "Re-scrape not seen by the scheduler"
+            assert scheduler.score(df_signals).max() < stale_priority, "Re-scraped location should be less urgent"
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_find_changes()
+    test_region_snapshot()
+    test_rescrape_schedule()
+    test_plan_scrape_plan()
+    test_schedule_scrape_schedule()
+    print("SUCCESS!")
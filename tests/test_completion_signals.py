@@ -0,0 +1,140 @@
+from threading import Thread
+from time import sleep, time
+
+from evlens.data.plugshare import MainMapScraper, LocationIDScraper, SearchCriterion
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class StandInResponse:
+    status_code = 200
+
+
+class StandInRequest:
+    def __init__(self, url: str):
+        self.url = url
+        self.response = None
+
+
+class StandInWireDriver:
+    '''
+    Just enough of a selenium-wire browser to watch captured requests on.
+    '''
+    def __init__(self):
+        self.requests = []
+
+
+def region_url(latitude: float, longitude: float, span: float = 0.5) -> str:
+    return (
+        "https://api.plugshare.com/v3/locations/region?access=1&count=500"
+        f"&latitude={latitude}&longitude={longitude}&spanLat={span}&spanLng={span}"
+    )
+
+
+def play(driver: StandInWireDriver, events: list) -> Thread:
+    '''
+    Starts (url, None) or completes (None, index) requests on `driver` at the given delays, in the background.
+    '''
+    def run():
+        for delay, url, index in events:
+            sleep(delay)
+            if url is not None:
+                driver.requests.append(StandInRequest(url))
+            else:
+                driver.requests[index].response = StandInResponse()
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_politeness_floor():
+    s = MainMapScraper(fetch_mode='http', progress_bars=False, page_load_pause=0.3)
+    started = time()
+    s._wait_for_politeness_floor()
+    assert time() - started < 0.05, "First item shouldn't wait"
+
+    # Time spent on the item counts towards the floor
+    sleep(0.2)
+    s._wait_for_politeness_floor()
+    elapsed = time() - started
+    assert 0.3 <= elapsed < 0.4, f"Second item started {elapsed:.2f} seconds after the first"
+
+    # Items slower than the floor don't wait at all
+    sleep(0.35)
+    before = time()
+    s._wait_for_politeness_floor()
+    assert time() - before < 0.05
+
+    s = MainMapScraper(fetch_mode='http', progress_bars=False, page_load_pause=0)
+    started = time()
+    for _ in range(5):
+        s._wait_for_politeness_floor()
+    assert time() - started < 0.05
+
+
+def test_network_idle():
+    s = MainMapScraper(fetch_mode='http', progress_bars=False)
+    s.driver = StandInWireDriver()
+    api_url = 'https://api.plugshare.com/v3/locations/12345'
+    play(s.driver, [
+        (0, api_url, None),
+        (0, 'https://maps.googleapis.com/maps/vt?tile', None),
+        (0.3, None, 0)
+    ])
+    started = time()
+    assert s.wait_for_network_idle(timeout=3, idle_time=0.2, poll_interval=0.02)
+    elapsed = time() - started
+    assert 0.45 <= elapsed < 1, f"Idle after {elapsed:.2f} seconds, should be ~0.5 (pending until 0.3 + 0.2 quiet)"
+
+    # Out-of-scope requests that never finish don't hold it up
+    assert s.driver.requests[1].response is None
+
+    # A request that never finishes
+    s.driver = StandInWireDriver()
+    s.driver.requests.append(StandInRequest(api_url))
+    started = time()
+    assert not s.wait_for_network_idle(timeout=0.3, idle_time=0.1, poll_interval=0.02)
+    assert time() - started < 0.5
+
+
+def test_map_idle():
+    s = LocationIDScraper(fetch_mode='http', progress_bars=False)
+    s.driver = StandInWireDriver()
+    search = SearchCriterion(40.0, -105.0, 10, 1, 'NREL', 3)
+    play(s.driver, [
+        # Map asks for pins where it was, then pans to the search and asks again,
+        # and the first request's response only comes back last
+        (0, region_url(38.9, -77.0), None),
+        (0.1, region_url(40.01, -105.01), None),
+        (0.1, None, 1),
+        (0.1, None, 0)
+    ])
+    started = time()
+    r = s.wait_for_map_idle(search, timeout=3, idle_time=0.2, poll_interval=0.02)
+    elapsed = time() - started
+    assert r is s.driver.requests[1], "Should use the response for the viewport the map settled on"
+    assert 0.45 <= elapsed < 1, f"Idle after {elapsed:.2f} seconds"
+
+    # Viewport isn't in the URL, so the latest response it is
+    s.driver = StandInWireDriver()
+    play(s.driver, [
+        (0, 'https://api.plugshare.com/v3/locations/region?count=500', None),
+        (0, 'https://api.plugshare.com/v3/locations/region?count=250', None),
+        (0, None, 0),
+        (0, None, 1)
+    ])
+    assert s.wait_for_map_idle(search, timeout=3, idle_time=0.1, poll_interval=0.02) is s.driver.requests[1]
+
+    # Map never asks for pins
+    s.driver = StandInWireDriver()
+    started = time()
+    assert s.wait_for_map_idle(search, timeout=0.3, idle_time=0.1, poll_interval=0.02) is None
+    assert 0.3 <= time() - started < 0.5
+
+
+if __name__ == '__main__':
+    test_politeness_floor()
+    test_network_idle()
+    test_map_idle()
+    print("SUCCESS!")
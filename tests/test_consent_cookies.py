@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+
+from evlens.data.plugshare import MainMapScraper
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+BROWSER_COOKIES = [
+    {'name': 'OptanonConsent', 'value': 'groups=C0001:1', 'domain': '.plugshare.com', 'path': '/', 'secure': True, 'expiry': 1900000000},
+    {'name': 'consentUUID', 'value': 'abc', 'domain': '.plugshare.com', 'path': '/', 'secure': True, 'sameSite': 'Lax'},
+    {'name': 'sessionid', 'value': 'secret-session', 'domain': 'www.plugshare.com', 'path': '/', 'httpOnly': True},
+    {'name': 'auth_token', 'value': 'secret-token', 'domain': 'www.plugshare.com', 'path': '/'}
+]
+
+
+class StandInCookieDriver:
+    '''
+    Just enough of a browser to save cookies from and set them on.
+    '''
+    def __init__(self, cookies=None):
+        self.cookies = cookies or []
+        self.cdp_commands = []
+
+    def get_cookies(self):
+        return self.cookies
+
+    def execute_cdp_cmd(self, command: str, params: dict):
+        self.cdp_commands.append((command, params))
+
+
+class StandInDialogScraper(MainMapScraper):
+    '''
+    Scraper whose cookie dialog (if `banner_showing`) can't be rejected until `reject_works` is set.
+    '''
+    def __init__(self, banner_showing: bool = True, **kwargs):
+        super().__init__(fetch_mode='http', progress_bars=False, **kwargs)
+        self._consent_handled = False
+        self._cookie_dialog_seen = None
+        self._login_dialog_seen = None
+        self.banner_showing = banner_showing
+        self.reject_works = False
+        self.num_reject_attempts = 0
+        self.probe_timeouts = []
+
+    def reject_all_cookies_dialog(self) -> bool:
+        # Waits the full `timeout` for the banner, then tries to reject it
+        self.num_reject_attempts += 1
+        if self.banner_showing and self.reject_works:
+            self.banner_showing = False
+            return True
+        return False
+
+    def _find_visible(self, locator, timeout: float):
+        self.probe_timeouts.append(timeout)
+        return 'banner' if self.banner_showing else None
+
+    def exit_login_dialog(self, timeout: float = None, screenshot_if_missing: bool = True) -> bool:
+        return False
+
+
+def test_consent_cookie_round_trip():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cookies', 'consent.json')
+
+        s = MainMapScraper(fetch_mode='http', progress_bars=False, consent_cookie_path=path)
+        s.driver = StandInCookieDriver(BROWSER_COOKIES)
+        s._save_consent_cookies()
+        with open(path) as f:
+            saved = json.load(f)
+        assert [c['name'] for c in saved] == ['OptanonConsent', 'consentUUID'], "Only consent cookies should be saved"
+        assert 'secret' not in json.dumps(saved)
+
+        # A fresh browser session gets the saved cookies back through CDP
+        s2 = MainMapScraper(fetch_mode='http', progress_bars=False, consent_cookie_path=path)
+        s2.driver = StandInCookieDriver()
+        assert s2._load_consent_cookies()
+        commands = s2.driver.cdp_commands
+        assert [c for c, _ in commands] == ['Network.setCookie'] * 2
+        assert commands[0][1]['expires'] == 1900000000 and 'expiry' not in commands[0][1]
+        assert commands[1][1]['sameSite'] == 'Lax'
+
+        # Files saved before filtering was added may hold login cookies, those are never loaded
+        with open(path, 'w') as f:
+            json.dump(BROWSER_COOKIES[2:], f)
+        s2.driver = StandInCookieDriver()
+        assert not s2._load_consent_cookies()
+        assert s2.driver.cdp_commands == []
+
+        s3 = MainMapScraper(fetch_mode='http', progress_bars=False, consent_cookie_path=os.path.join(directory, 'missing.json'))
+        s3.driver = StandInCookieDriver()
+        assert not s3._load_consent_cookies()
+
+
+def test_failed_rejection_is_retried():
+    s = StandInDialogScraper()
+    s.handle_dialogs()
+    assert not s._consent_handled, "A failed rejection shouldn't count as handled"
+    s.handle_dialogs()
+    assert s.num_reject_attempts == 2, "Rejection should be retried on the next page"
+
+    s.reject_works = True
+    s.handle_dialogs()
+    assert s._consent_handled
+    s.handle_dialogs()
+    assert s.num_reject_attempts == 3, "Once handled, the banner shouldn't be waited on again"
+
+
+def test_missing_banner_is_only_probed():
+    s = StandInDialogScraper(banner_showing=False, dialog_probe_timeout=0.1)
+    for _ in range(5):
+        s.handle_dialogs()
+    assert s.num_reject_attempts == 1, "Only the first page should wait the full timeout for a banner that isn't there"
+    assert s.probe_timeouts == [0.1] * 4, "Later pages should only take a quick peek"
+
+    # Banner turns up after all
+    s.banner_showing = True
+    s.reject_works = True
+    s.handle_dialogs()
+    assert s._consent_handled and s.num_reject_attempts == 2
+
+
+if __name__ == '__main__':
+    test_consent_cookie_round_trip()
+    test_failed_rejection_is_retried()
+    test_missing_banner_is_only_probed()
+    print("SUCCESS!")
@@ -0,0 +1,86 @@
+import gzip
+import json
+import os
+import tempfile
+
+from evlens.data.error_capture import ErrorCapture
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class StandInDriver:
+    '''
+    Just enough of a (selenium-wire) browser to be captured.
+    '''
+    current_url = 'https://www.plugshare.com/location/12345'
+    title = 'PlugShare'
+    page_source = '<html><body><div class="checkin">...</div></body></html>'
+    requests = []
+
+    def __init__(self):
+        self.num_screenshots = 0
+
+    def save_screenshot(self, path: str):
+        self.num_screenshots += 1
+        with open(path, 'wb') as f:
+            f.write(b'png')
+
+
+def fail(location_id: int):
+    raise KeyError(f"No checkins for location {location_id}")
+
+
+def capture_failure(capture: ErrorCapture, error_class: str, driver: StandInDriver, location_id: int) -> str:
+    try:
+        fail(location_id)
+    except KeyError:
+        return capture.capture(error_class, driver)
+
+
+def test_failure_storm():
+    with tempfile.TemporaryDirectory() as directory:
+        capture = ErrorCapture(directory, bucket_name=None, default_max_per_minute=3, seed=42)
+        driver = StandInDriver()
+
+        # The same failure at thousands of locations is only worth capturing once
+        paths = [capture_failure(capture, 'checkin_parsing_error', driver, i) for i in range(1_000)]
+        assert driver.num_screenshots == 1 and os.path.exists(paths[0])
+        assert capture.suppressed[('checkin_parsing_error', 'duplicate')] == 999
+
+        # Distinct failures are still rate limited per error class
+        for i in range(20):
+            try:
+                raise ValueError(f"Unexpected layout variant {chr(ord('a') + i)}")
+            except ValueError:
+                capture.capture('layout_error', driver)
+        summary = capture.summary()
+        assert summary['layout_error']['captured'] == 3, summary
+        assert summary['layout_error']['rate_limited'] == 17, summary
+
+        # Other classes have their own budget
+        assert capture_failure(capture, 'selenium_login_not_found', driver, 1) is not None
+
+        sampled = ErrorCapture(directory, bucket_name=None, sample_rates={'noisy': 0}, seed=42)
+        assert sampled.capture('noisy', driver) is None
+        assert sampled.summary()['noisy'] == {'captured': 0, 'duplicate': 0, 'sampled': 1, 'rate_limited': 0}
+
+
+def test_snapshot():
+    with tempfile.TemporaryDirectory() as directory:
+        capture = ErrorCapture(directory, bucket_name=None, mode='snapshot')
+        driver = StandInDriver()
+        path = capture_failure(capture, 'checkin_parsing_error', driver, 7)
+        assert path.endswith('.json.gz') and driver.num_screenshots == 0
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        assert snapshot['url'] == driver.current_url
+        assert snapshot['dom'] == driver.page_source
+        assert 'KeyError' in snapshot['exception']
+
+
+if __name__ == '__main__':
+    test_failure_storm()
+    test_snapshot()
+    print("SUCCESS!")
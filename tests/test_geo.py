@@ -0,0 +1,74 @@
+import json
+import os
+from time import time
+
+import numpy as np
+import pandas as pd
+
+from evlens.data.geo import haversine_miles, make_search_tiles, make_ball_tree, EARTH_RADIUS_MILES, NREL_SEARCH_TILE_COLUMNS
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+NREL_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'cloud', 'bq_plugshare_searchTilesTable_NREL_config.json')
+
+
+def make_stations(num_stations: int, seed: int = 42) -> pd.DataFrame:
+    '''
+    AFDC-like stations, mostly clustered around a few hundred "towns" across the continental US.
+    '''
+    rng = np.random.default_rng(seed)
+    towns = np.column_stack([rng.uniform(25, 49, 300), rng.uniform(-124, -67, 300)])
+    town_of_station = rng.integers(0, len(towns), num_stations)
+    coordinates = towns[town_of_station] + rng.normal(0, 0.05, size=(num_stations, 2))
+    return pd.DataFrame({
+        'id': np.arange(num_stations) + 100_000,
+        'station_name': [f"Station {i}" for i in range(num_stations)],
+        'latitude': coordinates[:, 0],
+        'longitude': coordinates[:, 1],
+        'ev_dc_fast_num': rng.integers(1, 8, num_stations),
+        'ev_level2_evse_num': np.nan,
+        'ev_connector_types': [['J1772COMBO', 'CHADEMO'] if i % 2 else ['TESLA'] for i in range(num_stations)],
+        'ev_network': 'Electrify America',
+        'ev_network_ids': [{'station': [str(i)]} for i in range(num_stations)]
+    })
+
+
+def test_haversine():
+    # New York to Los Angeles
+    assert abs(haversine_miles(40.7128, -74.0060, 34.0522, -118.2437) - 2445) < 5
+    distances = haversine_miles(40.0, -105.0, np.array([40.0, 41.0]), np.array([-105.0, -105.0]))
+    assert distances[0] == 0 and abs(distances[1] - 69.1) < 0.1
+
+
+def test_search_tiles_cover_stations():
+    df_stations = make_stations(60_000)
+    started = time()
+    df_tiles = make_search_tiles(df_stations, max_radius_in_miles=2)
+    elapsed = time() - started
+    assert elapsed < 30, f"Took {elapsed:.1f} seconds"
+
+    with open(NREL_SCHEMA_PATH) as f:
+        assert df_tiles.columns.tolist() == [field['name'] for field in json.load(f)] == NREL_SEARCH_TILE_COLUMNS
+    assert df_tiles['id'].is_unique
+    assert df_tiles['cell_radius_mi'].between(0.1, 2).all()
+    assert len(df_tiles) < len(df_stations) / 3, f"{len(df_tiles)} tiles for {len(df_stations)} stations"
+    assert df_tiles['num_plugs'].sum() == df_stations['ev_dc_fast_num'].sum(), "Every station's plugs should be in exactly one tile"
+
+    # Every station is inside some tile
+    tree = make_ball_tree(df_tiles['latitude'], df_tiles['longitude'])
+    tile_indices, distances = tree.query_radius(
+        np.radians(df_stations[['latitude', 'longitude']].to_numpy()),
+        r=2 / EARTH_RADIUS_MILES,
+        return_distance=True
+    )
+    radii = df_tiles['cell_radius_mi'].to_numpy()
+    covered = [(d * EARTH_RADIUS_MILES <= radii[t] + 1e-9).any() for t, d in zip(tile_indices, distances)]
+    assert all(covered), f"{len(covered) - sum(covered)} stations not covered"
+
+
+if __name__ == '__main__':
+    test_haversine()
+    test_search_tiles_cover_stations()
+    print("SUCCESS!")
@@ -0,0 +1,115 @@
+from multiprocessing import Pool
+import os
+import tempfile
+
+from evlens.data.google_cloud import BigQuery
+from evlens.data.key_index import KeyIndex, BloomFilter
+from evlens.data.plugshare import MainMapScraper
+
+from evlens.data.archive import ResponseArchive
+
+from test_bigquery_merge import DuckDBClient, make_checkins
+from test_mainmap_http_fetch import start_stand_in_server, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def add_keys(args):
+    path, worker = args
+    key_index = KeyIndex(path, expected_keys=10_000)
+    for i in range(10):
+        key_index.add('plugshare.checkins', [f"{worker}_{i}_{j}" for j in range(50)])
+    key_index.close()
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(expected_items=1000, false_positive_rate=0.01)
+    for i in range(1000):
+        bloom.add(str(i))
+    assert all(str(i) in bloom for i in range(1000)), "Bloom filter gave a false negative"
+    false_positives = sum(str(i) in bloom for i in range(1000, 11_000))
+    assert false_positives < 300, f"Too many false positives ({false_positives} of 10,000)"
+
+
+def test_concurrent_writers():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'keys.db')
+        key_index = KeyIndex(path, expected_keys=10_000)
+        
+        with Pool(4) as pool:
+            pool.map(add_keys, [(path, w) for w in range(4)])
+        
+        # Another process's writes are picked up without reopening
+        assert key_index.count('plugshare.checkins') == 2000, "Keys lost under concurrent writes"
+        assert len(key_index.filter_known('plugshare.checkins', ['3_9_49', '0_0_0', 'nope'])) == 2, \
+            "Keys written by other processes not found"
+        assert ('plugshare.stations', '0_0_0') not in key_index, "Namespaces should be separate"
+        
+        assert key_index.rebuild('plugshare.checkins', ['a', 'b']) == 2, "Rebuild didn't replace keys"
+        assert key_index.filter_new('plugshare.checkins', ['a', '0_0_0']) == ['0_0_0'], "Rebuild left old keys behind"
+        key_index.close()
+
+
+def test_insert_and_skip():
+    with tempfile.TemporaryDirectory() as directory:
+        key_index = KeyIndex(os.path.join(directory, 'keys.db'), expected_keys=10_000)
+        client = DuckDBClient()
+        bq = BigQuery(client=client)
+        client.load_table_from_dataframe(make_checkins([1, 2]), bq._make_table_id('plugshare', 'checkins'))
+        
+        assert bq.insert_data(make_checkins([2, 3]), 'plugshare', 'checkins', merge_columns='id', key_index=key_index) == 1, \
+            "Wrong number of rows inserted"
+        assert key_index.filter_known('plugshare.checkins', ['1', '2', '3']) == ['2', '3'], "Saved keys not recorded"
+        
+        # Known keys never make it to the warehouse
+        client.queries = []
+        assert bq.insert_data(make_checkins([2, 3]), 'plugshare', 'checkins', merge_columns='id', key_index=key_index) == 0, \
+            "Known rows inserted"
+        assert client.queries == [], "Warehouse queried for rows the key index already knew about"
+        key_index.close()
+        
+        # Scrapers skip locations that are already stored
+        s = MainMapScraper(
+            progress_bars=False,
+            fetch_mode='http',
+            key_index_path=os.path.join(directory, 'keys.db')
+        )
+        s.key_index.add('plugshare.stations', ['252784'])
+        assert s._filter_known_locations([252784, '000001']) == ['000001'], "Known location not skipped"
+        s.quit()
+        s.key_index.close()
+
+
+def test_skip_known_is_opt_in():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            key_index_path = os.path.join(directory, 'keys.db')
+            KeyIndex(key_index_path).add('plugshare.stations', [TEST_LOCATION])
+
+            def fetched(**run_kwargs) -> list:
+                archive_path = os.path.join(directory, f"archive_{len(run_kwargs)}")
+                s = MainMapScraper(
+                    progress_bars=False,
+                    fetch_mode='http',
+                    api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+                    key_index_path=key_index_path,
+                    parse_responses=False,
+                    archive_path=archive_path
+                )
+                s.run([TEST_LOCATION], **run_kwargs)
+                return ResponseArchive(archive_path).keys()
+
+            assert fetched() == [TEST_LOCATION], "Re-scrapes of stored locations should be fetched by default"
+            assert fetched(skip_known=True) == [], "Discovery runs should skip stored locations"
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_bloom_filter()
+    test_concurrent_writers()
+    test_insert_and_skip()
+    test_skip_known_is_opt_in()
+    print("SUCCESS!")
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import pandas as pd
+
+from evlens.data.local_warehouse import LocalWarehouse
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def make_checkins(ids) -> pd.DataFrame:
+    return pd.DataFrame({
+        'id': ids,
+        'created_at': pd.Timestamp('2024-06-01 12:00'),
+        'evse_id': [i % 3 for i in ids],
+        'rating': [1] * len(ids)
+    })
+
+
+def test_local_warehouse():
+    with tempfile.TemporaryDirectory() as directory:
+        warehouse = LocalWarehouse(os.path.join(directory, 'warehouse'))
+        warehouse.create_dataset('plugshare')
+        warehouse.setup_plugshare_tables()
+        assert warehouse.list_datasets() == ['plugshare']
+        table_id = warehouse._make_table_id('plugshare', 'checkins')
+
+        df = warehouse.query_to_dataframe(f"SELECT * FROM `{table_id}`")
+        assert df.empty and 'charge_power_kilowatts' in df.columns, "Empty tables should still have their schema"
+
+        assert warehouse.insert_data(make_checkins([1, 2, 3]), 'plugshare', 'checkins', merge_columns='id') == 3
+        # Overlapping batch, with a repeat inside the batch too
+        num_inserted = warehouse.insert_data(make_checkins([3, 4, 4, 5]), 'plugshare', 'checkins', merge_columns='id')
+        assert num_inserted == 2, f"Expected 2 new rows, got {num_inserted}"
+        assert warehouse.insert_data(make_checkins([1, 5]), 'plugshare', 'checkins', merge_columns='id') == 0
+
+        df = warehouse.query_to_dataframe(f"""
+            SELECT c.id, c.created_at, c.vehicle_name
+            FROM `{table_id}` c
+            ORDER BY c.id
+        """)
+        assert df['id'].tolist() == [1, 2, 3, 4, 5], "Table should have each ID exactly once"
+        assert df['created_at'].iloc[0] == pd.Timestamp('2024-06-01 12:00'), "DATETIME values shouldn't shift"
+        assert df['vehicle_name'].isnull().all(), "Columns missing from inserts should be null"
+
+        # Unquoted table IDs work too, the way BigQuery allows
+        new = warehouse.check_and_remove_duplicates('plugshare', 'checkins', make_checkins([4, 6]), 'id')
+        assert new['id'].tolist() == [6]
+
+        try:
+            warehouse.insert_data(make_checkins([7]).assign(bogus=1), 'plugshare', 'checkins')
+            assert False, "Columns outside the schema should be rejected"
+        except ValueError:
+            pass
+
+        warehouse.compact_table('plugshare', 'checkins')
+        assert len([f for f in os.listdir(os.path.join(directory, 'warehouse', 'plugshare', 'checkins')) if f.endswith('.parquet')]) == 1
+        assert warehouse.query_to_dataframe(f"SELECT count(*) AS n FROM {table_id}")['n'].iloc[0] == 5
+
+        assert warehouse.table_exists('plugshare', 'checkins') and not warehouse.table_exists('plugshare', 'missing')
+        assert warehouse.replace_table(make_checkins([8, 9]), 'plugshare', 'checkins') == 2
+        df = warehouse.query_to_dataframe(f"SELECT id FROM `{table_id}` ORDER BY id")
+        assert df['id'].tolist() == [8, 9], "Old contents should be gone"
+
+        warehouse.clear_table('plugshare', 'checkins')
+        assert warehouse.query_to_dataframe(f"SELECT * FROM `{table_id}`").empty
+
+
+if __name__ == '__main__':
+    test_local_warehouse()
+    print("SUCCESS!")
@@ -0,0 +1,73 @@
+import json
+
+import pandas as pd
+
+from evlens.data.plugshare_parsing import LocationBatchParser
+
+from test_mainmap_http_fetch import RECORDED_RESPONSE_PATH, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def make_sparse_location(location: dict) -> dict:
+    '''
+    A second location with no check-ins, amenities, or photos, as new locations often have.
+    '''
+    sparse = dict(location, id=999999, reviews=[], amenities=[], photos=[])
+    sparse['stations'] = [dict(e, location_id=999999) for e in location['stations'][:1]]
+    return sparse
+
+
+def test_single_location():
+    with open(RECORDED_RESPONSE_PATH, 'rb') as f:
+        df_station, df_checkins, df_evses = LocationBatchParser.parse(f.read())
+        
+    assert df_station.loc[0, 'location_id'] == TEST_LOCATION, "Wrong location parsed"
+    assert df_station.loc[0, 'amenities'] == '2;8;3;9;4', "Amenities not joined"
+    assert df_station.loc[0, 'network'] == 'Electrify America', "Network not found"
+    assert df_station.loc[0, 'kilowatts_max'] == 350, "Max power wrong"
+    
+    assert len(df_checkins) == 6, "Spam check-ins not dropped"
+    assert isinstance(df_checkins['created_at'].dtype, pd.DatetimeTZDtype), "Timestamps not parsed"
+    assert df_checkins.loc[0, 'vehicle_year'] == 2019, "Vehicle year not extracted"
+    assert pd.isnull(df_checkins['vehicle_year']).sum() == 1, "Year found where there is none"
+    
+    assert len(df_evses) == 4, "Wrong number of EVSEs"
+    assert (df_evses['station_id'] == TEST_LOCATION).all(), "EVSEs not tied to location"
+
+
+def test_batch_matches_single_parses():
+    with open(RECORDED_RESPONSE_PATH, 'rb') as f:
+        body = f.read()
+    sparse_body = json.dumps(make_sparse_location(json.loads(body)))
+    
+    parser = LocationBatchParser()
+    parser.add(body)
+    parser.add(sparse_body)
+    assert len(parser) == 2, "Locations not counted"
+    batch = parser.flush()
+    assert len(parser) == 0, "Parser not reset by flush"
+    
+    singles = [LocationBatchParser.parse(b) for b in (body, sparse_body)]
+    for i, df_batch in enumerate(batch):
+        df_expected = pd.concat([s[i] for s in singles], ignore_index=True)
+        pd.testing.assert_frame_equal(df_batch, df_expected, check_dtype=False)
+        
+    df_stations = batch[0]
+    assert df_stations.loc[1, 'amenities'] == '', "Missing amenities not handled"
+    
+    # Bad payloads are rejected without leaving partial rows behind
+    for bad_body in (b'not json', b'[]'):
+        try:
+            parser.add(bad_body)
+            raise AssertionError("Bad payload accepted")
+        except ValueError:
+            pass
+    assert all(df.empty for df in parser.flush()), "Bad payload left rows behind"
+
+
+if __name__ == '__main__':
+    test_single_location()
+    test_batch_matches_single_parses()
+    print("SUCCESS!")
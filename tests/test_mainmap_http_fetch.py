@@ -0,0 +1,81 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+import os
+
+from evlens.data.plugshare import MainMapScraper
+
+# Electrify America in Springfield, VA mall parking lot
+TEST_LOCATION = '252784'
+RECORDED_RESPONSE_PATH = os.path.join(
+    os.path.dirname(__file__),
+    'data',
+    f'plugshare_location_{TEST_LOCATION}.json'
+)
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class RecordedLocationHandler(BaseHTTPRequestHandler):
+    '''
+    Stand-in for the PlugShare API that serves recorded location JSON from tests/data/.
+    '''
+    def do_GET(self):
+        location_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+        path = os.path.join(
+            os.path.dirname(RECORDED_RESPONSE_PATH),
+            f'plugshare_location_{location_id}.json'
+        )
+        if not self.path.startswith('/v3/locations/') or not os.path.exists(path):
+            self.send_response(404)
+            self.end_headers()
+            return
+        
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stand_in_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RecordedLocationHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_http_fetch_mode():
+    server = start_stand_in_server()
+    try:
+        s = MainMapScraper(
+            timeout=3,
+            progress_bars=False,
+            fetch_mode='http',
+            api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/"
+        )
+        assert s.driver is None, "No browser should be launched in http mode"
+        
+        results = s.scrape_location(TEST_LOCATION)
+        assert results is not None, "No results parsed from stand-in server"
+        df_station, df_checkins, df_evses = results
+        
+        assert df_station.loc[0, 'location_id'] == TEST_LOCATION, "Wrong location parsed"
+        assert not df_checkins.empty, "No checkins found"
+        assert not df_evses.empty, "No EVSEs found"
+        assert (df_evses['station_id'] == TEST_LOCATION).all(), "EVSEs not tied to location"
+        
+        assert s.scrape_location('000000') is None, "Missing location should return None"
+        s.quit()
+        
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_http_fetch_mode()
+    print("SUCCESS!")
@@ -0,0 +1,130 @@
+import sys
+import time
+
+import ray
+
+from evlens.concurrency import parallelized_data_processing, get_chunks, ChunkResult, ScraperSession
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+@ray.remote
+class StandInScraper:
+    '''
+    Doubles its inputs, stalling on -1 and failing on -2, and remembers whether it was told to quit.
+    '''
+    def __init__(self, stall_seconds: float = 0):
+        self.stall_seconds = stall_seconds
+        self.num_runs = 0
+        
+    def run(self, inputs, close_when_done: bool = True):
+        assert not close_when_done, "Browser would be closed between chunks"
+        self.num_runs += 1
+        if -2 in list(inputs):
+            raise RuntimeError("Stand-in failure")
+        if -1 in list(inputs):
+            time.sleep(self.stall_seconds)
+        return [2 * x for x in inputs]
+    
+    def get_num_runs(self) -> int:
+        return self.num_runs
+    
+    def quit(self):
+        pass
+
+
+def test_get_chunks():
+    chunks = get_chunks(list(range(7)), 3)
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]], f"Unexpected chunks {chunks}"
+
+
+def test_chunk_mode():
+    inputs = [-1] + list(range(20)) + [-2]
+    results = parallelized_data_processing(
+        StandInScraper,
+        inputs,
+        n_jobs=2,
+        chunk_size=3,
+        stall_seconds=2
+    )
+    
+    assert all(isinstance(r, ChunkResult) for r in results), "Chunk mode should return ChunkResults"
+    assert [r.chunk_index for r in results] == list(range(8)), "Results not in input order"
+    
+    failed = [r for r in results if not r.ok]
+    assert len(failed) == 1 and failed[0].inputs == [-2], "Failure not reported for just its chunk"
+    
+    outputs = [x for r in results if r.ok for x in r.result]
+    assert outputs == [2 * x for x in inputs[:-1]], "Missing or out of order outputs"
+
+
+def test_scraper_session():
+    ray.shutdown()
+    ray.init(num_cpus=1, include_dashboard=False)
+    try:
+        with ScraperSession(StandInScraper, n_jobs=1) as session:
+            first = session.submit(list(range(4)))
+            second = session.submit(list(range(4, 10)), chunk_size=2)
+            actor = session.actors[0]
+            assert ray.get(actor.get_num_runs.remote()) == 4, "Same warm actor should have served both jobs"
+        
+        assert first == [[0, 2, 4, 6]], f"Unexpected batch results {first}"
+        assert [r.result for r in second] == [[8, 10], [12, 14], [16, 18]], "Unexpected chunk results"
+        assert ray.is_initialized(), "Session shut down a Ray runtime it didn't start"
+        
+    finally:
+        ray.shutdown()
+
+
+def test_streaming_results():
+    ray.shutdown()
+    ray.init(num_cpus=2, include_dashboard=False)
+    inputs = [-1, 0] + list(range(1, 9))
+    try:
+        with ScraperSession(StandInScraper, stall_seconds=2) as session:
+            assert len(session.actors) == 2, "Should use every CPU of the runtime it attached to"
+            
+            # The stalled first chunk shouldn't hold up the rest
+            order = [r.chunk_index for r in session.iter_submit(inputs, chunk_size=2)]
+            assert order == [1, 2, 3, 4, 0], f"Results not streamed as they finished {order}"
+            
+            # Each result is a list of two ints, so a cap of one result stops new work while the stall is in flight,
+            # and only the first chunk runs until there's a result to estimate from
+            one_result = 2 * sys.getsizeof(0) + 1
+            stall_second = [0, 1, -1] + list(range(2, 9))
+            order = [
+                r.chunk_index for r in session.iter_submit(stall_second, chunk_size=2, max_in_flight_bytes=one_result)
+            ]
+            assert order == [0, 1, 2, 3, 4], f"In-flight byte cap not respected {order}"
+            
+    finally:
+        ray.shutdown()
+
+
+def test_streaming_stopped_early():
+    ray.shutdown()
+    ray.init(num_cpus=2, include_dashboard=False)
+    try:
+        with ScraperSession(StandInScraper, stall_seconds=2) as session:
+            started = time.time()
+            for r in session.iter_submit([-1, 0] + list(range(1, 9)), chunk_size=2):
+                break
+            assert r.chunk_index == 1
+            assert time.time() - started >= 2, "Stalled chunk should be waited on once the caller stops"
+            
+            num_runs = ray.get([a.get_num_runs.remote() for a in session.actors])
+            assert sum(num_runs) == 3, f"Chunks handed out after the caller stopped {num_runs}"
+            assert [r.result for r in session.submit([1, 2], chunk_size=1)] == [[2], [4]]
+            
+    finally:
+        ray.shutdown()
+
+
+if __name__ == '__main__':
+    test_get_chunks()
+    test_chunk_mode()
+    test_scraper_session()
+    test_streaming_results()
+    test_streaming_stopped_early()
+    print("SUCCESS!")
@@ -0,0 +1,143 @@
+from threading import Timer
+from time import sleep, time
+
+from evlens.data.plugshare import MainMapScraper, LocationResponseRouter
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class StandInRequest:
+    def __init__(self, url: str):
+        self.url = url
+
+
+class StandInResponse:
+    def __init__(self, status_code: int, body: bytes):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {}
+
+
+class StandInSwitchTo:
+    def __init__(self, driver: 'StandInTabbedDriver'):
+        self.driver = driver
+
+    def new_window(self, kind: str):
+        self.driver.window_handles.append(f"tab{len(self.driver.window_handles)}")
+
+    def window(self, handle: str):
+        self.driver.current_tab = handle
+
+
+class StandInTabbedDriver:
+    '''
+    Just enough of a selenium-wire browser to load location pages in several tabs, each page's API response coming back through `response_interceptor` after `delays[location_id]` seconds (or never, if it isn't in `delays`).
+    '''
+    def __init__(self, delays: dict, status_codes: dict = None):
+        self.delays = delays
+        self.status_codes = status_codes or dict()
+        self.window_handles = ['tab0']
+        self.switch_to = StandInSwitchTo(self)
+        self.current_tab = 'tab0'
+        self.navigations = []
+        self.response_interceptor = None
+
+    @property
+    def requests(self):
+        return []
+
+    @requests.deleter
+    def requests(self):
+        pass
+
+    def get(self, url: str):
+        # First page is loaded normally, see `StandInPipelinedScraper._catch_api_body()`
+        pass
+
+    def execute_script(self, script: str, url: str):
+        location_id = url.rsplit('/', 1)[-1]
+        self.navigations.append((self.current_tab, location_id))
+        if location_id not in self.delays:
+            return
+        request = StandInRequest(f"https://api.plugshare.com/v3/locations/{location_id}")
+        response = StandInResponse(self.status_codes.get(location_id, 200), f'{{"id": {location_id}}}'.encode())
+        interceptor = self.response_interceptor
+        Timer(self.delays[location_id], interceptor, args=(request, response)).start()
+
+
+class StandInPipelinedScraper(MainMapScraper):
+    def __init__(self, driver: StandInTabbedDriver, **kwargs):
+        super().__init__(fetch_mode='http', progress_bars=False, **kwargs)
+        self.driver = driver
+        self._location_responses = LocationResponseRouter()
+
+    def handle_dialogs(self):
+        pass
+
+    def _catch_api_body(self, location_id: str) -> bytes:
+        return b'first'
+
+
+def test_router():
+    router = LocationResponseRouter()
+    assert not router.deliver('1', 200, b'unexpected'), "Responses nobody waits on are ignored"
+
+    router.expect('1')
+    router.expect('2')
+    assert router.deliver('2', 200, b'two')
+    assert router.wait('2', timeout=1) == (200, b'two')
+    assert not router.is_expected('2')
+
+    started = time()
+    assert router.wait('1', timeout=0.2) is None
+    assert 0.2 <= time() - started < 0.3
+
+    # Time spent paused doesn't count against the timeout
+    router.expect('3')
+    router.pause()
+    sleep(0.3)
+    router.resume()
+    assert router.time_left('3', timeout=0.2) > 0.15
+    Timer(0.1, router.deliver, args=('3', 404, None)).start()
+    assert router.wait('3', timeout=0.2) == (404, None)
+
+    router.expect('4')
+    router.clear()
+    assert not router.is_expected('4')
+
+
+def test_pipelined_tabs():
+    driver = StandInTabbedDriver(
+        # 3's page is slow enough that it only answers after 2's slow save,
+        # and 4 answers before 3 does
+        delays={'2': 0.05, '3': 1.2, '4': 0.05, '5': 0.05},
+        status_codes={'5': 429}
+    )
+    s = StandInPipelinedScraper(driver, n_tabs=2, timeout=0.5)
+
+    results = dict()
+    elapsed = dict()
+    started = time()
+    for location_id, body in s._iter_pipelined_bodies(['1', '2', '3', '4', '5', '6']):
+        results[location_id] = body
+        elapsed[location_id] = time() - started
+        if location_id == '2':
+            # Slow checkpoint save
+            sleep(1)
+        started = time()
+
+    assert results == {'1': b'first', '2': b'{"id": 2}', '3': b'{"id": 3}', '4': b'{"id": 4}', '5': None, '6': None}
+    assert elapsed['3'] < 0.5, "3 should be waited on for (about) 0.2 seconds after the save"
+    assert 0.4 <= elapsed['6'] < 0.7, "6 never answers, so should be waited on for the full timeout"
+
+    # Both tabs were kept busy, in turn
+    assert driver.navigations == [('tab0', '2'), ('tab1', '3'), ('tab0', '4'), ('tab1', '5'), ('tab0', '6')]
+    assert not hasattr(driver, 'response_interceptor'), "Interceptor should be removed once done"
+    assert not s._location_responses.is_expected('6')
+
+
+if __name__ == '__main__':
+    test_router()
+    test_pipelined_tabs()
+    print("SUCCESS!")
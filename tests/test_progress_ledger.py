@@ -0,0 +1,123 @@
+import os
+import tempfile
+from multiprocessing import Pool
+
+from evlens.data.ledger import ProgressLedger
+from evlens.data.plugshare import MainMapScraper
+
+from test_mainmap_http_fetch import start_stand_in_server, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def _mark_many(args):
+    path, worker = args
+    ledger = ProgressLedger(path)
+    for i in range(50):
+        ledger.mark_in_flight([f"{worker}-{i}-{j}" for j in range(100)])
+    ledger.close()
+
+
+def test_ledger_states():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ledger', 'tiles.tsv')
+        ledger = ProgressLedger(path)
+        ledger.mark_in_flight(['a', 'b', 'c', 'd'])
+        ledger.mark_done(['a'])
+        ledger.mark_failed(['b'], detail="Timed out\nwaiting")
+        ledger.close()
+        
+        # Crashed writer leaves a torn line behind
+        with open(path, 'a') as f:
+            f.write("2024-08-01T00:00:00\tdo")
+        
+        ledger = ProgressLedger(path)
+        assert ledger.states() == {'a': 'done', 'b': 'failed', 'c': 'in_flight', 'd': 'in_flight'}
+        assert ledger.remaining(['a', 'b', 'c', 'd', 'e']) == ['b', 'c', 'd', 'e'], "Wrong work left"
+        assert ledger.remaining(['a', 'b', 'c'], retry_failed=False) == ['c'], "Failures should be skippable"
+        assert ledger.summary() == {'in_flight': 2, 'done': 1, 'failed': 1}
+        
+        ledger.mark_done(['b'])
+        assert ledger.remaining(['b']) == [], "Later entries should win"
+        ledger.close()
+
+
+def test_reads_only_new_lines():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ledger.tsv')
+        ours = ProgressLedger(path)
+        theirs = ProgressLedger(path)
+        ours.mark_in_flight(['a', 'b'])
+        assert ours._offset == os.path.getsize(path), "Own appends not applied in memory"
+        
+        theirs.mark_done(['a'])
+        # Another writer is partway through a line
+        with open(path, 'a') as f:
+            f.write("2024-08-01T00:00:00\tdone\tb")
+        assert ours.remaining(['a', 'b']) == ['b'], "Other writer's line not picked up"
+        assert ours._offset < os.path.getsize(path), "Unfinished line shouldn't be read yet"
+        
+        with open(path, 'a') as f:
+            f.write("\t\n")
+        assert ours.remaining(['a', 'b']) == [], "Line finished later not picked up"
+        
+        # Nothing new to read
+        offset = ours._offset
+        assert ours.states() == {'a': 'done', 'b': 'done'}
+        assert ours._offset == offset == os.path.getsize(path)
+        ours.close()
+        theirs.close()
+
+
+def test_concurrent_writers():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ledger.tsv')
+        with Pool(4) as pool:
+            pool.map(_mark_many, [(path, w) for w in range(4)])
+        
+        with open(path) as f:
+            lines = f.readlines()
+        assert len(lines) == 4 * 50 * 100, "Lines lost"
+        assert all(len(line.split('\t')) == 4 for line in lines), "Lines from different writers interleaved"
+
+
+def test_scraper_resume():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ledger.tsv')
+            
+            def run_scraper():
+                s = MainMapScraper(
+                    timeout=3,
+                    progress_bars=False,
+                    fetch_mode='http',
+                    api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+                    parse_responses=False,
+                    archive_path=os.path.join(directory, 'archive'),
+                    ledger_path=path
+                )
+                s.run([TEST_LOCATION, '000000'])
+            
+            run_scraper()
+            states = ProgressLedger(path).states()
+            assert states == {TEST_LOCATION: 'done', '000000': 'failed'}, f"Unexpected states {states}"
+            
+            # Only the failure should be tried again
+            run_scraper()
+            with open(path) as f:
+                entries = [line.split('\t')[1:3] for line in f]
+            assert entries.count(['in_flight', TEST_LOCATION]) == 1, "Finished location was repeated"
+            assert entries.count(['in_flight', '000000']) == 2, "Failed location wasn't retried"
+            
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_ledger_states()
+    test_reads_only_new_lines()
+    test_concurrent_writers()
+    test_scraper_resume()
+    print("SUCCESS!")
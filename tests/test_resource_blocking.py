@@ -0,0 +1,148 @@
+import json
+from queue import Queue
+
+from evlens.data.plugshare import MainMapScraper, ResourceBlockingProfile, DEFAULT_BLOCKED_URL_PATTERNS
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+# Bytes one location page transfers, with and without blocking
+UNBLOCKED_PAGE_BYTES = 5_000
+BLOCKED_PAGE_BYTES = 1_200
+NUM_BLOCKED_PER_PAGE = 7
+
+
+def network_event(method: str, **params) -> dict:
+    return {'message': json.dumps({'message': {'method': method, 'params': params}})}
+
+
+class StandInRequest:
+    def __init__(self, url: str):
+        self.url = url
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+class StandInNetworkDriver:
+    '''
+    Just enough of a Chrome to block resources in and read network events from. Each page load transfers fewer bytes (and logs blocked requests) while URLs are blocked.
+    '''
+    def __init__(self):
+        self.cdp_commands = []
+        self.blocked_url_patterns = []
+        self.events = []
+        self.pages = []
+
+    @property
+    def requests(self):
+        return []
+
+    @requests.deleter
+    def requests(self):
+        pass
+
+    def execute_cdp_cmd(self, command: str, params: dict):
+        self.cdp_commands.append(command)
+        if command == 'Network.setBlockedURLs':
+            self.blocked_url_patterns = params['urls']
+
+    def get(self, url: str):
+        self.pages.append(url)
+        if len(self.blocked_url_patterns) == 0:
+            self.events.append(network_event('Network.loadingFinished', encodedDataLength=UNBLOCKED_PAGE_BYTES))
+            return
+        # Spread over a few requests, plus some that didn't finish for other reasons
+        for _ in range(3):
+            self.events.append(network_event('Network.loadingFinished', encodedDataLength=BLOCKED_PAGE_BYTES / 3))
+        for _ in range(NUM_BLOCKED_PER_PAGE):
+            self.events.append(network_event('Network.loadingFailed', errorText='net::ERR_BLOCKED_BY_CLIENT', blockedReason='inspector'))
+        self.events.append(network_event('Network.loadingFailed', errorText='net::ERR_CONNECTION_RESET'))
+        self.events.append(network_event('Network.requestWillBeSent'))
+
+    def get_log(self, kind: str) -> list:
+        events, self.events = self.events, []
+        return events
+
+
+class StandInBlockingScraper(MainMapScraper):
+    def __init__(self, driver: StandInNetworkDriver, **kwargs):
+        super().__init__(fetch_mode='http', progress_bars=False, network_idle_time=0.01, **kwargs)
+        self.driver = driver
+
+    def handle_dialogs(self):
+        pass
+
+    def _catch_api_body(self, location_id: str) -> bytes:
+        return b'{}'
+
+
+def test_profile():
+    profile = ResourceBlockingProfile()
+    assert profile.blocked_url_patterns == DEFAULT_BLOCKED_URL_PATTERNS
+    assert profile.is_allowed('https://anything.example.com/'), "No allowlist means everything is allowed"
+    assert ResourceBlockingProfile(blocked_url_patterns=None).blocked_url_patterns == []
+
+    profile = ResourceBlockingProfile(allowed_url_patterns=[r'https://(www|api)\.plugshare\.com/'])
+    assert profile.is_allowed('https://api.plugshare.com/v3/locations/12345')
+    assert not profile.is_allowed('https://www.google-analytics.com/collect')
+    assert 'allowlist of 1' in str(profile)
+
+
+def test_blocking_and_allowlist():
+    driver = StandInNetworkDriver()
+    s = StandInBlockingScraper(
+        driver,
+        resource_blocking=ResourceBlockingProfile(allowed_url_patterns=[r'https://api\.plugshare\.com/'])
+    )
+    s.apply_resource_blocking()
+    assert driver.blocked_url_patterns == DEFAULT_BLOCKED_URL_PATTERNS
+    assert driver.request_interceptor == s._abort_disallowed_request
+
+    allowed = StandInRequest('https://api.plugshare.com/v3/locations/12345')
+    disallowed = StandInRequest('https://www.googletagmanager.com/gtm.js')
+    driver.request_interceptor(allowed)
+    driver.request_interceptor(disallowed)
+    assert not allowed.aborted and disallowed.aborted
+
+    s.apply_resource_blocking(enabled=False)
+    assert driver.blocked_url_patterns == []
+    assert not hasattr(driver, 'request_interceptor')
+
+    # No profile, no blocking
+    driver = StandInNetworkDriver()
+    StandInBlockingScraper(driver).apply_resource_blocking()
+    assert driver.cdp_commands == []
+
+
+def test_bytes_saved_reported():
+    driver = StandInNetworkDriver()
+    s = StandInBlockingScraper(
+        driver,
+        resource_blocking=ResourceBlockingProfile(report_bytes=True),
+        parse_responses=False,
+        output_queue=Queue()
+    )
+    s.apply_resource_blocking()
+    s.run(['1', '2', '3'], fetch_mode='browser', close_when_done=False)
+
+    assert s._baseline_page_bytes == UNBLOCKED_PAGE_BYTES, "run() should measure an unblocked page first"
+    assert len(driver.pages) == 4 and driver.pages[0] == driver.pages[1]
+    assert driver.blocked_url_patterns == DEFAULT_BLOCKED_URL_PATTERNS, "Blocking should be back on after measuring"
+    assert s.bytes_transferred_total == 3 * BLOCKED_PAGE_BYTES
+    assert s.bytes_saved_total == 3 * (UNBLOCKED_PAGE_BYTES - BLOCKED_PAGE_BYTES)
+
+    stats = s.get_page_transfer_stats()
+    assert stats == {'bytes_transferred': 0, 'requests_finished': 0, 'requests_blocked': 0}, "Stats are since the last call"
+    driver.get('https://www.plugshare.com/location/4')
+    stats = s.get_page_transfer_stats()
+    assert stats == {'bytes_transferred': BLOCKED_PAGE_BYTES, 'requests_finished': 3, 'requests_blocked': NUM_BLOCKED_PER_PAGE}
+
+
+if __name__ == '__main__':
+    test_profile()
+    test_blocking_and_allowlist()
+    test_bytes_saved_reported()
+    print("SUCCESS!")
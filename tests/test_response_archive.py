@@ -0,0 +1,108 @@
+import os
+import tempfile
+
+from evlens.data.archive import ResponseArchive
+from evlens.data.plugshare import MainMapScraper
+
+from test_mainmap_http_fetch import start_stand_in_server, RECORDED_RESPONSE_PATH, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def test_append_and_read():
+    with open(RECORDED_RESPONSE_PATH, 'rb') as f:
+        body = f.read()
+        
+    with tempfile.TemporaryDirectory() as directory:
+        # Tiny segments so we rotate a few times
+        archive = ResponseArchive(directory, writer_id='a', segment_max_bytes=10_000)
+        for i in range(5):
+            archive.append('location', str(i), body)
+        archive.append('region', 'cell/0', b'[]')
+        archive.append('location', '0', b'{"id": 0}')
+        
+        other = ResponseArchive(directory, writer_id='b')
+        other.append('location', '100', body)
+        other.close()
+        
+        segments = [f for f in os.listdir(directory) if f.endswith('.seg')]
+        assert len(segments) > 2, "Segments not rotated"
+        assert archive.get('location', '3') == body, "Random read doesn't match what was written"
+        assert archive.get('location', '0') == b'{"id": 0}', "Latest append should win"
+        assert archive.get('location', 'missing') is None, "Missing key should be None"
+        
+        # Reads pick up other writers once the index is reloaded
+        archive.load_index()
+        assert archive.get('location', '100') == body, "Other writer's record not found"
+        
+        records = list(archive.iter_records(kind='location'))
+        assert sorted(k for _, k, _ in records) == ['0', '1', '100', '2', '3', '4'], "Sequential read has the wrong keys"
+        assert len(list(archive.iter_records(latest_only=False))) == 8, "Superseded records missing"
+        archive.close()
+        
+        # Index files can be recreated from the segments alone
+        for f in os.listdir(directory):
+            if f.endswith('.idx'):
+                os.remove(os.path.join(directory, f))
+        rebuilt = ResponseArchive(directory, writer_id='a')
+        rebuilt.rebuild_index()
+        assert len(rebuilt) == 7, "Rebuilt index has the wrong number of keys"
+        assert rebuilt.get('region', 'cell/0') == b'[]', "Rebuilt index doesn't point at the right record"
+        rebuilt.close()
+
+
+def test_reopen_after_torn_append():
+    with tempfile.TemporaryDirectory() as directory:
+        archive = ResponseArchive(directory, writer_id='a')
+        archive.append('location', '1', b'{"id": 1}')
+        segment_name, _ = archive.append('location', '2', b'{"id": 2}')
+        archive.close()
+
+        # Crash partway through appending a third record and its index line
+        with open(os.path.join(directory, segment_name), 'ab') as f:
+            f.write(b'\x00\x00\x01\x00\x00')
+        with open(os.path.join(directory, 'a.idx'), 'a') as f:
+            f.write('location\t3\ta-0000')
+
+        # Same writer ID picks up where the crashed one left off
+        archive = ResponseArchive(directory, writer_id='a')
+        archive.append('location', '4', b'{"id": 4}')
+        archive.close()
+
+        archive = ResponseArchive(directory, writer_id='a')
+        assert [k for _, k, _ in archive.iter_records()] == ['1', '2', '4'], "Records after the reopen should be readable"
+        assert archive.get('location', '4') == b'{"id": 4}'
+        assert archive.get('location', '3') is None
+        archive.close()
+
+
+def test_scraper_archives_responses():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            s = MainMapScraper(
+                timeout=3,
+                progress_bars=False,
+                fetch_mode='http',
+                api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+                archive_path=directory
+            )
+            assert s.scrape_location(TEST_LOCATION) is not None, "No results parsed from stand-in server"
+            s.quit()
+            
+            archive = ResponseArchive(directory)
+            assert archive.keys('location') == [TEST_LOCATION], "Response not archived"
+            with open(RECORDED_RESPONSE_PATH, 'rb') as f:
+                assert archive.get('location', TEST_LOCATION) == f.read(), "Archived body doesn't match response"
+            archive.close()
+            
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_append_and_read()
+    test_reopen_after_torn_append()
+    test_scraper_archives_responses()
+    print("SUCCESS!")
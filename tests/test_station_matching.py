@@ -0,0 +1,116 @@
+from time import time
+import json
+
+import numpy as np
+import pandas as pd
+
+from evlens.data.matching import StationMatcher, normalize_network, connector_bitmask, CROSSWALK_COLUMNS
+
+from test_geo import make_stations
+from test_mainmap_http_fetch import RECORDED_RESPONSE_PATH, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+def make_locations(df_stations: pd.DataFrame, num_extra: int, seed: int = 42) -> pd.DataFrame:
+    '''
+    PlugShare-like locations: every AFDC station geocoded a few meters off, plus `num_extra` sites AFDC doesn't know about.
+    '''
+    rng = np.random.default_rng(seed)
+    connector_ids = {'J1772COMBO': '13', 'CHADEMO': '3', 'TESLA': '6'}
+    known = pd.DataFrame({
+        'location_id': (df_stations['id'] + 1_000_000).astype(str),
+        'latitude': df_stations['latitude'] + rng.normal(0, 0.0001, len(df_stations)),
+        'longitude': df_stations['longitude'] + rng.normal(0, 0.0001, len(df_stations)),
+        'plug_types': [';'.join(connector_ids[c] for c in types) for types in df_stations['ev_connector_types']],
+        'network': 'Electrify America'
+    })
+    extra = pd.DataFrame({
+        'location_id': [f"extra_{i}" for i in range(num_extra)],
+        'latitude': rng.uniform(25, 49, num_extra),
+        'longitude': rng.uniform(-124, -67, num_extra),
+        'plug_types': '2',
+        'network': None
+    })
+    return pd.concat([known, extra], ignore_index=True)
+
+
+def test_similarities():
+    assert normalize_network('eVgo Network') == normalize_network('EVgo') == 'evgo'
+    assert normalize_network('Tesla Supercharger') == normalize_network('Tesla') == 'tesla'
+    assert normalize_network('Non-Networked') is None
+    assert connector_bitmask('3;13', plugshare_ids=True) == connector_bitmask(['CHADEMO', 'J1772COMBO'])
+    assert connector_bitmask(None) == 0
+
+
+def test_neighbors_told_apart():
+    # A Tesla site and a CCS site across the street from each other
+    df_stations = pd.DataFrame({
+        'id': [1, 2],
+        'latitude': [40.0, 40.0004],
+        'longitude': [-105.0, -105.0],
+        'ev_connector_types': [['TESLA'], ['J1772COMBO', 'CHADEMO']],
+        'ev_network': ['Tesla', 'Electrify America']
+    })
+    df_locations = pd.DataFrame({
+        'location_id': ['a', 'b'],
+        'latitude': [40.0003, 40.0001],
+        'longitude': [-105.0, -105.0],
+        'plug_types': ['6', '3;13'],
+        'network': ['Tesla Supercharger', 'Electrify America']
+    })
+    df_crosswalk = StationMatcher().match(df_locations, df_stations)
+    assert df_crosswalk.columns.tolist() == CROSSWALK_COLUMNS
+    assert dict(zip(df_crosswalk['location_id'], df_crosswalk['afdc_station_id'])) == {'a': 1, 'b': 2}, \
+        "Connectors and networks should beat being a bit closer"
+
+
+def test_recorded_location():
+    with open(RECORDED_RESPONSE_PATH) as f:
+        location = json.load(f)
+    connector_types = sorted({str(o['connector_type']) for s in location['stations'] for o in s['outlets']})
+    assert connector_types == ['13', '2'], "Fixture lists CCS/SAE and J-1772"
+    assert connector_bitmask(';'.join(connector_types), plugshare_ids=True) \
+        == connector_bitmask(['J1772COMBO', 'J1772'])
+
+    # A Tesla site right on top of it and the Electrify America CCS site it really is, a little way off
+    df_stations = pd.DataFrame({
+        'id': [1, 2],
+        'latitude': [location['latitude'], location['latitude'] + 0.0003],
+        'longitude': [location['longitude'], location['longitude']],
+        'ev_connector_types': [['TESLA'], ['J1772COMBO', 'J1772']],
+        'ev_network': ['Tesla', 'Electrify America']
+    })
+    df_locations = pd.DataFrame({
+        'location_id': [TEST_LOCATION],
+        'latitude': [location['latitude']],
+        'longitude': [location['longitude']],
+        'plug_types': [';'.join(connector_types)],
+        'network': [location['stations'][1]['network']['name']]
+    })
+    df_crosswalk = StationMatcher().match(df_locations, df_stations)
+    assert df_crosswalk['afdc_station_id'].tolist() == [2], f"CCS location matched to the wrong station {df_crosswalk}"
+
+
+def test_match_at_scale():
+    df_stations = make_stations(60_000)
+    df_locations = make_locations(df_stations, 40_000)
+    started = time()
+    df_crosswalk = StationMatcher().match(df_locations, df_stations)
+    elapsed = time() - started
+    assert elapsed < 60, f"Took {elapsed:.1f} seconds"
+
+    assert df_crosswalk['location_id'].is_unique and df_crosswalk['afdc_station_id'].is_unique
+    truth = (df_crosswalk['afdc_station_id'] + 1_000_000).astype(str) == df_crosswalk['location_id']
+    precision = truth.mean()
+    recall = truth.sum() / len(df_stations)
+    assert precision > 0.99 and recall > 0.95, f"{precision=:.3f}, {recall=:.3f}"
+
+
+if __name__ == '__main__':
+    test_similarities()
+    test_neighbors_told_apart()
+    test_recorded_location()
+    test_match_at_scale()
+    print("SUCCESS!")
@@ -0,0 +1,119 @@
+import os
+import tempfile
+from time import sleep
+
+import pandas as pd
+
+from evlens.data.ledger import ProgressLedger
+from evlens.data.plugshare import MainMapScraper
+from evlens.data.write_behind import WriteBehindUploader
+
+from test_mainmap_http_fetch import start_stand_in_server, TEST_LOCATION
+
+from evlens.logs import setup_logger
+logger = setup_logger(__name__)
+
+
+class FlakyWarehouse:
+    '''
+    Stand-in for `save_to_bigquery` that fails its first `num_failures` calls.
+    '''
+    def __init__(self, num_failures: int = 0):
+        self.num_failures = num_failures
+        self.saves = []
+        
+    def save(self, data: pd.DataFrame, table_name: str, merge_columns=None):
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise ConnectionError("Warehouse unavailable")
+        self.saves.append((table_name, len(data)))
+
+
+def make_rows(n: int, start: int = 0) -> pd.DataFrame:
+    return pd.DataFrame({'id': range(start, start + n), 'value': ['x'] * n})
+
+
+def test_batches_by_rows():
+    warehouse = FlakyWarehouse()
+    uploader = WriteBehindUploader(warehouse.save, flush_rows=10, flush_interval=60)
+    durable = []
+    for i in range(3):
+        uploader.submit(
+            [(make_rows(4, 4 * i), 'checkins', 'id')],
+            on_durable=lambda i=i: durable.append(i)
+        )
+    uploader.flush()
+    assert warehouse.saves == [('checkins', 12)], f"Buffered rows not saved together {warehouse.saves}"
+    assert sorted(durable) == [0, 1, 2], "Not every submission reported durable"
+    
+    uploader.submit([(make_rows(2), 'checkins', 'id'), (make_rows(3), 'evses', 'id')])
+    uploader.close()
+    assert sorted(warehouse.saves[1:]) == [('checkins', 2), ('evses', 3)], "Buffers not flushed on close"
+
+
+def test_outbox_spill_and_drain():
+    with tempfile.TemporaryDirectory() as directory:
+        warehouse = FlakyWarehouse(num_failures=1)
+        uploader = WriteBehindUploader(warehouse.save, outbox_path=directory, retry_interval=0.2)
+        durable = []
+        uploader.submit(
+            [(make_rows(5), 'stations', 'location_id'), (make_rows(7), 'evses', 'id')],
+            on_durable=lambda: durable.append('checkpoint')
+        )
+        uploader.flush()
+        assert durable == ['checkpoint'], "Spilled checkpoint should count as durable"
+        assert len(uploader.pending_outbox()) >= 1, "Failed save not spilled to the outbox"
+        
+        # Warehouse is back, so the outbox drains on the next retry
+        sleep(0.3)
+        uploader.flush()
+        assert uploader.pending_outbox() == [], "Outbox not drained on recovery"
+        assert sorted(warehouse.saves) == [('evses', 7), ('stations', 5)], f"Rows lost or repeated {warehouse.saves}"
+        uploader.close()
+
+
+class WriteBehindStandInScraper(MainMapScraper):
+    warehouse = None
+    
+    def save_to_bigquery(self, data, table_name, merge_columns='location_id'):
+        self.warehouse.save(data, table_name, merge_columns)
+
+
+def test_scraper_write_behind():
+    server = start_stand_in_server()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            s = WriteBehindStandInScraper(
+                timeout=3,
+                progress_bars=False,
+                fetch_mode='http',
+                api_base_url=f"http://127.0.0.1:{server.server_address[1]}/v3/",
+                ledger_path=os.path.join(directory, 'ledger.tsv'),
+                write_behind=True,
+                outbox_path=os.path.join(directory, 'outbox')
+            )
+            s.warehouse = FlakyWarehouse(num_failures=100)
+            df_stations, _, _ = s.run([TEST_LOCATION])
+            assert len(df_stations) == 1, "Location not scraped"
+            
+            # Warehouse was down the whole run, so the checkpoint should be waiting in the outbox
+            states = ProgressLedger(os.path.join(directory, 'ledger.tsv')).states()
+            assert states == {TEST_LOCATION: 'done'}, f"Checkpoint not marked done once durable {states}"
+            assert len(os.listdir(os.path.join(directory, 'outbox'))) == 3, "Checkpoint tables not in the outbox"
+            
+            # The next uploader to use the outbox drains it once the warehouse is back
+            s.warehouse.num_failures = 0
+            uploader = WriteBehindUploader(s.warehouse.save, outbox_path=os.path.join(directory, 'outbox'))
+            uploader.flush()
+            uploader.close()
+            assert {t for t, _ in s.warehouse.saves} == {'stations', 'checkins', 'evses'}, "Outbox not drained"
+            
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_batches_by_rows()
+    test_outbox_spill_and_drain()
+    test_scraper_write_behind()
+    print("SUCCESS!")